@@ -0,0 +1,139 @@
+import json
+import os
+import time
+from typing import Dict, Optional
+from urllib.parse import urljoin
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from SmartApi import SmartConnect
+import SmartApi.smartExceptions as ex
+from upstream import UPSTREAM_POOL_SIZE
+
+# Keep-alive connections to Angel One; one per upstream thread, so no call waits for a socket
+HTTP_POOL_SIZE = int(os.getenv("ANGEL_HTTP_POOL_SIZE", str(UPSTREAM_POOL_SIZE)))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("ANGEL_HTTP_CONNECT_TIMEOUT", "3"))
+# Failed connection attempts never reached the server, so they are retried for every route
+HTTP_CONNECT_RETRIES = int(os.getenv("ANGEL_HTTP_CONNECT_RETRIES", "2"))
+# Read-only routes are also retried after timeouts, dropped connections and gateway errors
+HTTP_READ_RETRIES = int(os.getenv("ANGEL_HTTP_READ_RETRIES", "2"))
+HTTP_BACKOFF = float(os.getenv("ANGEL_HTTP_BACKOFF", "0.2"))
+
+# SmartConnect routes without side effects (all of them are POSTs, so urllib3 cannot tell)
+READ_ROUTES = frozenset({
+    "api.ltp.data", "api.market.data", "api.candle.data", "api.oi.data", "api.search.scrip",
+    "api.user.profile", "api.order.book", "api.trade.book", "api.rms.limit", "api.holding",
+    "api.allholding", "api.position", "api.gtt.details", "api.gtt.list",
+})
+RETRY_STATUSES = frozenset({500, 502, 503, 504})
+
+
+class PooledSmartConnect(SmartConnect):
+    """
+    SmartConnect whose requests go through one keep-alive requests.Session instead of the
+    SDK's module-level requests.request (a new TCP + TLS handshake per call).
+    Read-only routes are retried with exponential backoff. `share_pool` reuses another
+    client's session and connections, so a new login does not start cold.
+    """
+
+    def __init__(self, *args, pool_size: int = HTTP_POOL_SIZE,
+                 share_pool: Optional["PooledSmartConnect"] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if share_pool is not None:
+            self.pool_size = share_pool.pool_size
+            self.retries = share_pool.retries
+            self.adapter = share_pool.adapter
+            self.reqsession = share_pool.reqsession
+            return
+        self.pool_size = pool_size
+        self.retries = 0
+        self.adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=HTTP_CONNECT_RETRIES, connect=HTTP_CONNECT_RETRIES, read=0, status=0,
+                              other=0, backoff_factor=HTTP_BACKOFF, raise_on_status=False),
+        )
+        self.reqsession = requests.Session()
+        self.reqsession.mount("https://", self.adapter)
+        self.reqsession.mount("http://", self.adapter)
+
+    def _request(self, route, method, parameters=None):
+        params = parameters.copy() if parameters else {}
+        url = urljoin(self.root, self._routes[route].format(**params))
+        headers = self.requestHeaders()
+        if self.access_token:
+            headers["Authorization"] = "Bearer {}".format(self.access_token)
+        body = json.dumps(params)
+
+        attempts = 1 + (HTTP_READ_RETRIES if route in READ_ROUTES else 0)
+        for attempt in range(attempts):
+            last = attempt + 1 >= attempts
+            try:
+                r = self.reqsession.request(
+                    method, url,
+                    data=body if method in ("POST", "PUT") else None,
+                    params=body if method in ("GET", "DELETE") else None,
+                    headers=headers,
+                    verify=not self.disable_ssl,
+                    allow_redirects=True,
+                    timeout=(HTTP_CONNECT_TIMEOUT, self.timeout),
+                    proxies=self.proxies,
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if last:
+                    raise
+            else:
+                if last or r.status_code not in RETRY_STATUSES:
+                    return self._parse_response(r, headers)
+            self.retries += 1
+            time.sleep(HTTP_BACKOFF * (2 ** attempt))
+
+    def _parse_response(self, r: requests.Response, headers: Dict):
+        """
+        Same handling as SmartConnect._request: SDK exception types, session expiry hook.
+        """
+        if "json" in headers["Content-type"]:
+            try:
+                data = json.loads(r.content.decode("utf8"))
+            except ValueError:
+                raise ex.DataException("Couldn't parse the JSON response received from the server: {content}".format(
+                    content=r.content))
+            if data.get("error_type"):
+                if self.session_expiry_hook and r.status_code == 403 and data["error_type"] == "TokenException":
+                    self.session_expiry_hook()
+                exp = getattr(ex, data["error_type"], ex.GeneralException)
+                raise exp(data["message"], code=r.status_code)
+            return data
+        elif "csv" in headers["Content-type"]:
+            return r.content
+        raise ex.DataException("Unknown Content-type ({content_type}) with response: ({content})".format(
+            content_type=headers["Content-type"], content=r.content))
+
+    def pool_stats(self) -> Dict:
+        requests_sent = opened = idle = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_sent += pool.num_requests
+            opened += pool.num_connections
+            # The LIFO queue is pre-filled with None placeholders for connections never opened
+            if pool.pool is not None:
+                idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        return {
+            "poolSize": self.pool_size,
+            "requests": requests_sent,
+            "connectionsOpened": opened,
+            "connectionsReused": max(0, requests_sent - opened),
+            "idleConnections": idle,
+            "retries": self.retries,
+        }
+
+
+def pool_stats(client) -> Optional[Dict]:
+    """
+    Pool statistics of a SmartConnect client, None for clients without a pool.
+    """
+    stats = getattr(client, "pool_stats", None)
+    return stats() if callable(stats) else None
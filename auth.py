@@ -1,11 +1,17 @@
-from SmartApi import SmartConnect
+import asyncio
+import jwt
 import pyotp
 import os
-from typing import Dict, Optional
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from upstream import run_blocking
+from angel_http import PooledSmartConnect
 
 class AngelOneAuth:
     """
     Handles authentication with Angel One SmartAPI.
+    Also acts as the session manager: only one login is ever in flight, and the
+    session is refreshed with the stored refreshToken before the JWT expires.
     """
     def __init__(self):
         self.api_key = os.getenv("ANGEL_API_KEY")
@@ -13,36 +19,163 @@ class AngelOneAuth:
         self.pin = os.getenv("ANGEL_PIN")
         self.totp_key = os.getenv("ANGEL_TOTP_KEY")
         self.smart_api = None
+        self.tokens: Optional[Dict] = None
+        # Epoch seconds at which the current JWT expires
+        self.expires_at: Optional[float] = None
+        self.login_timeout = float(os.getenv("LOGIN_TIMEOUT", "20"))
+        # Refresh this many seconds before expiry
+        self.refresh_margin = float(os.getenv("SESSION_REFRESH_MARGIN", "600"))
+        # Used when the JWT carries no exp claim
+        self.default_ttl = float(os.getenv("SESSION_DEFAULT_TTL", str(6 * 3600)))
+        # Called with (tokens, refreshed) after every successful login / refresh
+        self.listeners: List[Callable[[Dict, bool], None]] = []
+        self._lock: Optional[asyncio.Lock] = None
+        self._keeper_task: Optional[asyncio.Task] = None
 
-    def login(self) -> Dict:
+    @property
+    def has_credentials(self) -> bool:
+        return all([self.api_key, self.client_id, self.pin, self.totp_key])
+
+    def login(self) -> Tuple[PooledSmartConnect, Dict]:
         """
-        Logs in to Angel One and returns the session data including tokens.
+        Logs in to Angel One and returns the new client and its tokens.
+        Nothing is stored here: the caller commits them with `_commit` once it has the
+        result, so a login that finishes after its caller timed out changes nothing.
         """
         if not all([self.api_key, self.client_id, self.pin, self.totp_key]):
              raise ValueError("Missing Angel One credentials in environment variables.")
 
         try:
-            self.smart_api = SmartConnect(api_key=self.api_key)
+            # A new client over the current one's warm connection pool: in-flight calls keep
+            # the old session, and it is only replaced once the new one is up
+            current = self.smart_api if isinstance(self.smart_api, PooledSmartConnect) else None
+            client = PooledSmartConnect(api_key=self.api_key, share_pool=current)
             
             # Generate TOTP
             totp = pyotp.TOTP(self.totp_key).now()
             
             # Generate Session
-            data = self.smart_api.generateSession(self.client_id, self.pin, totp)
+            data = client.generateSession(self.client_id, self.pin, totp)
             
             if data['status'] == False:
                 raise Exception(f"Login Failed: {data['message']}")
                 
-            return {
-                "jwtToken": data['data']['jwtToken'],
-                "feedToken": data['data']['feedToken'],
-                "refreshToken": data['data']['refreshToken']
-            }
+            return client, self._tokens(data['data']['jwtToken'], data['data']['feedToken'], data['data']['refreshToken'])
         except Exception as e:
             print(f"Authentication Error: {e}")
             raise e
 
+    def refresh_session(self) -> Dict:
+        """
+        Renews the JWT and feed token using the stored refreshToken, without a TOTP login.
+        Returns the new tokens for the caller to commit, like `login`.
+        """
+        if not self.smart_api or not self.tokens:
+            raise ValueError("No session to refresh.")
+
+        data = self.smart_api.generateToken(self.tokens["refreshToken"])
+        if not data or data.get('status') == False:
+            raise Exception(f"Token refresh failed: {data.get('message') if data else 'empty response'}")
+
+        refresh_token = data['data'].get('refreshToken') or self.tokens["refreshToken"]
+        return self._tokens(data['data']['jwtToken'], data['data']['feedToken'], refresh_token)
+
+    @staticmethod
+    def _tokens(jwt_token: str, feed_token: str, refresh_token: str) -> Dict:
+        return {
+            "jwtToken": jwt_token,
+            "feedToken": feed_token,
+            "refreshToken": refresh_token
+        }
+
+    def _commit(self, client, tokens: Dict):
+        self.smart_api = client
+        self.tokens = tokens
+        self.expires_at = self.token_expiry(tokens["jwtToken"]) or time.time() + self.default_ttl
+
+    @staticmethod
+    def token_expiry(jwt_token: str) -> Optional[float]:
+        """
+        Reads the exp claim of the JWT (signature is not verified, we only need the timestamp).
+        """
+        try:
+            raw = jwt_token.split(" ", 1)[-1]  # login returns "Bearer <token>"
+            claims = jwt.decode(raw, options={"verify_signature": False})
+            return float(claims["exp"]) if "exp" in claims else None
+        except Exception:
+            return None
+
+    def session_valid(self) -> bool:
+        return self.smart_api is not None and self.expires_at is not None and time.time() < self.expires_at
+
+    def _notify(self, refreshed: bool):
+        for listener in self.listeners:
+            try:
+                listener(self.tokens, refreshed)
+            except Exception as e:
+                print(f"Session listener error: {e}")
+
+    async def ensure_session(self, force: bool = False):
+        """
+        Single-flight login: concurrent callers wait for the one login in progress
+        instead of starting their own.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        if not force and self.session_valid():
+            return self.smart_api
+
+        async with self._lock:
+            # Another caller may have logged in while we waited
+            if force or not self.session_valid():
+                client, tokens = await run_blocking(self.login, timeout=self.login_timeout)
+                self._commit(client, tokens)
+                self._notify(False)
+        return self.smart_api
+
+    async def refresh(self):
+        """
+        Proactive refresh via refreshToken, falling back to a full login if it fails.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            try:
+                tokens = await run_blocking(self.refresh_session, timeout=self.login_timeout)
+                self._commit(self.smart_api, tokens)
+                self._notify(True)
+                return
+            except Exception as e:
+                print(f"Session refresh failed, logging in again: {e}")
+        await self.ensure_session(force=True)
+
+    async def run_session_keeper(self):
+        """
+        Background task: logs in at startup and keeps the session fresh, so request
+        handlers never pay login latency.
+        """
+        while True:
+            try:
+                if not self.session_valid():
+                    await self.ensure_session()
+                else:
+                    await self.refresh()
+                delay = self.expires_at - self.refresh_margin - time.time()
+            except Exception as e:
+                print(f"Session keeper error: {e}")
+                delay = 60
+            await asyncio.sleep(max(30.0, delay))
+
+    def start_session_keeper(self):
+        if not self.has_credentials:
+            print("Angel One credentials not configured, session keeper not started")
+            return
+        if self._keeper_task is None or self._keeper_task.done():
+            self._keeper_task = asyncio.create_task(self.run_session_keeper())
+
     def get_smart_api_instance(self):
         if not self.smart_api:
-             self.login()
+             self._commit(*self.login())
         return self.smart_api
@@ -0,0 +1,156 @@
+import os
+from array import array
+from datetime import date, datetime
+from typing import Dict, List, Optional
+from market_hours import IST, SESSION_OPEN, SESSION_CLOSE, MarketCalendar, market_calendar
+
+# Seconds per Angel One intraday interval
+INTERVAL_SECONDS = {
+    "ONE_MINUTE": 60,
+    "THREE_MINUTE": 180,
+    "FIVE_MINUTE": 300,
+    "TEN_MINUTE": 600,
+    "FIFTEEN_MINUTE": 900,
+    "THIRTY_MINUTE": 1800,
+    "ONE_HOUR": 3600,
+}
+
+
+class BarRing:
+    """
+    Fixed-size ring of OHLCV bars for one symbol and interval, stored in flat arrays.
+    """
+    __slots__ = ("capacity", "start", "open", "high", "low", "close", "volume", "head", "count")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.start = array("q", [0] * capacity)
+        self.open = array("d", [0.0] * capacity)
+        self.high = array("d", [0.0] * capacity)
+        self.low = array("d", [0.0] * capacity)
+        self.close = array("d", [0.0] * capacity)
+        self.volume = array("q", [0] * capacity)
+        self.head = -1  # index of the newest bar
+        self.count = 0
+
+    def update(self, bar_start: int, price: float, volume: int):
+        head = self.head
+        if self.count and self.start[head] == bar_start:
+            if price > self.high[head]:
+                self.high[head] = price
+            if price < self.low[head]:
+                self.low[head] = price
+            self.close[head] = price
+            self.volume[head] += volume
+            return
+        if self.count and bar_start < self.start[head]:
+            return  # late tick for an already closed bar
+
+        head = (head + 1) % self.capacity
+        self.head = head
+        self.count = min(self.count + 1, self.capacity)
+        self.start[head] = bar_start
+        self.open[head] = self.high[head] = self.low[head] = self.close[head] = price
+        self.volume[head] = volume
+
+    def rows(self) -> List[List]:
+        """
+        Bars oldest first, as [timestamp, open, high, low, close, volume] like getCandleData.
+        """
+        result = []
+        for offset in range(self.count - 1, -1, -1):
+            i = (self.head - offset) % self.capacity
+            ts = datetime.fromtimestamp(self.start[i], IST).isoformat()
+            result.append([ts, self.open[i], self.high[i], self.low[i], self.close[i], self.volume[i]])
+        return result
+
+
+class BarAggregator:
+    """
+    Builds the current session's intraday bars from the LTP / cumulative volume the
+    backend already receives, so today's part of a chart needs no upstream call.
+    Bars are kept per token and interval in rings sized for one full session.
+    Only trading-day ticks inside the session make bars; pre-open observations only set
+    the volume baseline, so every bar's volume is an increase we actually saw.
+    """
+
+    def __init__(self, intervals: Optional[List[str]] = None, calendar: MarketCalendar = market_calendar):
+        if intervals is None:
+            raw = os.getenv("BAR_INTERVALS", "ONE_MINUTE,FIVE_MINUTE,FIFTEEN_MINUTE")
+            intervals = [i.strip() for i in raw.split(",") if i.strip() in INTERVAL_SECONDS]
+        self.intervals = intervals
+        self.calendar = calendar
+        session_seconds = (SESSION_CLOSE.hour * 60 + SESSION_CLOSE.minute - SESSION_OPEN.hour * 60 - SESSION_OPEN.minute) * 60
+        self.capacity = {i: session_seconds // INTERVAL_SECONDS[i] + 1 for i in intervals}
+        self.session_day: Optional[date] = None
+        self._session_open = 0
+        self._session_close = 0
+        self._rings: Dict[str, Dict[str, BarRing]] = {}
+        self._last_volume: Dict[str, int] = {}
+        # Tokens with a pre-open volume baseline whose first session tick fell in the first bar
+        self._complete: Dict[str, Dict[str, bool]] = {}
+
+    def _start_session(self, day: date):
+        self.session_day = day
+        self._session_open = int(datetime.combine(day, SESSION_OPEN, tzinfo=IST).timestamp())
+        self._session_close = int(datetime.combine(day, SESSION_CLOSE, tzinfo=IST).timestamp())
+        self._rings = {}
+        self._last_volume = {}
+        self._complete = {}
+
+    def on_tick(self, token: str, price: float, cumulative_volume: Optional[int], ts: Optional[float] = None):
+        """
+        Feeds one observation. `cumulative_volume` is the day's traded volume so far, or
+        None when it is not a live figure (e.g. filled in from the daily volume cache);
+        each bar gets the increase since the previous live figure.
+        """
+        now = datetime.now(IST) if ts is None else datetime.fromtimestamp(ts, IST)
+        day = now.date()
+        if price is None or not self.calendar.is_trading_day(day):
+            return
+        if day != self.session_day:
+            self._start_session(day)
+
+        seconds = int(now.timestamp())
+        if seconds >= self._session_close:
+            return
+        if seconds < self._session_open:
+            # Pre-open: no bars, the last figure before the open is the volume baseline
+            if cumulative_volume is not None:
+                self._last_volume[token] = cumulative_volume
+            return
+
+        previous = self._last_volume.get(token)
+        volume = 0
+        if cumulative_volume is not None:
+            if previous is not None:
+                volume = max(0, cumulative_volume - previous)
+            self._last_volume[token] = cumulative_volume
+
+        rings = self._rings.get(token)
+        if rings is None:
+            rings = self._rings[token] = {i: BarRing(self.capacity[i]) for i in self.intervals}
+            # Without a baseline from before the open, the first bar's volume is unknown
+            self._complete[token] = {
+                i: previous is not None and seconds < self._session_open + INTERVAL_SECONDS[i]
+                for i in self.intervals
+            }
+
+        for interval, ring in rings.items():
+            step = INTERVAL_SECONDS[interval]
+            bar_start = self._session_open + (seconds - self._session_open) // step * step
+            ring.update(bar_start, float(price), volume)
+
+    def session_bars(self, token: str, interval: str, day: date) -> Optional[List[List]]:
+        """
+        Today's bars for a token, or None when they are not available in full
+        (interval not aggregated, different day, started mid-session or no live volume before the open).
+        """
+        if day != self.session_day or interval not in self.intervals:
+            return None
+        if not self._complete.get(token, {}).get(interval):
+            return None
+        return self._rings[token][interval].rows()
+
+
+bar_aggregator = BarAggregator()
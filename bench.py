@@ -0,0 +1,451 @@
+"""
+Benchmarks for the stream, history, search and screener paths.
+Runs the FastAPI app in-process against FakeSmartConnect (fake_smartapi.py), so no
+credentials or network are needed, and prints the results as JSON.
+
+    python bench.py                                  # full run, JSON on stdout
+    python bench.py --quick --output bench.json      # smaller sizes
+    python bench.py --latency 0.05 --error-rate 0.01 --only ws,search
+
+Suites:
+    ws               /ws end-to-end tick latency (feed tick -> client frame) and fan-out, 1 / 100 / 1000 clients
+    market_strength  snapshot cycle time and GET /market-strength with 26 / 500 / 5000 symbols
+    stock_history    /stock-history throughput on an empty candle store (cold), then again (warm)
+    search           /search latency percentiles over the instrument index
+    screener         universe scan time and /screener top-N latency over the indexes
+
+Angel One's rate limits are lifted by default so the numbers reflect the backend itself;
+--rate-limits keeps them. Needs httpx for the in-process HTTP client.
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+FULL_SIZES = {"clients": [1, 100, 1000], "symbols": [26, 500, 5000], "rounds": 20, "history_symbols": 50, "search_queries": 2000, "screener_queries": 2000}
+QUICK_SIZES = {"clients": [1, 10, 100], "symbols": [26, 500], "rounds": 5, "history_symbols": 10, "search_queries": 300, "screener_queries": 300}
+
+
+def summarize(samples: List[float]) -> Dict:
+    """
+    Latency summary in milliseconds (nearest-rank percentiles).
+    """
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pct(q):
+        return round(ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50": pct(0.50),
+        "p95": pct(0.95),
+        "p99": pct(0.99),
+        "max": round(ordered[-1] * 1000, 3)
+    }
+
+
+def configure_env(args, workdir: str):
+    """
+    Must run before the app modules are imported: they read their settings at import time.
+    """
+    os.environ["CANDLE_DB_PATH"] = os.path.join(workdir, "candles.db")
+    os.environ["WATCHLIST_PATH"] = os.path.join(workdir, "watchlists.json")
+    os.environ["INSTRUMENT_FILE"] = os.path.join(workdir, "OpenAPIScripMaster.json")
+    os.environ["FEED_ENABLED"] = "false"
+    os.environ.pop("RECORD_FILE", None)
+    os.environ.pop("REPLAY_FILE", None)
+    # Full-rate producer whatever the time of day
+    os.environ["MARKET_HOURS_AWARE"] = "false"
+    # Cycles are driven by the injected ticks, not the regular interval
+    os.environ.setdefault("STREAM_INTERVAL", "60")
+    # Keeps the tick history inside its budget with thousands of symbols
+    os.environ.setdefault("TICK_HISTORY_ROWS", "256")
+    if not args.rate_limits:
+        for method in ("LTPDATA", "GETMARKETDATA", "GETCANDLEDATA", "SEARCHSCRIP"):
+            os.environ[f"UPSTREAM_RATE_{method}"] = "1000000"
+
+
+def raise_fd_limit():
+    # 1000 clients plus their server-side sockets exceed the usual soft limit of 1024
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+# --- /ws ----------------------------------------------------------------------
+
+class _Round:
+    def __init__(self):
+        self.expected = None
+        self.started = 0.0
+        self.received: Dict[int, float] = {}
+        self.target = 0
+        self.done = asyncio.Event()
+
+
+async def _ws_reader(index: int, ws, marker: str, state: _Round):
+    try:
+        async for message in ws:
+            frame = json.loads(message)
+            for entry in frame:
+                if entry.get("symbol") == marker and entry.get("ltp") == state.expected and index not in state.received:
+                    state.received[index] = time.perf_counter() - state.started
+                    if len(state.received) >= state.target:
+                        state.done.set()
+    except Exception:
+        pass
+
+
+async def bench_ws(app, manager, client_counts: List[int], rounds: int) -> List[Dict]:
+    """
+    Injects one SNAP_QUOTE tick per tracked token through the feed path and measures
+    how long each client takes to receive the frame carrying the marker symbol's new LTP.
+    """
+    import uvicorn
+    import websockets
+    from fake_smartapi import fake_snap_quote
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    loop = asyncio.get_running_loop()
+    manager._feed_loop = loop
+    manager.start_producer()
+    rng = random.Random(1)
+    token_map = dict(manager.token_map)
+    marker, marker_token = next(iter(token_map.items()))
+    url = f"ws://127.0.0.1:{port}/ws"
+    spacing = manager.min_stream_interval + 0.05
+    results = []
+    price = 100000
+
+    try:
+        for count in client_counts:
+            clients = []
+            for start in range(0, count, 100):
+                batch = [websockets.connect(url, max_size=None, open_timeout=30) for _ in range(start, min(count, start + 100))]
+                clients.extend(await asyncio.gather(*batch))
+
+            state = _Round()
+            state.target = count
+            readers = [asyncio.create_task(_ws_reader(i, ws, marker, state)) for i, ws in enumerate(clients)]
+            await asyncio.sleep(spacing)
+
+            latencies: List[float] = []
+            fanout: List[float] = []
+            delivered = 0
+            for _ in range(rounds):
+                price += 1
+                state.expected = price / 100.0
+                state.received = {}
+                state.done.clear()
+                state.started = time.perf_counter()
+                for symbol, token in token_map.items():
+                    ltp = price if token == marker_token else rng.randint(10000, 500000)
+                    manager.order_books.publish_threadsafe(loop, fake_snap_quote(token, ltp, rng))
+                try:
+                    await asyncio.wait_for(state.done.wait(), 10)
+                except asyncio.TimeoutError:
+                    pass
+                received = list(state.received.values())
+                delivered += len(received)
+                latencies.extend(received)
+                if received:
+                    fanout.append(len(received) / max(received))
+                await asyncio.sleep(spacing)
+
+            for task in readers:
+                task.cancel()
+            await asyncio.gather(*[ws.close() for ws in clients], return_exceptions=True)
+            await asyncio.sleep(0.2)
+
+            results.append({
+                "clients": count,
+                "rounds": rounds,
+                "symbols": len(token_map),
+                "tickLatencyMs": summarize(latencies),
+                "deliveredRatio": round(delivered / (count * rounds), 4),
+                "fanoutFramesPerSecond": round(sorted(fanout)[len(fanout) // 2], 1) if fanout else 0,
+                "stream": manager.stream_stats()
+            })
+    finally:
+        for task in (manager._producer_task, manager._volume_task):
+            if task is not None:
+                task.cancel()
+        server.should_exit = True
+        await serve_task
+    return results
+
+
+# --- /market-strength ---------------------------------------------------------
+
+def universe(defaults: Dict[str, str], size: int) -> Dict[str, str]:
+    symbols = dict(list(defaults.items())[:size])
+    i = 0
+    while len(symbols) < size:
+        symbols[f"SYM{i}.BSE"] = str(500000 + i)
+        i += 1
+    return symbols
+
+
+async def bench_market_strength(client, manager, fake, sizes: List[int], cycles: int, workdir: str) -> List[Dict]:
+    """
+    Times the producer's snapshot cycle (quotes + analysis + diff + fan-out) over REST
+    quotes, and the /market-strength response that serves it.
+    """
+    from watchlist import WatchlistStore
+
+    results = []
+    for size in sizes:
+        manager.watchlists = WatchlistStore(universe(manager.DEFAULT_TOKEN_MAP, size), os.path.join(workdir, f"watchlists-{size}.json"))
+        # Pushed books would bypass the REST path being measured
+        manager.order_books.books.clear()
+        manager.last_quotes.clear()
+        manager.latest_calculated_data = []
+
+        await manager.produce_snapshot()  # warm-up
+        calls_before = sum(fake.calls.values())
+        cycle_times, endpoint_times = [], []
+        stale = 0
+        for _ in range(cycles):
+            started = time.perf_counter()
+            snapshot = await manager.produce_snapshot()
+            cycle_times.append(time.perf_counter() - started)
+            stale += sum(1 for entry in snapshot if entry.get("stale"))
+
+            started = time.perf_counter()
+            res = await client.get("/market-strength")
+            res.raise_for_status()
+            endpoint_times.append(time.perf_counter() - started)
+
+        results.append({
+            "symbols": size,
+            "cycles": cycles,
+            "cycleMs": summarize(cycle_times),
+            "endpointMs": summarize(endpoint_times),
+            "upstreamCallsPerCycle": round((sum(fake.calls.values()) - calls_before) / cycles, 2),
+            "staleRatio": round(stale / (size * cycles), 4)
+        })
+    return results
+
+
+# --- /stock-history -----------------------------------------------------------
+
+async def _timed_requests(client, paths: List[str], concurrency: int) -> Dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(path):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            res = await client.get(path)
+            latencies.append(time.perf_counter() - started)
+            if res.status_code != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(p) for p in paths])
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(paths),
+        "errors": errors,
+        "requestsPerSecond": round(len(paths) / elapsed, 2),
+        "latencyMs": summarize(latencies)
+    }
+
+
+async def bench_stock_history(client, instruments: List[Dict], count: int, interval: str, days: int, concurrency: int) -> Dict:
+    from candle_store import candle_store
+
+    symbols = sorted({item["symbol"] for item in instruments})[:count]
+    paths = [f"/stock-history/{symbol}?interval={interval}&days={days}" for symbol in symbols]
+    cold = await _timed_requests(client, paths, concurrency)
+    warm = await _timed_requests(client, paths, concurrency)
+    return {
+        "interval": interval,
+        "days": days,
+        "concurrency": concurrency,
+        "cold": cold,
+        "warm": warm,
+        "store": {"hits": candle_store.hits, "misses": candle_store.misses}
+    }
+
+
+# --- /search ------------------------------------------------------------------
+
+async def bench_search(client, index, instruments: List[Dict], count: int) -> Dict:
+    rng = random.Random(3)
+    queries = []
+    for _ in range(count):
+        symbol = rng.choice(instruments)["symbol"]
+        queries.append(symbol[:rng.randint(1, min(6, len(symbol)))])
+
+    http_times, index_times = [], []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query)
+        index_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        res = await client.get("/search", params={"query": query})
+        res.raise_for_status()
+        http_times.append(time.perf_counter() - started)
+
+    return {"instruments": len(instruments), "queries": count, "httpMs": summarize(http_times), "indexMs": summarize(index_times)}
+
+
+# --- /screener ----------------------------------------------------------------
+
+async def bench_screener(client, screener, count: int) -> Dict:
+    started = time.perf_counter()
+    await screener.scan_universe()
+    scan_seconds = time.perf_counter() - started
+
+    queries = [
+        {"sort": "strengthPercent", "limit": 20},
+        {"sort": "tradedVolume", "limit": 50, "filters": ["sentiment=Bullish"]},
+        {"sort": "ofi", "order": "asc", "limit": 20, "filters": ["tradedVolume>1000000"]},
+        {"sort": "buyPercent", "limit": 100, "filters": ["buyPercent>=60", "ltp<2000"]},
+    ]
+    http_times, index_times = [], []
+    for i in range(count):
+        params = queries[i % len(queries)]
+        started = time.perf_counter()
+        screener.query(params["sort"], params.get("order", "desc"), params["limit"], params.get("filters", []))
+        index_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        res = await client.get("/screener", params=params)
+        res.raise_for_status()
+        http_times.append(time.perf_counter() - started)
+
+    return {
+        "universe": len(screener.index),
+        "scanSeconds": round(scan_seconds, 3),
+        "queries": count,
+        "httpMs": summarize(http_times),
+        "indexMs": summarize(index_times),
+    }
+
+
+# --- Runner -------------------------------------------------------------------
+
+async def run(args, workdir: str) -> Dict:
+    import httpx
+    from fake_smartapi import FakeSmartConnect, fake_instruments
+
+    server = importlib.import_module("main")
+    manager = server.socket_manager
+    sizes = QUICK_SIZES if args.quick else FULL_SIZES
+    suites = set(args.only.split(",")) if args.only else {"ws", "market_strength", "stock_history", "search", "screener"}
+
+    fake = FakeSmartConnect(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=42)
+    # Looks like a logged-in session, so ensure_api_connected never tries a real login
+    server.angel_auth.smart_api = fake
+    server.angel_auth.expires_at = time.time() + 86400
+    manager.set_api_instance(fake)
+
+    instruments = fake_instruments(args.instruments)
+    server.instrument_index.build(instruments)
+
+    results: Dict = {}
+    if "ws" in suites:
+        results["ws"] = await bench_ws(server.app, manager, sizes["clients"], sizes["rounds"])
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        if "market_strength" in suites:
+            results["marketStrength"] = await bench_market_strength(client, manager, fake, sizes["symbols"], sizes["rounds"], workdir)
+        if "stock_history" in suites:
+            results["stockHistory"] = await bench_stock_history(client, instruments, sizes["history_symbols"], args.interval, args.days, args.concurrency)
+        if "search" in suites:
+            results["search"] = await bench_search(client, server.instrument_index, instruments, sizes["search_queries"])
+        if "screener" in suites:
+            results["screener"] = await bench_screener(client, server.screener, sizes["screener_queries"])
+
+    results["upstream"] = server.upstream.stats()
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="In-process benchmarks against a fake SmartConnect")
+    parser.add_argument("--quick", action="store_true", help="smaller client / symbol counts")
+    parser.add_argument("--only", help="comma-separated suites: ws,market_strength,stock_history,search,screener")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake upstream latency per call, seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="extra random latency per call, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls that fail")
+    parser.add_argument("--rate-limits", action="store_true", help="keep Angel One's per-endpoint rate limits")
+    parser.add_argument("--instruments", type=int, default=60000, help="size of the fake instrument master")
+    parser.add_argument("--interval", default="ONE_DAY", help="/stock-history interval")
+    parser.add_argument("--days", type=int, default=365, help="/stock-history range")
+    parser.add_argument("--concurrency", type=int, default=10, help="concurrent /stock-history requests")
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    return parser.parse_args()
+
+
+def cli():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    configure_env(args, workdir)
+    raise_fd_limit()
+
+    started = time.time()
+    # App logging goes to stderr so stdout stays valid JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        results = asyncio.run(run(args, workdir))
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "startedAt": started,
+            "durationSeconds": round(time.time() - started, 2),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": vars(args)
+        },
+        "results": results
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    cli()
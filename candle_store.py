@@ -0,0 +1,237 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from market_hours import MarketCalendar, market_calendar
+
+# Upstream responses that include the still-changing session are reused this long
+LIVE_TTL = float(os.getenv("CANDLE_LIVE_TTL", "30"))
+# Worker processes share the database file: writers wait this long for each other's locks
+BUSY_TIMEOUT = float(os.getenv("CANDLE_DB_BUSY_TIMEOUT", "10"))
+
+
+class CandleStore:
+    """
+    Persistent SQLite candle store keyed by (token, interval).
+    Requests are served locally; only day ranges that were never fetched, plus the
+    current (still changing) session, go upstream, and the latter at most once per
+    LIVE_TTL per range. Large ranges are split into
+    chunks that respect Angel One's per-request limits and fetched in parallel.
+    """
+    # Maximum number of days per getCandleData request, per interval
+    MAX_DAYS_PER_REQUEST = {
+        "ONE_MINUTE": 30,
+        "THREE_MINUTE": 60,
+        "FIVE_MINUTE": 100,
+        "TEN_MINUTE": 100,
+        "FIFTEEN_MINUTE": 200,
+        "THIRTY_MINUTE": 200,
+        "ONE_HOUR": 400,
+        "ONE_DAY": 2000
+    }
+
+    def __init__(self, path: Optional[str] = None, calendar: MarketCalendar = market_calendar):
+        self.path = path or os.getenv("CANDLE_DB_PATH", "candles.db")
+        self.calendar = calendar
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS candles ("
+            "token TEXT, interval TEXT, ts TEXT, open REAL, high REAL, low REAL, close REAL, volume INTEGER, "
+            "PRIMARY KEY (token, interval, ts)) WITHOUT ROWID"
+        )
+        # Day ranges (inclusive) that were fully fetched and can no longer change
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS coverage (token TEXT, interval TEXT, from_day TEXT, to_day TEXT)"
+        )
+        self._conn.commit()
+        # (token, interval, from_day, to_day) -> expiry of fetched days that are still live
+        self._live: Dict[Tuple[str, str, date, date], float] = {}
+        self.hits = 0
+        self.misses = 0
+
+    # --- Coverage bookkeeping -------------------------------------------------
+
+    def _load_coverage(self, token: str, interval: str) -> List[Tuple[date, date]]:
+        rows = self._conn.execute(
+            "SELECT from_day, to_day FROM coverage WHERE token = ? AND interval = ? ORDER BY from_day",
+            (token, interval)
+        ).fetchall()
+        return [(date.fromisoformat(a), date.fromisoformat(b)) for a, b in rows]
+
+    def _save_coverage(self, token: str, interval: str, ranges: List[Tuple[date, date]]):
+        # Merge overlapping / adjacent ranges before rewriting
+        merged: List[Tuple[date, date]] = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1] + timedelta(days=1):
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+
+        self._conn.execute("DELETE FROM coverage WHERE token = ? AND interval = ?", (token, interval))
+        self._conn.executemany(
+            "INSERT INTO coverage VALUES (?, ?, ?, ?)",
+            [(token, interval, a.isoformat(), b.isoformat()) for a, b in merged]
+        )
+
+    @staticmethod
+    def missing_ranges(start: date, end: date, covered: List[Tuple[date, date]]) -> List[Tuple[date, date]]:
+        """
+        Parts of [start, end] not contained in the (sorted) covered ranges.
+        """
+        gaps = []
+        cursor = start
+        for a, b in covered:
+            if b < cursor:
+                continue
+            if a > end:
+                break
+            if a > cursor:
+                gaps.append((cursor, min(end, a - timedelta(days=1))))
+            cursor = max(cursor, b + timedelta(days=1))
+            if cursor > end:
+                break
+        if cursor <= end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def split_range(self, start: date, end: date, interval: str) -> List[Tuple[date, date]]:
+        step = self.MAX_DAYS_PER_REQUEST.get(interval, 30)
+        chunks = []
+        while start <= end:
+            chunk_end = min(end, start + timedelta(days=step - 1))
+            chunks.append((start, chunk_end))
+            start = chunk_end + timedelta(days=1)
+        return chunks
+
+    def last_final_day(self) -> date:
+        """
+        Latest day whose candles can no longer change: today once its session is over,
+        or all day when it is a weekend / holiday.
+        """
+        now = self.calendar.now()
+        today = now.date()
+        if not self.calendar.is_trading_day(today) or now >= self.calendar.session_close(today):
+            return today
+        return today - timedelta(days=1)
+
+    def stable_seconds(self, end: date) -> float:
+        """
+        How long a window ending on `end` keeps returning the same candles: until midnight
+        once `end` is final (then the window moves), otherwise the live-session TTL.
+        """
+        if end > self.last_final_day():
+            return LIVE_TTL
+        now = self.calendar.now()
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=now.tzinfo)
+        return (midnight - now).total_seconds()
+
+    # Live entries are keyed by the non-final part of a chunk: after the first fetch the
+    # final days are covered, so the next plan asks for exactly that part again
+    def _live_fresh(self, token: str, interval: str, chunk: Tuple[date, date], last_final: date, now: float) -> bool:
+        expires = self._live.get((token, interval, max(chunk[0], last_final + timedelta(days=1)), chunk[1]))
+        return expires is not None and expires > now
+
+    def _mark_live(self, token: str, interval: str, chunk: Tuple[date, date], last_final: date, now: float):
+        if len(self._live) > 4096:
+            self._live = {key: expires for key, expires in self._live.items() if expires > now}
+        self._live[(token, interval, max(chunk[0], last_final + timedelta(days=1)), chunk[1])] = now + LIVE_TTL
+
+    # --- Storage --------------------------------------------------------------
+
+    def _read(self, token: str, interval: str, start: date, end: date) -> List[List]:
+        rows = self._conn.execute(
+            "SELECT ts, open, high, low, close, volume FROM candles "
+            "WHERE token = ? AND interval = ? AND ts >= ? AND ts < ? ORDER BY ts",
+            (token, interval, start.isoformat(), (end + timedelta(days=1)).isoformat())
+        ).fetchall()
+        return [list(row) for row in rows]
+
+    def _write(self, token: str, interval: str, candles: List[List], covered: List[Tuple[date, date]]):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(token, interval, c[0], c[1], c[2], c[3], c[4], c[5]) for c in candles]
+        )
+        if covered:
+            self._save_coverage(token, interval, self._load_coverage(token, interval) + covered)
+        self._conn.commit()
+
+    def _plan(self, token: str, interval: str, start: date, end: date) -> List[Tuple[date, date]]:
+        with self._lock:
+            return self.missing_ranges(start, end, self._load_coverage(token, interval))
+
+    def _store(self, token: str, interval: str, candles: List[List], covered: List[Tuple[date, date]]):
+        with self._lock:
+            self._write(token, interval, candles, covered)
+
+    def _load(self, token: str, interval: str, start: date, end: date) -> List[List]:
+        with self._lock:
+            return self._read(token, interval, start, end)
+
+    # --- Public API -----------------------------------------------------------
+
+    async def get_candles(
+        self,
+        fetch: Callable[[Dict], Awaitable[Optional[Dict]]],
+        token: str,
+        interval: str,
+        start: date,
+        end: date,
+        exchange: str = "BSE"
+    ) -> List[List]:
+        """
+        Returns [timestamp, open, high, low, close, volume] rows for [start, end].
+        `fetch` performs one getCandleData request asynchronously.
+        """
+        gaps = await asyncio.to_thread(self._plan, token, interval, start, end)
+        chunks = [chunk for gap in gaps for chunk in self.split_range(gap[0], gap[1], interval)]
+        last_final = self.last_final_day()
+        now = time.monotonic()
+        # Live-session chunks fetched within LIVE_TTL are already in the table
+        chunks = [c for c in chunks if not (c[1] > last_final and self._live_fresh(token, interval, c, last_final, now))]
+        if not chunks:
+            self.hits += 1
+            return await asyncio.to_thread(self._load, token, interval, start, end)
+
+        self.misses += 1
+
+        async def fetch_chunk(chunk_start: date, chunk_end: date):
+            historicParam={
+                "exchange": exchange,
+                "symboltoken": token,
+                "interval": interval,
+                "fromdate": f"{chunk_start.isoformat()} 00:00",
+                "todate": f"{chunk_end.isoformat()} 23:59"
+            }
+            try:
+                return await fetch(historicParam)
+            except Exception as e:
+                print(f"Candle fetch error for {token} {chunk_start}..{chunk_end}: {e}")
+                return None
+
+        results = await asyncio.gather(*[fetch_chunk(a, b) for a, b in chunks])
+
+        candles: List[List] = []
+        covered: List[Tuple[date, date]] = []
+        for (chunk_start, chunk_end), res in zip(chunks, results):
+            if not res or not res.get('status'):
+                continue
+            candles.extend(res.get('data') or [])
+            if chunk_end > last_final:
+                self._mark_live(token, interval, (chunk_start, chunk_end), last_final, now)
+            # Only days that can no longer change are marked as covered
+            final_end = min(chunk_end, last_final)
+            if chunk_start <= final_end:
+                covered.append((chunk_start, final_end))
+
+        await asyncio.to_thread(self._store, token, interval, candles, covered)
+        return await asyncio.to_thread(self._load, token, interval, start, end)
+
+
+# Replayed responses are matched loosely (see recorder.ReplayApi), so in replay mode they
+# go to a throwaway in-memory store and never mark ranges covered in the real database
+candle_store = CandleStore(":memory:" if os.getenv("REPLAY_FILE") else None)
@@ -0,0 +1,137 @@
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from market_hours import IST
+
+# Bar length per getCandleData interval, in minutes
+INTERVAL_MINUTES = {
+    "ONE_MINUTE": 1,
+    "THREE_MINUTE": 3,
+    "FIVE_MINUTE": 5,
+    "TEN_MINUTE": 10,
+    "FIFTEEN_MINUTE": 15,
+    "THIRTY_MINUTE": 30,
+    "ONE_HOUR": 60,
+    "ONE_DAY": 1440,
+}
+
+
+class FakeSmartConnect:
+    """
+    In-process stand-in for SmartConnect with the same response shapes,
+    injectable latency and error rate. Used by bench.py.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls: Dict[str, int] = {}
+
+    def _simulate(self, method: str):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        delay = self.latency + self.random.uniform(0, self.jitter) if self.jitter else self.latency
+        if delay > 0:
+            time.sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise Exception(f"Injected upstream error in {method}")
+
+    def _price(self, token: str) -> float:
+        # Stable per token, with a little noise per call
+        base = 100 + (int(token) % 5000) if token.isdigit() else 500
+        return round(base * (1 + self.random.uniform(-0.002, 0.002)), 2)
+
+    def _depth(self, ltp: float) -> Dict:
+        return {
+            "buy": [{"price": round(ltp - 0.05 * (i + 1), 2), "quantity": self.random.randint(1, 5000), "orders": self.random.randint(1, 20)} for i in range(5)],
+            "sell": [{"price": round(ltp + 0.05 * (i + 1), 2), "quantity": self.random.randint(1, 5000), "orders": self.random.randint(1, 20)} for i in range(5)],
+        }
+
+    # --- SmartConnect surface -------------------------------------------------
+
+    def generateSession(self, clientCode, password, totp):
+        self._simulate("generateSession")
+        return {"status": True, "data": {"jwtToken": "Bearer fake", "feedToken": "fake", "refreshToken": "fake"}}
+
+    def generateToken(self, refresh_token):
+        self._simulate("generateToken")
+        return {"status": True, "data": {"jwtToken": "fake", "feedToken": "fake", "refreshToken": refresh_token}}
+
+    def ltpData(self, exchange, tradingsymbol, symboltoken):
+        self._simulate("ltpData")
+        return {"status": True, "data": {"exchange": exchange, "tradingsymbol": tradingsymbol, "symboltoken": symboltoken, "ltp": self._price(symboltoken)}}
+
+    def getMarketData(self, mode, exchangeTokens):
+        self._simulate("getMarketData")
+        fetched = []
+        for exchange, tokens in exchangeTokens.items():
+            for token in tokens:
+                ltp = self._price(token)
+                item = {"exchange": exchange, "symbolToken": token, "tradingSymbol": f"SYM{token}", "ltp": ltp}
+                if mode == "FULL":
+                    item["tradeVolume"] = self.random.randint(10000, 5000000)
+                    item["depth"] = self._depth(ltp)
+                fetched.append(item)
+        return {"status": True, "message": "SUCCESS", "data": {"fetched": fetched, "unfetched": []}}
+
+    def getCandleData(self, historicDataParams):
+        self._simulate("getCandleData")
+        step = timedelta(minutes=INTERVAL_MINUTES.get(historicDataParams["interval"], 1440))
+        start = datetime.strptime(historicDataParams["fromdate"], "%Y-%m-%d %H:%M").replace(tzinfo=IST)
+        end = datetime.strptime(historicDataParams["todate"], "%Y-%m-%d %H:%M").replace(tzinfo=IST)
+        price = self._price(historicDataParams["symboltoken"])
+
+        data: List[List] = []
+        day = start.date()
+        while day <= end.date():
+            if day.weekday() < 5:
+                if step >= timedelta(days=1):
+                    data.append([datetime(day.year, day.month, day.day, tzinfo=IST).isoformat(), price, price * 1.01, price * 0.99, price, 100000])
+                else:
+                    ts = datetime(day.year, day.month, day.day, 9, 15, tzinfo=IST)
+                    close = datetime(day.year, day.month, day.day, 15, 30, tzinfo=IST)
+                    while ts < close:
+                        data.append([ts.isoformat(), price, price * 1.001, price * 0.999, price, 1000])
+                        ts += step
+            day += timedelta(days=1)
+        return {"status": True, "message": "SUCCESS", "data": data}
+
+    def searchScrip(self, exchange, searchscrip):
+        self._simulate("searchScrip")
+        return {"status": True, "data": [{"exchange": exchange, "tradingsymbol": searchscrip, "symboltoken": "1"}]}
+
+
+def fake_snap_quote(token: str, ltp_paise: int, rng: random.Random = random) -> Dict:
+    """
+    A parsed SmartWebSocketV2 SNAP_QUOTE tick, as the SDK hands it to on_data (prices in paise).
+    """
+    return {
+        "subscription_mode": 3,
+        "exchange_type": 3,
+        "token": token,
+        "last_traded_price": ltp_paise,
+        "volume_trade_for_the_day": rng.randint(10000, 5000000),
+        "best_5_buy_data": [{"price": ltp_paise - 5 * (i + 1), "quantity": rng.randint(1, 5000), "no of orders": rng.randint(1, 20)} for i in range(5)],
+        "best_5_sell_data": [{"price": ltp_paise + 5 * (i + 1), "quantity": rng.randint(1, 5000), "no of orders": rng.randint(1, 20)} for i in range(5)],
+    }
+
+
+def fake_instruments(count: int, seed: int = 7) -> List[Dict]:
+    """
+    Scrip-master style entries for `count` BSE equities.
+    """
+    rng = random.Random(seed)
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    instruments = []
+    for i in range(count):
+        symbol = "".join(rng.choice(letters) for _ in range(rng.randint(3, 10)))
+        instruments.append({
+            "token": str(500000 + i),
+            "symbol": symbol,
+            "name": f"{symbol} INDUSTRIES LTD",
+            "exch_seg": "BSE",
+            "instrumenttype": ""
+        })
+    return instruments
@@ -0,0 +1,247 @@
+"""
+Split deployment: one ingestion process owns the Angel One session, the feed and the
+snapshot producer; any number of API worker processes serve clients from its data.
+
+    APP_ROLE=ingest uvicorn main:app --port 8001               # single process, internal port
+    APP_ROLE=worker uvicorn main:app --port 8000 --workers 4   # client-facing
+
+Both sides talk over a Unix domain socket (INGEST_SOCKET) with length-prefixed JSON messages:
+
+    ingest -> worker   {"type": "snapshot", "data": [...]}                     every producer tick
+                       {"type": "watchlists", "data": {user: [...]}}           on connect and on every edit
+                       {"type": "result" | "error", "id": n, ...}              replies
+    worker -> ingest   {"type": "call", "id": n, "method": ..., "args": [...], "kwargs": {...}, "priority": p}
+                       {"type": "watchlist", "id": n, "op": "add" | "remove", "symbol", "token", "user"}
+                       {"type": "tick_history", "id": n, "symbol", "start", "end", "limit"}
+                       {"type": "screener", "id": n, "sort", "order", "limit", "filters", "scope"}
+
+Upstream calls from workers run through the ingest process's scheduler, so rate limits
+and request coalescing hold across all workers. The default role, "standalone", is the
+single-process setup without any of this.
+"""
+import asyncio
+import itertools
+import json
+import os
+import struct
+from typing import Dict, Optional, Set
+
+APP_ROLE = os.getenv("APP_ROLE", "standalone").lower()
+INGEST_SOCKET = os.getenv("INGEST_SOCKET", "/tmp/stockmarket-ingest.sock")
+# A worker whose socket buffer grows beyond this skips snapshots until it catches up
+# (deltas are computed on the worker against what it last applied, so nothing is lost)
+MAX_WORKER_BUFFER = int(os.getenv("INGEST_MAX_BUFFER", str(8 * 1024 * 1024)))
+
+FRAME_HEADER = struct.Struct(">I")
+# The only SmartConnect methods workers may call: read-only market data, never orders or logout
+REMOTE_METHODS = frozenset({"getMarketData", "ltpData", "getCandleData", "searchScrip"})
+
+
+def encode_message(message: Dict) -> bytes:
+    data = json.dumps(message, separators=(",", ":"), default=str).encode("utf-8")
+    return FRAME_HEADER.pack(len(data)) + data
+
+
+async def read_message(reader: asyncio.StreamReader) -> Dict:
+    """
+    Reads one message; raises asyncio.IncompleteReadError when the peer is gone.
+    """
+    header = await reader.readexactly(FRAME_HEADER.size)
+    (length,) = FRAME_HEADER.unpack(header)
+    return json.loads(await reader.readexactly(length))
+
+
+class IngestServer:
+    """
+    Runs in the ingestion process: publishes snapshots and watchlists to workers and
+    serves their upstream calls, watchlist edits, tick-history and screener queries.
+    """
+
+    def __init__(self, manager, scheduler, ticks, screener=None, path: str = INGEST_SOCKET):
+        self.manager = manager
+        self.scheduler = scheduler
+        self.ticks = ticks
+        self.screener = screener
+        self.path = path
+        self.workers: Set[asyncio.StreamWriter] = set()
+        # Requests being served: the loop only keeps weak references to tasks
+        self._serving: Set[asyncio.Task] = set()
+        self.skipped = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # left over from a previous run
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+        self.manager.snapshot_listeners.append(self.publish_snapshot)
+        self.manager.watchlists.on_change.append(self.publish_watchlists)
+        print(f"Ingest server listening on {self.path}")
+
+    # --- Publishing -----------------------------------------------------------
+
+    def _publish(self, message: Dict, droppable: bool = True):
+        if not self.workers:
+            return
+        # Encoded once, written to every worker without waiting on any of them
+        frame = encode_message(message)
+        for writer in list(self.workers):
+            if writer.is_closing():
+                self.workers.discard(writer)
+            elif droppable and writer.transport.get_write_buffer_size() > MAX_WORKER_BUFFER:
+                self.skipped += 1
+            else:
+                writer.write(frame)
+
+    def publish_snapshot(self, snapshot, changes):
+        self._publish({"type": "snapshot", "data": snapshot})
+
+    def publish_watchlists(self):
+        # Never skipped: a worker has no other way to learn about the edit
+        self._publish({"type": "watchlists", "data": self.manager.watchlists.to_dict()}, droppable=False)
+
+    # --- Worker connections ---------------------------------------------------
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        writer.write(encode_message({"type": "watchlists", "data": self.manager.watchlists.to_dict()}))
+        if self.manager.latest_calculated_data:
+            writer.write(encode_message({"type": "snapshot", "data": self.manager.latest_calculated_data}))
+        self.workers.add(writer)
+        try:
+            while True:
+                message = await read_message(reader)
+                # Each request on its own task: a slow upstream call must not block the others
+                task = asyncio.create_task(self._serve(message, writer))
+                self._serving.add(task)
+                task.add_done_callback(self._serving.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.workers.discard(writer)
+            writer.close()
+
+    async def _serve(self, message: Dict, writer: asyncio.StreamWriter):
+        request_id = message.get("id")
+        try:
+            kind = message.get("type")
+            if kind == "call":
+                if message.get("method") not in REMOTE_METHODS:
+                    raise ValueError(f"Method not allowed from workers: {message.get('method')}")
+                result = await self.scheduler.call(
+                    message["method"], *message.get("args", []),
+                    priority=message.get("priority", 2), **message.get("kwargs", {})
+                )
+            elif kind == "watchlist":
+                result = await self._watchlist(message)
+            elif kind == "tick_history":
+                result = self.ticks.query(message["symbol"], message["start"], message["end"], message.get("limit", 1000))
+            elif kind == "screener" and self.screener is not None:
+                result = self.screener.query(
+                    message["sort"], message["order"], message["limit"], message.get("filters", []), message["scope"]
+                )
+            else:
+                raise ValueError(f"Unknown request type: {kind}")
+            reply = {"type": "result", "id": request_id, "result": result}
+        except Exception as e:
+            reply = {"type": "error", "id": request_id, "error": str(e)}
+        if not writer.is_closing():
+            writer.write(encode_message(reply))
+
+    async def _watchlist(self, message: Dict) -> bool:
+        store = self.manager.watchlists
+        user = message.get("user", store.DEFAULT_USER)
+        if message["op"] == "add":
+            store.add(message["symbol"], message["token"], user)
+            changed = True
+        else:
+            changed = store.remove(message["symbol"], user)
+        if changed:
+            await asyncio.to_thread(store.save)
+        return changed
+
+
+class IngestClient:
+    """
+    Runs in each worker process: mirrors snapshots and watchlists from the ingestion
+    process and forwards everything that needs the upstream session. Reconnects on its own.
+    """
+
+    def __init__(self, manager, path: str = INGEST_SOCKET, timeout: Optional[float] = None):
+        self.manager = manager
+        self.path = path
+        self.timeout = timeout or float(os.getenv("INGEST_TIMEOUT", "15"))
+        self.connected = False
+        # Set once the first snapshot has arrived (startup waits for it)
+        self.snapshot_ready = asyncio.Event()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.path)
+                self.connected = True
+                print(f"Connected to ingest process at {self.path}")
+                while True:
+                    await self._dispatch(await read_message(reader))
+            except (OSError, asyncio.IncompleteReadError) as e:
+                if self.connected:
+                    print(f"Lost ingest process: {e}")
+            finally:
+                self.connected = False
+                if self._writer is not None:
+                    self._writer.close()
+                    self._writer = None
+                for future in self._pending.values():
+                    if not future.done():
+                        future.set_exception(ConnectionError("Ingest process disconnected"))
+                self._pending.clear()
+            await asyncio.sleep(1)
+
+    async def _dispatch(self, message: Dict):
+        kind = message.get("type")
+        if kind == "snapshot":
+            await self.manager.apply_snapshot(message["data"])
+            self.snapshot_ready.set()
+        elif kind == "watchlists":
+            self.manager.watchlists.replace(message["data"])
+        elif kind in ("result", "error"):
+            future = self._pending.pop(message.get("id"), None)
+            if future is None or future.done():
+                return
+            if kind == "result":
+                future.set_result(message.get("result"))
+            else:
+                future.set_exception(RuntimeError(message.get("error")))
+
+    async def request(self, kind: str, **payload):
+        if not self.connected:
+            raise RuntimeError("Ingest process not connected")
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self._writer.write(encode_message({"type": kind, "id": request_id, **payload}))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def call(self, method: str, args, kwargs, priority: int):
+        """
+        UpstreamScheduler.remote hook: the SmartConnect call runs in the ingest process.
+        """
+        return await self.request("call", method=method, args=list(args), kwargs=kwargs, priority=priority)
+
+    async def watchlist(self, op: str, symbol: str, token: Optional[str], user: str) -> bool:
+        return await self.request("watchlist", op=op, symbol=symbol, token=token, user=user)
+
+    async def tick_history(self, symbol: str, start: float, end: float, limit: int):
+        return await self.request("tick_history", symbol=symbol, start=start, end=end, limit=limit)
+
+    async def screener(self, sort: str, order: str, limit: int, filters, scope: str):
+        return await self.request("screener", sort=sort, order=order, limit=limit, filters=list(filters), scope=scope)
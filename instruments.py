@@ -0,0 +1,195 @@
+import asyncio
+import json
+import os
+import re
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import requests
+from market_hours import IST
+
+
+class InstrumentIndex:
+    """
+    In-memory index over Angel One's OpenAPIScripMaster instrument file.
+    Search runs in-process on sorted arrays (prefix lookups via bisect) plus a hash map
+    for exact symbol resolution, so neither /search nor get_token needs an API call.
+    """
+    URL = "https://margincalculator.angelbroking.com/OpenAPI_File/files/OpenAPIScripMaster.json"
+    EXCHANGES = ("BSE", "NSE")
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("INSTRUMENT_FILE", "OpenAPIScripMaster.json")
+        self.refresh_time = os.getenv("INSTRUMENT_REFRESH_TIME", "08:30")
+        self.loaded_at: Optional[float] = None
+        # (exchange, SYMBOL) -> token
+        self._tokens: Dict[Tuple[str, str], str] = {}
+        # exchange -> (sorted symbols, parallel entries)
+        self._symbols: Dict[str, Tuple[List[str], List[Dict]]] = {}
+        # exchange -> (sorted name words, parallel entries)
+        self._words: Dict[str, Tuple[List[str], List[Dict]]] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self.loaded_at is not None
+
+    # --- Loading --------------------------------------------------------------
+
+    def _file_is_fresh(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        modified = datetime.fromtimestamp(os.path.getmtime(self.path), IST)
+        return modified.date() == datetime.now(IST).date()
+
+    def _download(self):
+        print("Downloading instrument master...")
+        res = requests.get(self.URL, timeout=60)
+        res.raise_for_status()
+        # Atomic: several worker processes may load the same file
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(res.content)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        """
+        Blocking: loads the instrument file (downloading today's copy if needed) and rebuilds the index.
+        A stale file on disk is still used if the download fails.
+        """
+        if not self._file_is_fresh():
+            try:
+                self._download()
+            except Exception as e:
+                print(f"Instrument download failed: {e}")
+                if not os.path.exists(self.path):
+                    raise
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            self.build(json.load(f))
+
+    def build(self, instruments: List[Dict]):
+        """
+        Builds the lookup structures from raw scrip master entries (cash segment only)
+        and swaps them in at once, so readers never see a half-built index.
+        """
+        tokens: Dict[Tuple[str, str], str] = {}
+        symbols: Dict[str, List[Tuple[str, Dict]]] = {ex: [] for ex in self.EXCHANGES}
+        words: Dict[str, List[Tuple[str, Dict]]] = {ex: [] for ex in self.EXCHANGES}
+
+        for item in instruments:
+            exchange = item.get('exch_seg')
+            if exchange not in symbols or item.get('instrumenttype'):
+                continue
+            symbol = item.get('symbol', '').upper()
+            token = str(item.get('token', ''))
+            if not symbol or not token:
+                continue
+
+            entry = {"exchange": exchange, "tradingsymbol": item.get('symbol'), "symboltoken": token}
+            tokens[(exchange, symbol)] = token
+            symbols[exchange].append((symbol, entry))
+            for word in set(re.split(r"[^A-Z0-9&]+", item.get('name', '').upper())):
+                if word:
+                    words[exchange].append((word, entry))
+
+        def to_arrays(pairs):
+            pairs.sort(key=lambda pair: pair[0])
+            return [p[0] for p in pairs], [p[1] for p in pairs]
+
+        self._tokens = tokens
+        self._symbols = {ex: to_arrays(pairs) for ex, pairs in symbols.items()}
+        self._words = {ex: to_arrays(pairs) for ex, pairs in words.items()}
+        self.loaded_at = time.time()
+        print(f"Instrument index built with {len(tokens)} symbols")
+
+    # --- Queries --------------------------------------------------------------
+
+    @staticmethod
+    def _prefix_matches(keys: List[str], entries: List[Dict], prefix: str, limit: int) -> List[Dict]:
+        matches = []
+        i = bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix) and len(matches) < limit:
+            matches.append(entries[i])
+            i += 1
+        return matches
+
+    def search(self, query: str, exchange: str = "BSE", limit: int = 50) -> List[Dict]:
+        """
+        Same ranking as the searchScrip based endpoint: exact match first, then
+        symbols starting with the query, then symbols whose company name has a word
+        starting with the query.
+        """
+        q_upper = query.upper().strip()
+        if not q_upper or exchange not in self._symbols:
+            return []
+
+        keys, entries = self._symbols[exchange]
+        # Exact match sorts first because it is the shortest key with this prefix
+        results = self._prefix_matches(keys, entries, q_upper, limit)
+
+        seen = {entry["symboltoken"] for entry in results}
+        if len(results) < limit:
+            word_keys, word_entries = self._words[exchange]
+            for entry in self._prefix_matches(word_keys, word_entries, q_upper, limit * 2):
+                if entry["symboltoken"] not in seen:
+                    seen.add(entry["symboltoken"])
+                    results.append(entry)
+                    if len(results) >= limit:
+                        break
+        return results
+
+    def equities(self, exchange: str = "BSE") -> List[Dict]:
+        """
+        Every cash-segment instrument of an exchange, as search-style entries.
+        """
+        return list(self._symbols.get(exchange, ([], []))[1])
+
+    def resolve(self, symbol: str) -> Optional[Tuple[str, str]]:
+        """
+        Resolves "TCS.BSE", "TCS.NSE" or plain "TCS" (BSE) to (exchange, token).
+        NSE equities are listed with an "-EQ" suffix in the scrip master.
+        """
+        name = symbol.upper()
+        exchange = "BSE"
+        for ex in self.EXCHANGES:
+            if name.endswith(f".{ex}"):
+                name, exchange = name[:-(len(ex) + 1)], ex
+                break
+
+        token = self._tokens.get((exchange, name))
+        if token is None and exchange == "NSE":
+            token = self._tokens.get((exchange, f"{name}-EQ"))
+        return (exchange, token) if token else None
+
+    # --- Background refresh ---------------------------------------------------
+
+    def seconds_until_refresh(self) -> float:
+        hour, minute = (int(part) for part in self.refresh_time.split(":"))
+        now = datetime.now(IST)
+        target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if target <= now:
+            target += timedelta(days=1)
+        return (target - now).total_seconds()
+
+    async def run_refresher(self):
+        """
+        Loads the index at startup (unless the startup warm-up already did), then reloads
+        it once a day before the market opens.
+        """
+        reload = not self.ready
+        while True:
+            if reload:
+                try:
+                    await asyncio.to_thread(self.load)
+                except Exception as e:
+                    print(f"Instrument index load failed: {e}")
+                    # Retry sooner when we have nothing to serve
+                    if not self.ready:
+                        await asyncio.sleep(300)
+                        continue
+            reload = True
+            await asyncio.sleep(self.seconds_until_refresh())
+
+
+instrument_index = InstrumentIndex()
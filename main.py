@@ -1,11 +1,23 @@
 import os
-from fastapi import FastAPI, WebSocket, HTTPException, Depends
+from fastapi import FastAPI, WebSocket, HTTPException, Depends, Request, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import List, Optional
 import asyncio
 from auth import AngelOneAuth
 from websocket_manager import socket_manager
 from market import MarketAnalyzer
+from candle_store import candle_store
+from instruments import instrument_index
+from upstream import upstream, PRIORITY_INTERACTIVE
+from bars import bar_aggregator
+from market_hours import IST
+from tick_history import tick_history
+from metrics import loop_lag, render_metrics, CONTENT_TYPE
+from ingest import APP_ROLE, IngestServer, IngestClient
+from responses import cached_encoder, candles_to_columns, candles_to_rows, candles_last_modified, dumps
+from screener import Screener
+from angel_http import pool_stats
 
 from dotenv import load_dotenv
 
@@ -27,6 +39,100 @@ app.add_middleware(
 # Initialize Auth
 angel_auth = AngelOneAuth()
 
+def on_angel_session(tokens, refreshed):
+    """
+    Called after every login / token refresh: shares the session with the socket manager
+    and (re)starts the push feed after a full login.
+    """
+    socket_manager.set_api_instance(angel_auth.smart_api)
+    if not refreshed and os.getenv("FEED_ENABLED", "true").lower() == "true":
+        # Push-based depth: the snapshot producer prefers these ticks over REST polling
+        socket_manager.start_angel_socket(tokens["jwtToken"], angel_auth.api_key, angel_auth.client_id, tokens["feedToken"])
+
+angel_auth.listeners.append(on_angel_session)
+
+# APP_ROLE: "standalone" (default), "ingest" (owns the session, publishes to workers) or "worker", see ingest.py
+ingest_client = IngestClient(socket_manager) if APP_ROLE == "worker" else None
+# The screener index lives next to the producer; workers forward their queries
+screener = Screener(socket_manager) if ingest_client is None else None
+ingest_server = IngestServer(socket_manager, upstream, tick_history, screener) if APP_ROLE == "ingest" else None
+
+async def ensure_api_connected():
+    """
+    Returns immediately once the session keeper has logged in; otherwise joins the
+    single in-flight login instead of starting another one.
+    """
+    # Workers have no session of their own, the ingest process makes their upstream calls
+    if ingest_client is None and not socket_manager.replaying:
+        await angel_auth.ensure_session()
+
+# Startup waits at most this long for the caches to warm before accepting clients
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "30"))
+
+async def warm_up():
+    """
+    Fills the token (instrument master), volume and closing-price caches, so the first
+    client after a restart is not served from cold caches.
+    """
+    if not instrument_index.ready:
+        try:
+            await asyncio.to_thread(instrument_index.load)
+        except Exception as e:
+            print(f"Instrument warm-up failed: {e}")
+    if ingest_client is not None:
+        # Workers only need the ingest process's current snapshot
+        await ingest_client.snapshot_ready.wait()
+        return
+    if not socket_manager.replaying and angel_auth.has_credentials:
+        try:
+            await angel_auth.ensure_session()
+        except Exception as e:
+            print(f"Login during warm-up failed: {e}")
+    await socket_manager.warm_up()
+
+@app.on_event("startup")
+async def start_snapshot_producer():
+    loop_lag.start()
+    if ingest_client is not None:
+        # Worker: snapshots, watchlists and upstream calls come from the ingest process
+        upstream.set_remote(ingest_client)
+        ingest_client.start()
+    else:
+        replay_file = os.getenv("REPLAY_FILE")
+        if replay_file:
+            # Offline: recorded responses and ticks stand in for Angel One
+            socket_manager.start_replay(
+                replay_file,
+                float(os.getenv("REPLAY_SPEED", "1")),
+                os.getenv("REPLAY_LOOP", "false").lower() == "true"
+            )
+        else:
+            # Log in ahead of the first request and refresh the session before the JWT expires
+            angel_auth.start_session_keeper()
+
+    # The server accepts clients only once this handler returns
+    try:
+        await asyncio.wait_for(warm_up(), WARMUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"Cache warm-up not finished after {WARMUP_TIMEOUT}s, starting anyway")
+    except Exception as e:
+        print(f"Cache warm-up failed: {e}")
+
+    # Local instrument master for /search and symbol-to-token resolution, refreshed daily
+    asyncio.create_task(instrument_index.run_refresher())
+    if ingest_client is None:
+        # One shared producer for all clients instead of one polling loop per /ws connection
+        socket_manager.start_producer()
+        screener.start()
+        if ingest_server is not None:
+            await ingest_server.start()
+
+@app.on_event("shutdown")
+async def close_recorder():
+    # The recorder buffers writes, the tail of a recording would be lost otherwise
+    if socket_manager.recorder is not None:
+        socket_manager.recorder.close()
+
 class LoginRequest(BaseModel):
     # Depending on needs, might just use env vars, but allowing override if needed
     # For now, we use env vars as primary source to be safe
@@ -34,11 +140,13 @@ class LoginRequest(BaseModel):
 
 @app.post("/login")
 async def login():
+    if ingest_client is not None:
+        # Workers never hold a session or a feed of their own
+        raise HTTPException(status_code=409, detail="Login is handled by the ingest process")
     try:
         # Tries to login using Env Vars
-        tokens = angel_auth.login()
-        socket_manager.set_api_instance(angel_auth.get_smart_api_instance())
-        return {"status": "success", "tokens": tokens}
+        await angel_auth.ensure_session(force=True)
+        return {"status": "success", "tokens": angel_auth.tokens}
     except Exception as e:
         # For demo purposes, if env vars are missing, we might return a mock token
         # BUT user strictly said "No fake data", so we return error if purely from auth perspective.
@@ -47,73 +155,140 @@ async def login():
         raise HTTPException(status_code=401, detail=str(e))
 
 @app.get("/stock-history/{symbol}")
-async def get_stock_history(symbol: str, interval: str = "ONE_DAY", days: int = 30):
+async def get_stock_history(request: Request, symbol: str, interval: str = "ONE_DAY", days: int = 30, format: str = "rows"):
+    """
+    format=rows (default): [{"date", "open", "high", "low", "close", "volume"}, ...]
+    format=columnar: {"date": [...], "open": [...], ...}, much smaller for long ranges.
+    Responses carry ETag / Last-Modified (conditional requests get 304) and are
+    gzip / brotli compressed when the client accepts it.
+    """
+    if format not in ("rows", "columnar"):
+        raise HTTPException(status_code=400, detail="format must be rows or columnar")
+    # Revalidation of a response that cannot have changed is answered before any fetch
+    cache_key = ("stock-history", symbol, interval, days, format)
+    not_modified = cached_encoder.precheck(request, cache_key)
+    if not_modified is not None:
+        return not_modified
     try:
         # Map frontend interval names to Angel API intervals
         # Supported: ONE_MINUTE, FIVE_MINUTE, TEN_MINUTE, FIFTEEN_MINUTE, THIRTY_MINUTE, ONE_HOUR, ONE_DAY
         
-        token = socket_manager.get_token(symbol)
-        if not token:
+        resolved = socket_manager.resolve_symbol(symbol)
+        if not resolved:
             if not symbol.endswith(".BSE"):
-                token = socket_manager.get_token(f"{symbol}.BSE")
-            if not token:
+                resolved = socket_manager.resolve_symbol(f"{symbol}.BSE")
+            if not resolved:
                 raise HTTPException(status_code=404, detail="Stock symbol not found")
+        exchange, token = resolved
 
-        smart_api = socket_manager.angel_api
-        if not smart_api:
-             try:
-                angel_auth.login()
-                smart_api = angel_auth.get_smart_api_instance()
-             except:
-                raise HTTPException(status_code=503, detail="Backend not connected to Angel One API")
+        try:
+            await ensure_api_connected()
+        except Exception:
+            raise HTTPException(status_code=503, detail="Backend not connected to Angel One API")
 
         # Calculate Dates based on interval and provided days
         from datetime import datetime, timedelta
-        end_date = datetime.now()
+        end_date = datetime.now(IST)
         start_date = end_date - timedelta(days=days)
-        
-        from_date_str = start_date.strftime("%Y-%m-%d 00:00")
-        to_date_str = end_date.strftime("%Y-%m-%d 23:59")
-        
-        historicParam={
-            "exchange": "BSE",
-            "symboltoken": token,
-            "interval": interval,
-            "fromdate": from_date_str, 
-            "todate": to_date_str
-        }
-        
-        res = smart_api.getCandleData(historicParam)
-        
-        if res and res.get('status') and res.get('data'):
-            formatted_data = []
-            for candle in res['data']:
-                formatted_data.append({
-                    "date": candle[0],
-                    "open": candle[1],
-                    "high": candle[2],
-                    "low": candle[3],
-                    "close": candle[4],
-                    "volume": candle[5]
-                })
-            return formatted_data
-        else:
-            return []
-            
+
+        async def fetch_candles(historicParam):
+            return await upstream.call("getCandleData", historicParam, priority=PRIORITY_INTERACTIVE)
+
+        # Today's intraday bars come from the live aggregator when it has the full session
+        live_bars = bar_aggregator.session_bars(token, interval, end_date.date())
+        stored_end = end_date.date() - timedelta(days=1) if live_bars is not None else end_date.date()
+
+        # Served from the local store, only missing ranges and the live session go upstream
+        candles = []
+        if start_date.date() <= stored_end:
+            candles = await candle_store.get_candles(
+                fetch_candles, token, interval, start_date.date(), stored_end, exchange=exchange
+            )
+        if live_bars:
+            candles = candles + live_bars
+
+        formatted_data = candles_to_columns(candles) if format == "columnar" else candles_to_rows(candles)
+        # Live bars change every tick, anything else stays put until the store would refetch it
+        ttl = None if live_bars is not None else candle_store.stable_seconds(end_date.date())
+        return await cached_encoder.respond(
+            request, dumps(formatted_data), candles_last_modified(candles, interval), cache_key, ttl
+        )
+
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error fetching history: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/tick-history/{symbol}")
+async def get_tick_history(symbol: str, start: Optional[str] = None, end: Optional[str] = None, limit: int = Query(1000, ge=1, le=10000)):
+    """
+    Analysis of a symbol over a past time range, recomputed from the in-memory tick
+    history (no upstream call). `start` / `end` are ISO datetimes, default: last 15 minutes.
+    """
+    from datetime import datetime, timedelta
+    try:
+        end_dt = datetime.fromisoformat(end) if end else datetime.now(IST)
+        start_dt = datetime.fromisoformat(start) if start else end_dt - timedelta(minutes=15)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start/end must be ISO datetimes")
+    # Naive datetimes are exchange time
+    if end_dt.tzinfo is None:
+        end_dt = end_dt.replace(tzinfo=IST)
+    if start_dt.tzinfo is None:
+        start_dt = start_dt.replace(tzinfo=IST)
+
+    if ingest_client is not None:
+        try:
+            records = await ingest_client.tick_history(symbol, start_dt.timestamp(), end_dt.timestamp(), limit)
+        except Exception:
+            raise HTTPException(status_code=503, detail="Ingest process not available")
+    else:
+        records = tick_history.query(symbol, start_dt.timestamp(), end_dt.timestamp(), limit)
+    if records is None:
+        raise HTTPException(status_code=404, detail="No tick history for symbol")
+    return records
+
+@app.get("/screener")
+async def get_screener(
+    sort: str = "strengthPercent",
+    order: str = "desc",
+    limit: int = 20,
+    filters: List[str] = Query(default=[]),
+    scope: str = "all",
+):
+    """
+    Top `limit` symbols by any analysis metric, e.g.
+    /screener?sort=strengthPercent&filters=tradedVolume>1000000&filters=sentiment=Bullish
+    `scope=watchlist` restricts to tracked symbols; the whole BSE universe is included
+    when SCREENER_UNIVERSE=true.
+    """
+    if ingest_client is not None:
+        try:
+            return await ingest_client.screener(sort, order, limit, filters, scope)
+        except RuntimeError as e:
+            # Validation errors come back from the ingest process as plain messages
+            if not ingest_client.connected:
+                raise HTTPException(status_code=503, detail="Ingest process not available")
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception:
+            raise HTTPException(status_code=503, detail="Ingest process not available")
+    try:
+        return screener.query(sort, order, limit, filters, scope)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/search")
 async def search_stocks(query: str):
     try:
-        smart_api = socket_manager.angel_api
-        if not smart_api:
-             angel_auth.login()
-             smart_api = angel_auth.get_smart_api_instance()
+        # Served in-process from the instrument master once it is loaded
+        if instrument_index.ready:
+            return instrument_index.search(query)
+
+        await ensure_api_connected()
         
         q_upper = query.upper()
-        res = smart_api.searchScrip(exchange="BSE", searchscrip=q_upper)
+        res = await upstream.call("searchScrip", exchange="BSE", searchscrip=q_upper, priority=PRIORITY_INTERACTIVE)
         
         if res and res.get('status') and res.get('data'):
             data = res['data']
@@ -135,43 +310,108 @@ async def search_stocks(query: str):
 
 class WatchlistRequest(BaseModel):
     symbol: str
-    token: str
+    token: Optional[str] = None
+    user: str = "default"
+
+async def edit_watchlist(op: str, symbol: str, token: Optional[str], user: str) -> bool:
+    """
+    Applies and persists a watchlist edit, or forwards it to the ingest process (the only writer).
+    """
+    if ingest_client is not None:
+        try:
+            return await ingest_client.watchlist(op, symbol, token, user)
+        except Exception:
+            raise HTTPException(status_code=503, detail="Ingest process not available")
+
+    if op == "add":
+        socket_manager.watchlists.add(symbol, token, user)
+        changed = True
+    else:
+        changed = socket_manager.watchlists.remove(symbol, user)
+    if changed:
+        await asyncio.to_thread(socket_manager.watchlists.save)
+    return changed
+
+@app.get("/watchlist")
+async def get_watchlist(user: str = "default"):
+    return socket_manager.watchlists.get(user).to_list()
 
 @app.post("/watchlist/add")
 async def add_to_watchlist(request: WatchlistRequest):
     """
-    Dynamically adds a symbol to the tracking list, placing it at the front.
+    Adds a symbol to the user's watchlist, placing it at the front.
+    The token is resolved from the instrument master when not given.
     """
-    # Create a new mapping with the new symbol first
-    new_map = {request.symbol: request.token}
-    # Add existing symbols (excluding the new one if it already existed)
-    for k, v in socket_manager.token_map.items():
-        if k != request.symbol:
-            new_map[k] = v
-    
-    socket_manager.token_map = new_map
+    token = request.token
+    if not token:
+        resolved = socket_manager.resolve_symbol(request.symbol)
+        if not resolved:
+            raise HTTPException(status_code=404, detail="Stock symbol not found")
+        token = resolved[1]
+
+    await edit_watchlist("add", request.symbol, token, request.user)
     return {"status": "success", "message": f"Added {request.symbol} to tracking"}
 
+@app.post("/watchlist/remove")
+async def remove_from_watchlist(request: WatchlistRequest):
+    if not await edit_watchlist("remove", request.symbol, None, request.user):
+        raise HTTPException(status_code=404, detail="Symbol not in watchlist")
+    return {"status": "success", "message": f"Removed {request.symbol} from tracking"}
+
 @app.get("/market-strength")
 async def get_market_strength():
     """
-    Kicks off a single calculation based on latest data.
-    Since we might not have a live socket, we generate a sample based on the logic.
+    Returns the latest shared snapshot computed by the background producer.
+    """
+    return socket_manager.latest_calculated_data
+
+@app.get("/upstream/stats")
+async def get_upstream_stats():
+    """
+    Per-endpoint queue depth, wait times and coalescing counters of the upstream scheduler.
+    """
+    return upstream.stats()
+
+@app.get("/upstream/pool")
+async def get_upstream_pool():
+    """
+    Keep-alive connection pool to Angel One: requests, new vs reused connections, retries.
+    """
+    stats = pool_stats(angel_auth.smart_api)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No pooled Angel One session in this process")
+    return stats
+
+@app.get("/stream/stats")
+async def get_stream_stats():
+    """
+    /ws fan-out counters: connections, queued, dropped and conflated frames.
+    """
+    return socket_manager.stream_stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Prometheus text format: upstream call counts / errors / latency histograms, HTTP pool reuse,
+    snapshot cycle time, event-loop lag, /ws connections and queue depths, cache hit ratios.
     """
-    # In a real app, this would return `socket_manager.latest_calculated_data`
-    # For demonstration of the LOGIC flow:
-    data = socket_manager.mock_data_generator()
-    return data
+    text = render_metrics(socket_manager, upstream, {
+        "volume": socket_manager.volume_cache,
+        "candles": candle_store,
+        "order_book": socket_manager.order_books,
+    }, pool_stats(angel_auth.smart_api))
+    return Response(text, media_type=CONTENT_TYPE)
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await socket_manager.connect(websocket)
+    session = await socket_manager.connect(websocket)
     try:
+        # Send the current snapshot right away, later ticks arrive via socket_manager.broadcast
+        await socket_manager.send_snapshot(session)
         while True:
-            # unique logic: Stream data every 1 second
-            data = await socket_manager.mock_data_generator()
-            await websocket.send_json(data)
-            await asyncio.sleep(1)
+            # Subscribe / unsubscribe / mode messages, see ws_client.ClientSession
+            if session.handle_message(await websocket.receive_text()):
+                await socket_manager.send_snapshot(session)
     except Exception as e:
         # Standardize disconnect
         print(f"WebSocket Disconnected or Error: {e}")
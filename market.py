@@ -1,4 +1,9 @@
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Sequence
+from array import array
+from datetime import date, datetime
+import os
+import numpy as np
+from market_hours import IST
 
 class MarketAnalyzer:
     """
@@ -75,3 +80,247 @@ class MarketAnalyzer:
             "strengthPercent": round(strength_percent, 2),
             "sentiment": sentiment
         }
+
+    @staticmethod
+    def _round_exact(values: np.ndarray, ndigits: int = 2) -> np.ndarray:
+        """
+        np.round scales by 10**ndigits before rounding, which can disagree with Python's
+        correctly rounded round() on values sitting near a .5 boundary.
+        Those few entries are re-rounded with round() so results match the scalar path.
+        """
+        rounded = np.round(values, ndigits)
+        scaled = values * (10 ** ndigits)
+        near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+        for i in np.flatnonzero(near_tie):
+            rounded[i] = round(float(values[i]), ndigits)
+        return rounded
+
+    @staticmethod
+    def calculate_strength_batch(buy_quantities, sell_quantities, traded_volume=None) -> Dict[str, np.ndarray]:
+        """
+        Vectorized calculate_strength for N symbols in one NumPy pass.
+
+        Args:
+            buy_quantities: N x 5 array of best-5 buy quantities (missing levels as 0).
+            sell_quantities: N x 5 array of best-5 sell quantities.
+            traded_volume: Optional length-N array of executed volume.
+
+        Returns:
+            Dictionary of length-N arrays with the same keys as calculate_strength.
+            Use batch_to_records to get the exact per-symbol dicts.
+        """
+        buy_qty = np.asarray(buy_quantities)
+        sell_qty = np.asarray(sell_quantities)
+        n = buy_qty.shape[0]
+
+        buy_volume = buy_qty.sum(axis=1)
+        sell_volume = sell_qty.sum(axis=1)
+        total_order_volume = buy_volume + sell_volume
+        has_volume = total_order_volume != 0
+
+        # Same operation order as the scalar path: (a / total) * 100
+        total = total_order_volume.astype(np.float64)
+        buy_percent = np.zeros(n)
+        sell_percent = np.zeros(n)
+        strength_percent = np.zeros(n)
+        np.divide(buy_volume, total, out=buy_percent, where=has_volume)
+        np.divide(sell_volume, total, out=sell_percent, where=has_volume)
+        np.divide(buy_volume - sell_volume, total, out=strength_percent, where=has_volume)
+        buy_percent *= 100
+        sell_percent *= 100
+        strength_percent *= 100
+
+        # Sentiment uses the unrounded strength, like the scalar path
+        sentiment = np.full(n, "Neutral", dtype=object)
+        sentiment[strength_percent > 5] = "Bullish"
+        sentiment[strength_percent < -5] = "Bearish"
+
+        if traded_volume is None:
+            traded_volume = np.zeros(n, dtype=np.int64)
+
+        return {
+            "totalVolume": total_order_volume,
+            "buyVolume": buy_volume,
+            "sellVolume": sell_volume,
+            "tradedVolume": np.asarray(traded_volume),
+            "buyPercent": MarketAnalyzer._round_exact(buy_percent),
+            "sellPercent": MarketAnalyzer._round_exact(sell_percent),
+            "strengthPercent": MarketAnalyzer._round_exact(strength_percent),
+            "sentiment": sentiment,
+            "hasVolume": has_volume
+        }
+
+    @staticmethod
+    def batch_to_records(batch: Dict[str, np.ndarray], symbols: Optional[Sequence[str]] = None) -> List[Dict]:
+        """
+        Converts calculate_strength_batch output into the dicts calculate_strength returns,
+        including the zero-volume "Neutral" shape (which carries no tradedVolume).
+        """
+        columns = {key: values.tolist() for key, values in batch.items()}
+        records = []
+        for i, has_volume in enumerate(columns["hasVolume"]):
+            if not has_volume:
+                record = {
+                    "totalVolume": 0,
+                    "buyVolume": 0,
+                    "sellVolume": 0,
+                    "buyPercent": 0.0,
+                    "sellPercent": 0.0,
+                    "strengthPercent": 0.0,
+                    "sentiment": "Neutral"
+                }
+            else:
+                record = {
+                    "totalVolume": columns["totalVolume"][i],
+                    "buyVolume": columns["buyVolume"][i],
+                    "sellVolume": columns["sellVolume"][i],
+                    "tradedVolume": columns["tradedVolume"][i],
+                    "buyPercent": columns["buyPercent"][i],
+                    "sellPercent": columns["sellPercent"][i],
+                    "strengthPercent": columns["strengthPercent"][i],
+                    "sentiment": columns["sentiment"][i]
+                }
+            if symbols is not None:
+                record["symbol"] = symbols[i]
+            records.append(record)
+        return records
+
+    @staticmethod
+    def depth_to_arrays(depths: Sequence[Dict], levels: int = 5):
+        """
+        Packs a list of depth dicts into (buy N x levels, sell N x levels, traded N) arrays.
+        """
+        n = len(depths)
+        buy = np.zeros((n, levels), dtype=np.int64)
+        sell = np.zeros((n, levels), dtype=np.int64)
+        traded = np.zeros(n, dtype=np.int64)
+        for i, depth in enumerate(depths):
+            for j, order in enumerate(depth.get('buy', [])[:levels]):
+                buy[i, j] = order.get('quantity', 0)
+            for j, order in enumerate(depth.get('sell', [])[:levels]):
+                sell[i, j] = order.get('quantity', 0)
+            traded[i] = depth.get('tradedVolume', 0) or 0
+        return buy, sell, traded
+
+
+class SymbolState:
+    """
+    Fixed-size per-symbol state for StreamingAnalyzer.
+    """
+    __slots__ = (
+        "ema", "ofi_window", "ofi_pos", "ofi_sum", "ofi_count",
+        "bid_price", "bid_qty", "ask_price", "ask_qty",
+        "pv_sum", "volume_sum", "last_volume", "session_day"
+    )
+
+    def __init__(self, window: int):
+        self.ema: Optional[float] = None
+        self.ofi_window = array("d", [0.0] * window)
+        self.ofi_pos = 0
+        self.ofi_sum = 0.0
+        self.ofi_count = 0
+        self.bid_price: Optional[float] = None
+        self.bid_qty = 0
+        self.ask_price: Optional[float] = None
+        self.ask_qty = 0
+        self.pv_sum = 0.0
+        self.volume_sum = 0
+        self.last_volume: Optional[int] = None
+        self.session_day: Optional[date] = None
+
+
+class StreamingAnalyzer:
+    """
+    Stateful companion to MarketAnalyzer.calculate_strength, updated in O(1) per tick:
+    - strengthEma: exponential moving average of strengthPercent (and its sentiment)
+    - ofi: order-flow imbalance of the best bid/ask, summed over the last N ticks
+    - vwap: session VWAP from LTP and the increase in traded volume
+    """
+
+    def __init__(self, alpha: Optional[float] = None, window: Optional[int] = None):
+        self.alpha = alpha if alpha is not None else float(os.getenv("STRENGTH_EMA_ALPHA", "0.2"))
+        self.window = window if window is not None else int(os.getenv("OFI_WINDOW", "20"))
+        self.states: Dict[str, SymbolState] = {}
+
+    @staticmethod
+    def _best(orders: List[Dict]):
+        if not orders:
+            return None, 0
+        return orders[0].get('price'), orders[0].get('quantity', 0)
+
+    @staticmethod
+    def _order_flow(state: SymbolState, bid_price, bid_qty, ask_price, ask_qty) -> float:
+        """
+        Cont-Kukanov-Stoikov order-flow imbalance between two consecutive best quotes.
+        """
+        if state.bid_price is None or state.ask_price is None or bid_price is None or ask_price is None:
+            return 0.0
+        flow = 0.0
+        if bid_price >= state.bid_price:
+            flow += bid_qty
+        if bid_price <= state.bid_price:
+            flow -= state.bid_qty
+        if ask_price <= state.ask_price:
+            flow -= ask_qty
+        if ask_price >= state.ask_price:
+            flow += state.ask_qty
+        return flow
+
+    def update(self, symbol: str, depth: Dict, analysis: Dict, ltp: Optional[float], traded_volume: Optional[int],
+               session_day: Optional[date] = None, apply: bool = True) -> Dict:
+        """
+        Adds strengthEma, smoothedSentiment, ofi and vwap to `analysis`.
+        With apply=False (stale data) the current values are attached without updating.
+        `traded_volume` must be the live session figure; None leaves the VWAP untouched.
+        """
+        state = self.states.get(symbol)
+        if state is None:
+            state = self.states[symbol] = SymbolState(self.window)
+
+        if apply:
+            session_day = session_day or datetime.now(IST).date()
+            if state.session_day != session_day:
+                # New session: VWAP restarts
+                state.session_day = session_day
+                state.pv_sum = 0.0
+                state.volume_sum = 0
+                state.last_volume = None
+
+            # 1. EMA of strength
+            strength = analysis.get('strengthPercent', 0.0)
+            state.ema = strength if state.ema is None else self.alpha * strength + (1 - self.alpha) * state.ema
+
+            # 2. Rolling order-flow imbalance over the last `window` ticks
+            bid_price, bid_qty = self._best(depth.get('buy', []))
+            ask_price, ask_qty = self._best(depth.get('sell', []))
+            flow = self._order_flow(state, bid_price, bid_qty, ask_price, ask_qty)
+            state.ofi_sum += flow - state.ofi_window[state.ofi_pos]
+            state.ofi_window[state.ofi_pos] = flow
+            state.ofi_pos = (state.ofi_pos + 1) % self.window
+            state.ofi_count = min(state.ofi_count + 1, self.window)
+            state.bid_price, state.bid_qty = bid_price, bid_qty
+            state.ask_price, state.ask_qty = ask_price, ask_qty
+
+            # 3. Session VWAP from the traded volume increase since the last tick
+            if ltp is not None and traded_volume:
+                if state.last_volume is not None and traded_volume > state.last_volume:
+                    volume = traded_volume - state.last_volume
+                    state.pv_sum += ltp * volume
+                    state.volume_sum += volume
+                state.last_volume = traded_volume
+
+        ema = state.ema if state.ema is not None else 0.0
+        smoothed = "Neutral"
+        if ema > 5:
+            smoothed = "Bullish"
+        elif ema < -5:
+            smoothed = "Bearish"
+
+        analysis['strengthEma'] = round(ema, 2)
+        analysis['smoothedSentiment'] = smoothed
+        analysis['ofi'] = round(state.ofi_sum, 2)
+        analysis['vwap'] = round(state.pv_sum / state.volume_sum, 2) if state.volume_sum else None
+        return analysis
+
+    def forget(self, symbol: str):
+        self.states.pop(symbol, None)
@@ -0,0 +1,105 @@
+import os
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Iterable, Optional, Set
+
+# Indian Standard Time has no DST, a fixed offset is enough
+IST = timezone(timedelta(hours=5, minutes=30))
+
+# BSE equity session: pre-open call auction, continuous trading, closing / post-close session
+PRE_OPEN = time(9, 0)
+SESSION_OPEN = time(9, 15)
+SESSION_CLOSE = time(15, 30)
+POST_CLOSE_END = time(16, 0)
+
+PHASE_PRE_OPEN = "pre_open"
+PHASE_OPEN = "open"
+PHASE_CLOSING = "closing"
+PHASE_CLOSED = "closed"
+
+
+class MarketCalendar:
+    """
+    Minimal BSE trading calendar: weekdays minus configured exchange holidays.
+    Holidays come from BSE_HOLIDAYS (comma separated YYYY-MM-DD) unless passed explicitly.
+    """
+
+    def __init__(self, holidays: Optional[Iterable[date]] = None):
+        if holidays is None:
+            holidays = self._holidays_from_env()
+        self.holidays: Set[date] = set(holidays)
+
+    @staticmethod
+    def _holidays_from_env() -> Set[date]:
+        raw = os.getenv("BSE_HOLIDAYS", "")
+        holidays = set()
+        for item in raw.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            try:
+                holidays.add(datetime.strptime(item, "%Y-%m-%d").date())
+            except ValueError:
+                print(f"Ignoring invalid holiday date: {item}")
+        return holidays
+
+    @staticmethod
+    def now() -> datetime:
+        return datetime.now(IST)
+
+    def is_trading_day(self, day: date) -> bool:
+        return day.weekday() < 5 and day not in self.holidays
+
+    def next_trading_day(self, day: date) -> date:
+        """
+        First trading day strictly after `day`.
+        """
+        day += timedelta(days=1)
+        while not self.is_trading_day(day):
+            day += timedelta(days=1)
+        return day
+
+    def session_close(self, day: date) -> datetime:
+        return datetime.combine(day, SESSION_CLOSE, tzinfo=IST)
+
+    def next_session_close(self, now: Optional[datetime] = None) -> datetime:
+        """
+        Close of the current session if it is still running, otherwise of the next one.
+        That is the point at which a new daily candle becomes final.
+        """
+        now = (now or self.now()).astimezone(IST)
+        today = now.date()
+        if self.is_trading_day(today) and now < self.session_close(today):
+            return self.session_close(today)
+        return self.session_close(self.next_trading_day(today))
+
+    def phase(self, now: Optional[datetime] = None) -> str:
+        """
+        Session phase at `now`: pre_open, open, closing or closed (nights, weekends, holidays).
+        """
+        now = (now or self.now()).astimezone(IST)
+        if not self.is_trading_day(now.date()):
+            return PHASE_CLOSED
+        clock = now.time()
+        if PRE_OPEN <= clock < SESSION_OPEN:
+            return PHASE_PRE_OPEN
+        if SESSION_OPEN <= clock < SESSION_CLOSE:
+            return PHASE_OPEN
+        if SESSION_CLOSE <= clock < POST_CLOSE_END:
+            return PHASE_CLOSING
+        return PHASE_CLOSED
+
+    def next_phase_change(self, now: Optional[datetime] = None) -> datetime:
+        """
+        Next phase boundary after `now` (today's if any are left, else the next trading day's pre-open).
+        """
+        now = (now or self.now()).astimezone(IST)
+        today = now.date()
+        if self.is_trading_day(today):
+            for boundary in (PRE_OPEN, SESSION_OPEN, SESSION_CLOSE, POST_CLOSE_END):
+                moment = datetime.combine(today, boundary, tzinfo=IST)
+                if moment > now:
+                    return moment
+        return datetime.combine(self.next_trading_day(today), PRE_OPEN, tzinfo=IST)
+
+
+market_calendar = MarketCalendar()
@@ -0,0 +1,158 @@
+import asyncio
+import os
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Upper bounds in seconds, from sub-millisecond loop stalls to upstream timeouts
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = "stockmarket_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. `observe` is a bisect and two additions, cheap enough
+    to stay on in the hot paths.
+    """
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # One slot per bucket plus +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class LoopLagMonitor:
+    """
+    Measures event-loop lag: how late a sleep of `interval` seconds wakes up.
+    Anything blocking the loop (sync I/O, heavy CPU) shows up here.
+    """
+
+    def __init__(self, interval: Optional[float] = None):
+        self.interval = interval or float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+        self.histogram = Histogram()
+        self.last = 0.0
+        self.max = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            self.last = lag
+            self.max = max(self.max, lag)
+            self.histogram.observe(lag)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+
+loop_lag = LoopLagMonitor()
+
+
+class MetricsWriter:
+    """
+    Builds a Prometheus text exposition (format 0.0.4).
+    """
+
+    def __init__(self):
+        self.lines: List[str] = []
+
+    @staticmethod
+    def _labels(labels: Optional[Dict[str, str]]) -> str:
+        if not labels:
+            return ""
+        pairs = []
+        for key, value in labels.items():
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            pairs.append(f'{key}="{value}"')
+        return "{" + ",".join(pairs) + "}"
+
+    def _header(self, name: str, kind: str, help_text: str):
+        self.lines.append(f"# HELP {PREFIX}{name} {help_text}")
+        self.lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+    def metric(self, name: str, kind: str, help_text: str, samples: Iterable[Tuple[Optional[Dict[str, str]], float]]):
+        self._header(name, kind, help_text)
+        for labels, value in samples:
+            self.lines.append(f"{PREFIX}{name}{self._labels(labels)} {value}")
+
+    def histogram(self, name: str, help_text: str, samples: Iterable[Tuple[Optional[Dict[str, str]], Histogram]]):
+        self._header(name, "histogram", help_text)
+        for labels, hist in samples:
+            cumulative = 0
+            for bound, count in zip(list(hist.buckets) + ["+Inf"], hist.counts):
+                cumulative += count
+                self.lines.append(f"{PREFIX}{name}_bucket{self._labels({**(labels or {}), 'le': bound})} {cumulative}")
+            self.lines.append(f"{PREFIX}{name}_sum{self._labels(labels)} {hist.sum}")
+            self.lines.append(f"{PREFIX}{name}_count{self._labels(labels)} {hist.count}")
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def render_metrics(manager, scheduler, caches: Dict[str, object], http_pool: Optional[Dict] = None) -> str:
+    """
+    Collects everything at scrape time from the counters the components already keep.
+    `caches` maps a cache name to any object with `hits` / `misses` counters,
+    `http_pool` is PooledSmartConnect.pool_stats() (None without a session).
+    """
+    out = MetricsWriter()
+
+    # Upstream (SmartConnect) calls, per method
+    endpoints = list(scheduler.snapshot().items())
+    out.metric("upstream_calls_total", "counter", "SmartConnect calls executed",
+               (({"method": m}, s["calls"]) for m, s in endpoints))
+    out.metric("upstream_errors_total", "counter", "SmartConnect calls that raised or timed out",
+               (({"method": m}, s["errors"]) for m, s in endpoints))
+    out.metric("upstream_coalesced_total", "counter", "Calls served by an identical in-flight request",
+               (({"method": m}, s["coalesced"]) for m, s in endpoints))
+    out.metric("upstream_queue_depth", "gauge", "Calls waiting for a rate-limit token",
+               (({"method": m}, s["queueDepth"]) for m, s in endpoints))
+    out.histogram("upstream_latency_seconds", "SmartConnect call duration",
+                  (({"method": m}, s["latency"]) for m, s in endpoints))
+    out.histogram("upstream_wait_seconds", "Time queued before dispatch",
+                  (({"method": m}, s["wait"]) for m, s in endpoints))
+
+    # Keep-alive HTTP pool to Angel One
+    if http_pool is not None:
+        out.metric("upstream_http_requests_total", "counter", "HTTP requests sent to Angel One", [(None, http_pool["requests"])])
+        out.metric("upstream_http_connections_opened_total", "counter", "New TCP/TLS connections to Angel One",
+                   [(None, http_pool["connectionsOpened"])])
+        out.metric("upstream_http_idle_connections", "gauge", "Idle keep-alive connections in the pool", [(None, http_pool["idleConnections"])])
+        out.metric("upstream_http_retries_total", "counter", "Retried read-only requests", [(None, http_pool["retries"])])
+
+    # Snapshot producer and event loop
+    out.histogram("snapshot_cycle_seconds", "Snapshot producer cycle duration", [(None, manager.cycle_seconds)])
+    out.metric("snapshot_symbols", "gauge", "Symbols in the latest snapshot", [(None, len(manager.latest_calculated_data))])
+    out.histogram("event_loop_lag_seconds", "Event-loop wake-up delay", [(None, loop_lag.histogram)])
+    out.metric("event_loop_lag_max_seconds", "gauge", "Largest event-loop lag seen", [(None, loop_lag.max)])
+
+    # /ws fan-out
+    sessions = list(manager.active_connections.values())
+    depths = Histogram(tuple(float(i) for i in range(sessions[0].QUEUE_SIZE + 1)) if sessions else (0.0,))
+    for session in sessions:
+        depths.observe(len(session.queue))
+    out.metric("ws_connections", "gauge", "Active /ws connections", [(None, len(sessions))])
+    out.histogram("ws_client_queue_depth", "Pending frames per /ws client at scrape time", [(None, depths)])
+    stats = manager.stream_stats()
+    out.metric("ws_frames_dropped_total", "counter", "Frames dropped by conflation or disconnect", [(None, stats["droppedFrames"])])
+    out.metric("ws_frames_conflated_total", "counter", "Conflation events", [(None, stats["conflatedFrames"])])
+
+    # Caches
+    cache_items = list(caches.items())
+    out.metric("cache_hits_total", "counter", "Cache hits", (({"cache": n}, c.hits) for n, c in cache_items))
+    out.metric("cache_misses_total", "counter", "Cache misses", (({"cache": n}, c.misses) for n, c in cache_items))
+    out.metric("cache_hit_ratio", "gauge", "Hits / (hits + misses) since start",
+               (({"cache": n}, round(c.hits / (c.hits + c.misses), 4) if c.hits + c.misses else 0) for n, c in cache_items))
+    return out.render()
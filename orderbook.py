@@ -0,0 +1,94 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+# (exchangeType, token): token numbers are only unique within an exchange
+BookKey = Tuple[int, str]
+
+
+class OrderBookStore:
+    """
+    In-memory best-5 order book per (exchangeType, token), filled by the SmartWebSocketV2 feed.
+    All mutations happen on the asyncio loop thread (see `publish_threadsafe`),
+    so readers on the loop never need a lock.
+    """
+    # SmartWebSocketV2 sends prices in paise
+    PRICE_DIVISOR = 100.0
+
+    def __init__(self, max_age: float = 5.0):
+        self.max_age = max_age
+        self.books: Dict[BookKey, Dict] = {}
+        self.updates = 0
+        # get_fresh lookups served from the feed vs. left to REST polling
+        self.hits = 0
+        self.misses = 0
+        # Set on every update so the snapshot producer can react at exchange latency
+        self.changed = asyncio.Event()
+
+    @classmethod
+    def _parse_levels(cls, levels: Optional[List[Dict]]) -> List[Dict]:
+        return [
+            {
+                'price': level.get('price', 0) / cls.PRICE_DIVISOR,
+                'quantity': level.get('quantity', 0),
+                'orders': level.get('no of orders', 0)
+            }
+            for level in (levels or [])
+        ]
+
+    @classmethod
+    def parse_snap_quote(cls, msg: Dict) -> Optional[Tuple[BookKey, Dict]]:
+        """
+        Converts a parsed SNAP_QUOTE tick into ((exchangeType, token), quote) in the format
+        used by MarketAnalyzer. Returns None for messages without a token or exchange (e.g. heartbeats).
+        """
+        token = msg.get('token')
+        exchange_type = msg.get('exchange_type')
+        if not token or exchange_type is None:
+            return None
+
+        ltp = msg.get('last_traded_price')
+        quote = {
+            'ltp': ltp / cls.PRICE_DIVISOR if ltp is not None else None,
+            'tradedVolume': msg.get('volume_trade_for_the_day', 0),
+            'depth': None
+        }
+        if 'best_5_buy_data' in msg or 'best_5_sell_data' in msg:
+            quote['depth'] = {
+                'buy': cls._parse_levels(msg.get('best_5_buy_data')),
+                'sell': cls._parse_levels(msg.get('best_5_sell_data'))
+            }
+        return (int(exchange_type), str(token)), quote
+
+    def apply(self, key: BookKey, quote: Dict):
+        """
+        Stores the latest quote for an (exchangeType, token). Must run on the loop thread.
+        """
+        quote['updated'] = time.monotonic()
+        self.books[key] = quote
+        self.updates += 1
+        self.changed.set()
+
+    def publish_threadsafe(self, loop: asyncio.AbstractEventLoop, msg: Dict):
+        """
+        Called from the SDK callback thread: parses the tick there and hands
+        the result over to the asyncio loop.
+        """
+        parsed = self.parse_snap_quote(msg)
+        if parsed and not loop.is_closed():
+            loop.call_soon_threadsafe(self.apply, *parsed)
+
+    def get_fresh(self, exchange_type: int, token: str) -> Optional[Dict]:
+        """
+        Latest quote for a token on an exchange, or None if nothing arrived within `max_age` seconds.
+        """
+        quote = self.books.get((exchange_type, token))
+        if quote is None or time.monotonic() - quote['updated'] > self.max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return quote
+
+    def discard(self, exchange_type: int, token: str):
+        self.books.pop((exchange_type, token), None)
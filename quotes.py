@@ -0,0 +1,77 @@
+from typing import Dict, List, Optional
+
+
+class BatchQuoteFetcher:
+    """
+    Batched quote layer on top of SmartConnect.getMarketData.
+    One request covers up to 50 tokens and returns LTP, traded volume and real best-5 depth,
+    instead of one ltpData call per symbol.
+    """
+    MAX_TOKENS_PER_REQUEST = 50
+    MODES = ("LTP", "OHLC", "FULL")
+
+    def __init__(self, mode: str = "FULL", chunk_size: int = MAX_TOKENS_PER_REQUEST):
+        if mode not in self.MODES:
+            raise ValueError(f"Unsupported market data mode: {mode}")
+        self.mode = mode
+        self.chunk_size = max(1, min(chunk_size, self.MAX_TOKENS_PER_REQUEST))
+
+    @staticmethod
+    def exchange_for(symbol: str) -> str:
+        # Symbols are stored as "<TRADINGSYMBOL>.<EXCHANGE>", BSE is the default
+        return "NSE" if symbol.endswith(".NSE") else "BSE"
+
+    def build_chunks(self, token_map: Dict[str, str]) -> List[Dict[str, List[str]]]:
+        """
+        Groups the watchlist into request payloads of at most `chunk_size` tokens each.
+        Each payload has the shape getMarketData expects: {"BSE": ["532540", ...]}
+        """
+        by_exchange: Dict[str, List[str]] = {}
+        for symbol, token in token_map.items():
+            if token:
+                by_exchange.setdefault(self.exchange_for(symbol), []).append(token)
+
+        chunks = []
+        for exchange, tokens in by_exchange.items():
+            for i in range(0, len(tokens), self.chunk_size):
+                chunks.append({exchange: tokens[i:i + self.chunk_size]})
+        return chunks
+
+    @staticmethod
+    def parse_quote(item: Dict) -> Dict:
+        """
+        Converts one entry of the `fetched` list into the format used by MarketAnalyzer.
+        Depth entries already come as {'price', 'quantity', 'orders'}.
+        """
+        depth = item.get('depth') or {}
+        return {
+            'ltp': item.get('ltp'),
+            'tradedVolume': item.get('tradeVolume', 0),
+            'depth': {
+                'buy': depth.get('buy', []),
+                'sell': depth.get('sell', []),
+            } if depth else None
+        }
+
+    def parse_response(self, res: Optional[Dict]) -> Dict[str, Dict]:
+        """
+        Converts one getMarketData response into {token: quote}.
+        Tokens listed as `unfetched` by the API are simply missing from the result.
+        """
+        quotes: Dict[str, Dict] = {}
+        if res and res.get('status') and res.get('data'):
+            for item in res['data'].get('fetched', []):
+                token = str(item.get('symbolToken', ''))
+                if token:
+                    quotes[token] = self.parse_quote(item)
+        else:
+            print(f"Market data error: {res.get('message') if res else 'empty response'}")
+        return quotes
+
+    @staticmethod
+    def merge(results: List[Optional[Dict[str, Dict]]]) -> Dict[str, Dict]:
+        merged: Dict[str, Dict] = {}
+        for result in results:
+            if result:
+                merged.update(result)
+        return merged
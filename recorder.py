@@ -0,0 +1,234 @@
+import importlib
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import defaultdict, deque
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+# Record header: timestamp (float64), kind (uint8), payload length (uint32)
+HEADER = struct.Struct("<dBI")
+KIND_API = 1
+KIND_TICK = 2
+# Set on `kind` when the payload is zlib-compressed
+COMPRESSED = 0x80
+COMPRESS_ABOVE = 256
+# Buffered records reach the file at least this often (seconds) and every FLUSH_RECORDS records
+FLUSH_INTERVAL = 1.0
+FLUSH_RECORDS = 100
+
+
+class Recorder:
+    """
+    Append-only recording of raw upstream responses and feed ticks.
+    Each record is a small binary header followed by a JSON payload (zlib-compressed
+    when large). Safe to call from the upstream pool and the feed thread at once.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+        self.records = 0
+        self._flushed_at = time.monotonic()
+
+    def _write(self, kind: int, payload: Dict, ts: Optional[float] = None):
+        data = json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8")
+        if len(data) > COMPRESS_ABOVE:
+            data = zlib.compress(data)
+            kind |= COMPRESSED
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(HEADER.pack(ts or time.time(), kind, len(data)))
+            self._file.write(data)
+            self.records += 1
+            now = time.monotonic()
+            if self.records % FLUSH_RECORDS == 0 or now - self._flushed_at >= FLUSH_INTERVAL:
+                self._file.flush()
+                self._flushed_at = now
+
+    def record_call(self, method: str, args, kwargs, result, duration: float,
+                    error: Optional[BaseException] = None):
+        payload = {"method": method, "args": args, "kwargs": kwargs, "result": result, "duration": duration}
+        if error is not None:
+            payload["error"] = {"module": type(error).__module__, "type": type(error).__name__, "message": str(error)}
+        self._write(KIND_API, payload)
+
+    def record_tick(self, msg: Dict):
+        self._write(KIND_TICK, msg)
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                self._flushed_at = time.monotonic()
+
+    def close(self):
+        """
+        Flushes the tail of the recording; later writes (e.g. a late feed tick) are dropped.
+        """
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+def read_records(path: str) -> Iterator[Tuple[float, int, Dict]]:
+    """
+    Yields (timestamp, kind, payload) in file order. A truncated last record is ignored.
+    """
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            ts, kind, length = HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            if kind & COMPRESSED:
+                data = zlib.decompress(data)
+            yield ts, kind & ~COMPRESSED, json.loads(data)
+
+
+def _call_key(method: str, args, kwargs) -> str:
+    return json.dumps([method, args, kwargs], sort_keys=True, default=str)
+
+
+class ReplayedError(Exception):
+    """
+    A recorded upstream failure whose original exception type cannot be rebuilt.
+    """
+
+
+def _rebuild_error(error: Dict) -> Exception:
+    try:
+        cls = getattr(importlib.import_module(error["module"]), error["type"])
+        if isinstance(cls, type) and issubclass(cls, Exception):
+            return cls(error["message"])
+    except Exception:
+        pass
+    return ReplayedError(f"{error['type']}: {error['message']}")
+
+
+class RecordingApi:
+    """
+    Transparent SmartConnect proxy that records every call's result, or the exception
+    it raised, so failure paths replay too.
+    """
+
+    def __init__(self, api, recorder: Recorder):
+        self._api = api
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        attr = getattr(self._api, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            started = time.monotonic()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception as e:
+                self._recorder.record_call(name, list(args), kwargs, None, time.monotonic() - started, e)
+                raise
+            self._recorder.record_call(name, list(args), kwargs, result, time.monotonic() - started)
+            return result
+        return call
+
+
+class ReplayApi:
+    """
+    Offline stand-in for SmartConnect that serves recorded responses.
+    A call with exactly the recorded arguments gets the matching responses in order;
+    otherwise (e.g. date ranges that moved) it gets the method's responses round-robin.
+    The recorded latency is reproduced, scaled by `speed` (0 = as fast as possible), and
+    recorded failures are raised again (as the original exception type where possible).
+    """
+
+    def __init__(self, path: str, speed: float = 1.0):
+        self.speed = speed
+        self._by_key: Dict[str, deque] = defaultdict(deque)
+        self._by_method: Dict[str, list] = defaultdict(list)
+        self._cursor: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        for _, kind, payload in read_records(path):
+            if kind == KIND_API:
+                entry = (payload["result"], payload.get("duration", 0.0), payload.get("error"))
+                self._by_key[_call_key(payload["method"], payload["args"], payload["kwargs"])].append(entry)
+                self._by_method[payload["method"]].append(entry)
+
+    def _next(self, method: str, args, kwargs):
+        with self._lock:
+            queue = self._by_key.get(_call_key(method, list(args), kwargs))
+            if queue:
+                entry = queue.popleft()
+                queue.append(entry)
+                return entry
+            entries = self._by_method.get(method)
+            if not entries:
+                return None, 0.0, None
+            i = self._cursor[method] % len(entries)
+            self._cursor[method] += 1
+            return entries[i]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            result, duration, error = self._next(name, args, kwargs)
+            if self.speed > 0 and duration:
+                time.sleep(duration / self.speed)
+            if error is not None:
+                raise _rebuild_error(error)
+            return result
+        return call
+
+
+class ReplayFeed:
+    """
+    Replays recorded feed ticks into a callback (normally the order-book store)
+    with the recorded spacing divided by `speed` (0 = as fast as possible).
+    Runs on its own thread like the real SmartWebSocketV2 feed.
+    """
+
+    def __init__(self, path: str, on_tick: Callable[[Dict], None], speed: float = 1.0, loop: bool = False):
+        self.path = path
+        self.on_tick = on_tick
+        self.speed = speed
+        self.loop = loop
+        self.ticks = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            previous = None
+            for ts, kind, payload in read_records(self.path):
+                if self._stop.is_set():
+                    return
+                if kind != KIND_TICK:
+                    continue
+                if previous is not None and self.speed > 0:
+                    time.sleep(max(0.0, ts - previous) / self.speed)
+                previous = ts
+                self.on_tick(payload)
+                self.ticks += 1
+            if not self.loop:
+                return
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="replay-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+def recorder_from_env() -> Optional[Recorder]:
+    path = os.getenv("RECORD_FILE")
+    return Recorder(path) if path else None
@@ -0,0 +1,232 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Hashable, List, Optional, Tuple
+from fastapi import Request, Response
+from bars import INTERVAL_SECONDS
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the standard library encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only
+    brotli = None
+
+CANDLE_FIELDS = ("date", "open", "high", "low", "close", "volume")
+# Bodies smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+# Larger bodies are compressed on a worker thread to keep the event loop free
+COMPRESS_OFF_LOOP_BYTES = 64 * 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def candles_to_rows(candles: List[List]) -> List[Dict]:
+    """
+    The original /stock-history shape: one object per candle.
+    """
+    return [dict(zip(CANDLE_FIELDS, candle)) for candle in candles]
+
+
+def candles_to_columns(candles: List[List]) -> Dict[str, List]:
+    """
+    Columnar shape: one array per field, no repeated keys.
+    """
+    if not candles:
+        return {field: [] for field in CANDLE_FIELDS}
+    return {field: list(column) for field, column in zip(CANDLE_FIELDS, zip(*candles))}
+
+
+def candles_last_modified(candles: List[List], interval: str) -> datetime:
+    """
+    Close time of the newest bar, capped at now: a bar that is still forming keeps moving
+    Last-Modified forward, a finished range keeps a stable one.
+    """
+    now = datetime.now(timezone.utc)
+    if not candles:
+        return now
+    try:
+        opened = datetime.fromisoformat(str(candles[-1][0]))
+    except ValueError:
+        return now
+    if opened.tzinfo is None:
+        opened = opened.replace(tzinfo=timezone.utc)
+    closed = opened + timedelta(seconds=INTERVAL_SECONDS.get(interval, 86400))
+    return min(now, closed.astimezone(timezone.utc))
+
+
+def _parse_accept_encoding(header: str) -> Dict[str, float]:
+    accepted = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    return accepted
+
+
+def choose_encoding(header: Optional[str]) -> Optional[str]:
+    if not header:
+        return None
+    accepted = _parse_accept_encoding(header)
+
+    def q(name):
+        return accepted.get(name, accepted.get("*", 0.0))
+
+    if brotli is not None and q("br") > 0:
+        return "br"
+    if q("gzip") > 0:
+        return "gzip"
+    return None
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # Weak comparison: W/"x" and "x" match
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+
+def _not_modified(request: Request, etag: str, last_modified: datetime) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CachedEncoder:
+    """
+    Builds cacheable responses: weak ETag from the body, Last-Modified, 304 for matching
+    conditional requests, and gzip / brotli by Accept-Encoding.
+    Compressed bodies are kept in a small LRU keyed by (ETag, encoding), so a chart that
+    many clients load is compressed once. Validators can also be remembered per request
+    key for as long as the data cannot change, so `precheck` answers a matching
+    conditional request with 304 before anything is fetched or serialized.
+    """
+
+    def __init__(self, max_entries: int = 64, max_validators: int = 4096):
+        self.max_entries = max_entries
+        self.max_validators = max_validators
+        self._compressed: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+        # request key -> (ETag, Last-Modified, monotonic expiry)
+        self._validators: "OrderedDict[Hashable, Tuple[str, datetime, float]]" = OrderedDict()
+        self.not_modified = 0
+
+    def _lookup(self, etag: str, encoding: str) -> Optional[bytes]:
+        key = (etag, encoding)
+        data = self._compressed.get(key)
+        if data is not None:
+            self._compressed.move_to_end(key)
+        return data
+
+    def _store(self, etag: str, encoding: str, data: bytes):
+        self._compressed[(etag, encoding)] = data
+        while len(self._compressed) > self.max_entries:
+            self._compressed.popitem(last=False)
+
+    @staticmethod
+    def _headers(etag: str, last_modified: datetime) -> Dict[str, str]:
+        return {
+            "ETag": etag,
+            "Last-Modified": format_datetime(last_modified.astimezone(timezone.utc), usegmt=True),
+            # Always revalidate: cheap with the validators above
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+
+    def precheck(self, request: Request, key: Hashable) -> Optional[Response]:
+        """
+        304 from the validators remembered for `key`, or None when the request has to be served.
+        """
+        if "if-none-match" not in request.headers and "if-modified-since" not in request.headers:
+            return None
+        entry = self._validators.get(key)
+        if entry is None:
+            return None
+        etag, last_modified, expires = entry
+        if expires <= time.monotonic():
+            del self._validators[key]
+            return None
+        if not _not_modified(request, etag, last_modified):
+            return None
+        self.not_modified += 1
+        return Response(status_code=304, headers=self._headers(etag, last_modified))
+
+    def _remember(self, key: Hashable, etag: str, last_modified: datetime, ttl: float):
+        self._validators[key] = (etag, last_modified, time.monotonic() + ttl)
+        self._validators.move_to_end(key)
+        while len(self._validators) > self.max_validators:
+            self._validators.popitem(last=False)
+
+    async def respond(self, request: Request, body: bytes, last_modified: datetime,
+                      key: Optional[Hashable] = None, ttl: Optional[float] = None) -> Response:
+        """
+        With `key` and `ttl`, the validators are remembered for `precheck` for `ttl` seconds.
+        """
+        etag = 'W/"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        headers = self._headers(etag, last_modified)
+        if key is not None and ttl:
+            self._remember(key, etag, last_modified, ttl)
+        if _not_modified(request, etag, last_modified):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+
+        encoding = choose_encoding(request.headers.get("accept-encoding")) if len(body) >= COMPRESS_MIN_BYTES else None
+        if encoding:
+            data = self._lookup(etag, encoding)
+            if data is None:
+                if len(body) >= COMPRESS_OFF_LOOP_BYTES:
+                    data = await asyncio.to_thread(_compress, body, encoding)
+                else:
+                    data = _compress(body, encoding)
+                self._store(etag, encoding, data)
+            body = data
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type="application/json", headers=headers)
+
+
+cached_encoder = CachedEncoder()
@@ -0,0 +1,316 @@
+import asyncio
+import heapq
+import operator
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sortedcontainers import SortedList
+from market import MarketAnalyzer
+from market_hours import market_calendar, PHASE_CLOSED
+from quotes import BatchQuoteFetcher
+from instruments import instrument_index
+from upstream import upstream, PRIORITY_BACKGROUND
+
+# Numeric analysis fields that get a sorted index (sortable and range-filterable)
+INDEXED_FIELDS = (
+    "strengthPercent", "buyPercent", "sellPercent", "totalVolume", "buyVolume", "sellVolume",
+    "tradedVolume", "ltp", "strengthEma", "ofi", "vwap",
+)
+# Other fields that can be filtered on (checked per candidate row)
+TEXT_FIELDS = ("sentiment", "smoothedSentiment", "symbol")
+
+FILTER_OPS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "=": operator.eq,
+    "!=": operator.ne,
+}
+FILTER_PATTERN = re.compile(r"^\s*(\w+)\s*(>=|<=|!=|>|<|=)\s*(.+?)\s*$")
+# Sorts after any token, for exclusive lower / inclusive upper bounds on (value, token) pairs
+MAX_KEY = "\U0010ffff"
+MAX_LIMIT = 500
+
+
+def parse_filter(text: str) -> Tuple[str, str, object]:
+    """
+    Parses "tradedVolume>1000000" / "sentiment=Bullish" into (field, op, value).
+    Raises ValueError for unknown fields or non-numeric values on numeric fields.
+    """
+    match = FILTER_PATTERN.match(text)
+    if not match:
+        raise ValueError(f"Invalid filter: {text}")
+    field, op, raw = match.groups()
+    if field in INDEXED_FIELDS:
+        try:
+            return field, op, float(raw)
+        except ValueError:
+            raise ValueError(f"Filter on {field} needs a number: {text}")
+    if field in TEXT_FIELDS:
+        if op not in ("=", "!="):
+            raise ValueError(f"Only = and != are supported on {field}")
+        return field, op, raw
+    raise ValueError(f"Unknown filter field: {field}")
+
+
+def _indexable(value) -> bool:
+    # bool is an int subclass but not a metric; NaN would break the ordering
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value == value
+
+
+class ScreenerIndex:
+    """
+    Latest analysis per token plus one sorted (value, token) list per numeric field.
+    Updates touch only the indexes of fields whose value changed (O(log n) each), and a
+    top-N query reads either the head of the sort index or the rows in the narrowest
+    filtered range, instead of scanning and sorting the whole universe.
+    """
+
+    def __init__(self, fields: Iterable[str] = INDEXED_FIELDS):
+        self.entries: Dict[str, Dict] = {}
+        self.indexes: Dict[str, SortedList] = {field: SortedList() for field in fields}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def upsert(self, key: str, fields: Dict):
+        """
+        Merges (possibly partial) fields into the entry for `key`.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = {}
+        for field, index in self.indexes.items():
+            if field not in fields:
+                continue
+            old, new = entry.get(field), fields[field]
+            if field in entry and old == new:
+                continue
+            if _indexable(old):
+                index.discard((old, key))
+            if _indexable(new):
+                index.add((new, key))
+        entry.update(fields)
+
+    def remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for field, index in self.indexes.items():
+            if _indexable(entry.get(field)):
+                index.discard((entry[field], key))
+
+    def query(self, sort: str, descending: bool = True, limit: int = 20,
+              filters: Iterable[Tuple[str, str, object]] = (), keys: Optional[Set[str]] = None) -> List[Dict]:
+        """
+        Top `limit` entries by `sort` that pass all `filters` (and are in `keys`, if given).
+        Range filters on indexed fields become index ranges. When another field's range
+        (or `keys`) holds fewer rows than the sort field's, the candidates come from that
+        one and only they are ranked; otherwise the sort index is walked from the requested
+        end and stops after `limit` matches.
+        """
+        if sort not in self.indexes:
+            raise ValueError(f"Cannot sort by {sort}")
+        ranges: Dict[str, Tuple[int, int]] = {}
+        checks = []
+        for field, op, value in filters:
+            checks.append((field, FILTER_OPS[op], value))
+            if field in self.indexes and op != "!=":
+                start, stop = ranges.get(field, (0, len(self.indexes[field])))
+                ranges[field] = self._narrow(self.indexes[field], op, value, start, stop)
+
+        start, stop = ranges.pop(sort, (0, len(self.indexes[sort])))
+        if start >= stop:
+            return []
+        # The smallest candidate set drives the query, the sort range wins ties
+        driver, size = None, stop - start
+        for field, (lo, hi) in ranges.items():
+            if hi - lo < size:
+                driver, size = field, max(0, hi - lo)
+        if keys is not None and len(keys) < size:
+            driver, size = "keys", len(keys)
+
+        if driver is None:
+            candidates = (key for _, key in self.indexes[sort].islice(start, stop, reverse=descending))
+        elif driver == "keys":
+            candidates = iter(keys)
+        else:
+            lo, hi = ranges[driver]
+            candidates = (key for _, key in self.indexes[driver].islice(lo, hi))
+
+        results = []
+        for key in candidates:
+            if keys is not None and key not in keys:
+                continue
+            entry = self.entries.get(key)
+            if entry is None or not all(self._passes(entry.get(f), check, v) for f, check, v in checks):
+                continue
+            if driver is None:
+                results.append(dict(entry, token=key))
+                if len(results) >= limit:
+                    break
+            elif _indexable(entry.get(sort)):
+                results.append((entry[sort], key))
+        if driver is None:
+            return results
+
+        # Same order as the index walk: (value, token), reversed for descending
+        pick = heapq.nlargest if descending else heapq.nsmallest
+        return [dict(self.entries[key], token=key) for key in (k for _, k in pick(limit, results))]
+
+    @staticmethod
+    def _narrow(index: SortedList, op: str, value, start: int, stop: int) -> Tuple[int, int]:
+        """
+        Intersects [start, stop) with the positions of `index` satisfying `op value`.
+        """
+        if op in (">", ">=", "="):
+            lower = index.bisect_right((value, MAX_KEY)) if op == ">" else index.bisect_left((value,))
+            start = max(start, lower)
+        if op in ("<", "<=", "="):
+            upper = index.bisect_left((value,)) if op == "<" else index.bisect_right((value, MAX_KEY))
+            stop = min(stop, upper)
+        return start, stop
+
+    @staticmethod
+    def _passes(actual, check, value) -> bool:
+        if actual is None:
+            return False
+        try:
+            return check(actual, value)
+        except TypeError:
+            return False
+
+
+class Screener:
+    """
+    Keeps the screener index current: every producer tick applies the snapshot's changed
+    fields (watchlist symbols), and with SCREENER_UNIVERSE=true a background scan batch-fetches
+    every BSE equity through getMarketData (50 tokens per request, background priority)
+    and scores them with the vectorized analyzer.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.index = ScreenerIndex()
+        self.universe_enabled = os.getenv("SCREENER_UNIVERSE", "false").lower() == "true"
+        self.universe_interval = float(os.getenv("SCREENER_UNIVERSE_INTERVAL", "60"))
+        self.batch_fetcher = BatchQuoteFetcher("FULL")
+        self.last_scan: Optional[float] = None
+        # symbol -> token of entries fed from the watchlist snapshot
+        self._watched: Dict[str, str] = {}
+        self._task: Optional[asyncio.Task] = None
+        manager.snapshot_listeners.append(self.on_snapshot)
+        manager.watchlists.on_untrack.append(self.on_untrack)
+
+    def _drop(self, token: str):
+        # Universe entries stay (the next scan refreshes them), as do tokens another symbol name holds
+        if not self.universe_enabled and token not in self._watched.values():
+            self.index.remove(token)
+
+    def on_untrack(self, symbol: str, token: str):
+        """
+        Watchlist listener: `symbol` no longer follows `token` (removed, or its token changed).
+        """
+        if self._watched.get(symbol) == token:
+            del self._watched[symbol]
+            self._drop(token)
+
+    def on_snapshot(self, snapshot: List[Dict], changes: List[Dict]):
+        token_map = self.manager.token_map
+        entries: Optional[Dict[str, Dict]] = None
+        for change in changes:
+            symbol = change.get("symbol")
+            if change.get("removed"):
+                token = self._watched.pop(symbol, None)
+                if token is not None:
+                    self._drop(token)
+                continue
+            token = token_map.get(symbol)
+            if not token:
+                continue
+            previous = self._watched.get(symbol)
+            if previous == token:
+                self.index.upsert(token, change)
+                continue
+            # New symbol or new token: the change may be partial, so index the whole entry
+            self._watched[symbol] = token
+            if previous is not None:
+                self._drop(previous)
+            if entries is None:
+                entries = {entry.get("symbol"): entry for entry in snapshot}
+            self.index.upsert(token, entries.get(symbol, change))
+
+        # Catches up on symbols whose token changed without any field changing this tick
+        if len(self._watched) != len(snapshot):
+            for entry in snapshot:
+                symbol = entry.get("symbol")
+                token = token_map.get(symbol)
+                if token and symbol not in self._watched:
+                    self._watched[symbol] = token
+                    self.index.upsert(token, entry)
+
+    def query(self, sort: str = "strengthPercent", order: str = "desc", limit: int = 20,
+              filters: Iterable[str] = (), scope: str = "all") -> List[Dict]:
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be asc or desc")
+        if scope not in ("all", "watchlist"):
+            raise ValueError("scope must be all or watchlist")
+        parsed = [parse_filter(f) for f in filters]
+        keys = set(self.manager.token_map.values()) if scope == "watchlist" else None
+        return self.index.query(sort, order == "desc", max(1, min(limit, MAX_LIMIT)), parsed, keys)
+
+    # --- Universe scan --------------------------------------------------------
+
+    def _apply_chunk(self, quotes: Dict[str, Dict], symbols: Dict[str, str], watched: Set[str]):
+        # Watchlist tokens get fresher data from the producer every tick
+        tokens = [t for t, q in quotes.items() if q.get("depth") and t not in watched]
+        if not tokens:
+            return
+        depths = [dict(quotes[t]["depth"], tradedVolume=quotes[t].get("tradedVolume", 0)) for t in tokens]
+        batch = MarketAnalyzer.calculate_strength_batch(*MarketAnalyzer.depth_to_arrays(depths))
+        for token, record in zip(tokens, MarketAnalyzer.batch_to_records(batch)):
+            record["symbol"] = symbols[token]
+            record["ltp"] = quotes[token].get("ltp")
+            record["tradedVolume"] = quotes[token].get("tradedVolume", 0)
+            self.index.upsert(token, record)
+
+    async def scan_universe(self):
+        """
+        One pass over every BSE equity; chunks are applied as they arrive.
+        """
+        token_map = {f"{e['tradingsymbol']}.BSE": e["symboltoken"] for e in instrument_index.equities("BSE")}
+        symbols = {token: symbol for symbol, token in token_map.items()}
+        watched = set(self.manager.token_map.values())
+
+        async def fetch(chunk):
+            try:
+                res = await upstream.call("getMarketData", self.batch_fetcher.mode, chunk, priority=PRIORITY_BACKGROUND)
+                self._apply_chunk(self.batch_fetcher.parse_response(res), symbols, watched)
+            except Exception as e:
+                print(f"Universe chunk failed: {e}")
+
+        await asyncio.gather(*[fetch(chunk) for chunk in self.batch_fetcher.build_chunks(token_map)])
+        self.last_scan = market_calendar.now().timestamp()
+
+    async def run_universe(self):
+        while True:
+            if instrument_index.ready and (self.manager.angel_api or upstream.remote):
+                try:
+                    await self.scan_universe()
+                except Exception as e:
+                    print(f"Universe scan error: {e}")
+            else:
+                await asyncio.sleep(5)
+                continue
+
+            if self.manager.market_phase == PHASE_CLOSED:
+                # Closing data does not change until the next session
+                until_change = (market_calendar.next_phase_change() - market_calendar.now()).total_seconds()
+                await asyncio.sleep(max(1.0, until_change))
+            else:
+                await asyncio.sleep(self.universe_interval)
+
+    def start(self):
+        if self.universe_enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self.run_universe())
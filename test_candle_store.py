@@ -0,0 +1,95 @@
+"""
+CandleStore range planning and caching, offline against FakeSmartConnect.
+Run: python test_candle_store.py
+"""
+import asyncio
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+from fake_smartapi import FakeSmartConnect
+from candle_store import CandleStore
+from market_hours import MarketCalendar, IST
+
+
+class FixedCalendar(MarketCalendar):
+    def __init__(self, moment: datetime):
+        super().__init__(holidays=[])
+        self.moment = moment
+
+    def now(self) -> datetime:
+        return self.moment
+
+
+def make_store(moment: datetime) -> CandleStore:
+    path = os.path.join(tempfile.mkdtemp(), "candles.db")
+    return CandleStore(path, calendar=FixedCalendar(moment))
+
+
+def d(day: int) -> date:
+    return date(2024, 1, day)
+
+
+def test_missing_ranges():
+    covered = [(d(3), d(5)), (d(8), d(10))]
+    assert CandleStore.missing_ranges(d(1), d(12), covered) == [(d(1), d(2)), (d(6), d(7)), (d(11), d(12))]
+    assert CandleStore.missing_ranges(d(3), d(5), covered) == []
+    assert CandleStore.missing_ranges(d(4), d(9), covered) == [(d(6), d(7))]
+    assert CandleStore.missing_ranges(d(1), d(2), covered) == [(d(1), d(2))]
+    assert CandleStore.missing_ranges(d(1), d(12), []) == [(d(1), d(12))]
+    # Adjacent ranges leave no gap
+    assert CandleStore.missing_ranges(d(3), d(10), [(d(3), d(5)), (d(6), d(10))]) == []
+
+
+def test_split_range():
+    store = make_store(datetime(2024, 1, 10, 12, 0, tzinfo=IST))
+    chunks = store.split_range(date(2024, 1, 1), date(2024, 3, 15), "ONE_MINUTE")
+    assert chunks[0] == (date(2024, 1, 1), date(2024, 1, 30))
+    assert chunks[-1][1] == date(2024, 3, 15)
+    assert all((b - a).days + 1 <= 30 for a, b in chunks)
+    assert all(chunks[i][1] + timedelta(days=1) == chunks[i + 1][0] for i in range(len(chunks) - 1))
+    assert store.split_range(d(5), d(5), "ONE_DAY") == [(d(5), d(5))]
+    assert store.split_range(d(6), d(5), "ONE_DAY") == []
+
+
+def test_last_final_day():
+    # Wednesday mid-session: today can still change
+    assert make_store(datetime(2024, 1, 10, 12, 0, tzinfo=IST)).last_final_day() == d(9)
+    # After the close it is final
+    assert make_store(datetime(2024, 1, 10, 16, 0, tzinfo=IST)).last_final_day() == d(10)
+    # Saturday never trades
+    assert make_store(datetime(2024, 1, 13, 10, 0, tzinfo=IST)).last_final_day() == d(13)
+
+
+def load(store, fake, start, end):
+    async def fetch(params):
+        return fake.getCandleData(params)
+    return asyncio.run(store.get_candles(fetch, "500325", "ONE_DAY", start, end))
+
+
+def test_repeat_loads_skip_upstream():
+    fake = FakeSmartConnect(latency=0, jitter=0)
+    # Saturday: the whole range is final after the first load
+    store = make_store(datetime(2024, 1, 13, 10, 0, tzinfo=IST))
+    first = load(store, fake, d(1), d(13))
+    calls = fake.calls["getCandleData"]
+    assert load(store, fake, d(1), d(13)) == first
+    assert fake.calls["getCandleData"] == calls
+    assert (store.hits, store.misses) == (1, 1)
+
+    # Mid-session: today is refetched only after CANDLE_LIVE_TTL
+    store = make_store(datetime(2024, 1, 10, 12, 0, tzinfo=IST))
+    load(store, fake, d(1), d(10))
+    calls = fake.calls["getCandleData"]
+    load(store, fake, d(1), d(10))
+    assert fake.calls["getCandleData"] == calls
+    store._live.clear()
+    load(store, fake, d(1), d(10))
+    assert fake.calls["getCandleData"] == calls + 1
+
+
+if __name__ == "__main__":
+    test_missing_ranges()
+    test_split_range()
+    test_last_final_day()
+    test_repeat_loads_skip_upstream()
+    print("CandleStore checks passed")
@@ -0,0 +1,60 @@
+"""
+calculate_strength_batch must give exactly what calculate_strength gives, symbol by symbol.
+Runs offline on FakeSmartConnect depth: python test_market_batch.py
+"""
+import random
+from fake_smartapi import FakeSmartConnect
+from market import MarketAnalyzer
+
+
+def fake_depths(count: int, seed: int = 11):
+    fake = FakeSmartConnect(latency=0, jitter=0, seed=seed)
+    tokens = [str(500000 + i) for i in range(count)]
+    res = fake.getMarketData("FULL", {"BSE": tokens})
+    return [dict(item["depth"], tradedVolume=item["tradeVolume"]) for item in res["data"]["fetched"]]
+
+
+def edge_depths():
+    rng = random.Random(5)
+    return [
+        {"buy": [], "sell": []},                                           # no depth at all
+        {"buy": [{"quantity": 0}], "sell": [{"quantity": 0}]},             # zero volume
+        {"buy": [{"quantity": 100}], "sell": []},                          # one-sided
+        {"buy": [{"quantity": 105}], "sell": [{"quantity": 95}], "tradedVolume": 7},   # strength exactly 5
+        {"buy": [{"quantity": 95}], "sell": [{"quantity": 105}]},          # strength exactly -5
+        {"buy": [{"quantity": 1}, {"quantity": 2}], "sell": [{"quantity": 3} for _ in range(5)]},  # short book
+        {"buy": [{"quantity": rng.randint(1, 10 ** 7)} for _ in range(5)],
+         "sell": [{"quantity": rng.randint(1, 10 ** 7)} for _ in range(5)], "tradedVolume": 10 ** 9},
+    ]
+
+
+def assert_batch_matches_scalar(depths):
+    batch = MarketAnalyzer.calculate_strength_batch(*MarketAnalyzer.depth_to_arrays(depths))
+    records = MarketAnalyzer.batch_to_records(batch)
+    assert len(records) == len(depths)
+    for depth, record in zip(depths, records):
+        expected = MarketAnalyzer.calculate_strength(depth)
+        assert record == expected, f"{depth}: batch {record} != scalar {expected}"
+
+
+def test_batch_matches_scalar_on_fake_depth():
+    assert_batch_matches_scalar(fake_depths(2000))
+
+
+def test_batch_matches_scalar_on_edge_cases():
+    assert_batch_matches_scalar(edge_depths())
+
+
+def test_batch_symbols():
+    records = MarketAnalyzer.batch_to_records(
+        MarketAnalyzer.calculate_strength_batch(*MarketAnalyzer.depth_to_arrays(fake_depths(3))),
+        ["A.BSE", "B.BSE", "C.BSE"]
+    )
+    assert [r["symbol"] for r in records] == ["A.BSE", "B.BSE", "C.BSE"]
+
+
+if __name__ == "__main__":
+    test_batch_matches_scalar_on_fake_depth()
+    test_batch_matches_scalar_on_edge_cases()
+    test_batch_symbols()
+    print("calculate_strength_batch matches calculate_strength")
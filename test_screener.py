@@ -0,0 +1,178 @@
+"""
+ScreenerIndex ordering, filters and updates, offline on FakeSmartConnect depth.
+Every query is checked against a plain sort-and-filter over the same rows.
+Run: python test_screener.py
+"""
+import os
+import tempfile
+from fake_smartapi import FakeSmartConnect
+from market import MarketAnalyzer
+from screener import FILTER_OPS, Screener, ScreenerIndex, parse_filter
+from watchlist import WatchlistStore
+from ws_client import diff_snapshots
+
+
+def fake_rows(count: int = 500, seed: int = 7):
+    fake = FakeSmartConnect(latency=0, jitter=0, seed=seed)
+    tokens = [str(500000 + i) for i in range(count)]
+    res = fake.getMarketData("FULL", {"BSE": tokens})
+    rows = {}
+    for item in res["data"]["fetched"]:
+        entry = MarketAnalyzer.calculate_strength(dict(item["depth"], tradedVolume=item["tradeVolume"]))
+        entry["symbol"] = f"SYM{item['symbolToken']}.BSE"
+        entry["ltp"] = item["ltp"]
+        rows[item["symbolToken"]] = entry
+    return rows
+
+
+def build(rows) -> ScreenerIndex:
+    index = ScreenerIndex()
+    for token, entry in rows.items():
+        index.upsert(token, entry)
+    return index
+
+
+def expected(rows, sort, descending=True, limit=20, filters=(), keys=None):
+    matching = [
+        (entry[sort], token) for token, entry in rows.items()
+        if (keys is None or token in keys)
+        and all(FILTER_OPS[op](entry[field], value) for field, op, value in filters)
+    ]
+    matching.sort(reverse=descending)
+    return [token for _, token in matching[:limit]]
+
+
+def tokens(results):
+    return [entry["token"] for entry in results]
+
+
+def test_ordering():
+    rows = fake_rows()
+    index = build(rows)
+    for sort in ("strengthPercent", "tradedVolume", "buyVolume", "ltp"):
+        for descending in (True, False):
+            assert tokens(index.query(sort, descending, 25)) == expected(rows, sort, descending, 25)
+
+
+def test_filters():
+    rows = fake_rows()
+    index = build(rows)
+    volumes = sorted(entry["tradedVolume"] for entry in rows.values())
+    median = volumes[len(volumes) // 2]
+    cases = [
+        # On the sort field: narrows the walked range
+        ("tradedVolume", [f"tradedVolume>{median}"]),
+        ("tradedVolume", [f"tradedVolume<={median}", "tradedVolume>0"]),
+        ("tradedVolume", [f"tradedVolume={volumes[0]}"]),
+        # Narrow range on another field: drives the query
+        ("strengthPercent", [f"tradedVolume>={volumes[-5]}"]),
+        ("sellVolume", [f"tradedVolume<{volumes[10]}", "sentiment!=Neutral"]),
+        # Wide range on another field and text filters: checked per row
+        ("buyPercent", ["ltp>0", "sentiment=Bullish"]),
+        ("strengthPercent", ["tradedVolume!=0"]),
+    ]
+    for sort, texts in cases:
+        parsed = [parse_filter(text) for text in texts]
+        for descending in (True, False):
+            got = tokens(index.query(sort, descending, 20, parsed))
+            assert got == expected(rows, sort, descending, 20, parsed), (sort, texts, descending)
+
+    # Empty ranges
+    assert index.query("ltp", True, 20, [parse_filter("ltp>1e12")]) == []
+    assert index.query("ltp", True, 20, [parse_filter("tradedVolume<0")]) == []
+
+
+def test_keys():
+    rows = fake_rows()
+    index = build(rows)
+    keys = set(list(rows)[:12])
+    assert tokens(index.query("strengthPercent", True, 5, keys=keys)) == expected(rows, "strengthPercent", True, 5, keys=keys)
+    parsed = [parse_filter("buyPercent>=50")]
+    assert tokens(index.query("totalVolume", False, 20, parsed, keys)) == expected(rows, "totalVolume", False, 20, parsed, keys)
+
+
+def test_updates_and_removal():
+    rows = fake_rows(50)
+    index = build(rows)
+    top = tokens(index.query("strengthPercent", True, 1))[0]
+    index.upsert(top, {"strengthPercent": -1000.0})
+    rows[top]["strengthPercent"] = -1000.0
+    assert tokens(index.query("strengthPercent", False, 1)) == [top]
+    assert tokens(index.query("strengthPercent", True, 10)) == expected(rows, "strengthPercent", True, 10)
+
+    index.remove(top)
+    del rows[top]
+    assert top not in tokens(index.query("strengthPercent", False, 50))
+    assert all(top != key for _, key in index.indexes["tradedVolume"])
+
+    # Non-numeric values are kept but never indexed
+    index.upsert("X", {"symbol": "X.BSE", "strengthPercent": None})
+    assert "X" not in tokens(index.query("strengthPercent", True, 100))
+
+
+class FakeManager:
+    """
+    What Screener needs from the socket manager: the watchlists and the snapshot listeners.
+    """
+
+    def __init__(self, defaults):
+        self.watchlists = WatchlistStore(defaults, path=os.path.join(tempfile.mkdtemp(), "watchlists.json"))
+        self.snapshot_listeners = []
+        self.latest = {}
+
+    @property
+    def token_map(self):
+        return self.watchlists.tracked
+
+    def tick(self, rows):
+        """
+        Publishes a snapshot of the tracked symbols, with each symbol's row taken from its token.
+        """
+        snapshot = [dict(rows[token], symbol=symbol) for symbol, token in self.token_map.items()]
+        changes = diff_snapshots(self.latest, snapshot)
+        self.latest = {entry["symbol"]: entry for entry in snapshot}
+        for listener in self.snapshot_listeners:
+            listener(snapshot, changes)
+
+
+def test_screener_follows_token_changes():
+    rows = fake_rows(10)
+    tokens_ = list(rows)
+    manager = FakeManager({"A.BSE": tokens_[0], "B.BSE": tokens_[1]})
+    screener = Screener(manager)
+    manager.tick(rows)
+    assert set(screener.index.entries) == {tokens_[0], tokens_[1]}
+
+    # Same-size swap: A.BSE now follows another token, with identical analysis fields
+    rows[tokens_[2]] = dict(rows[tokens_[0]])
+    manager.watchlists.add("A.BSE", tokens_[2])
+    manager.tick(rows)
+    assert set(screener.index.entries) == {tokens_[1], tokens_[2]}
+    assert all(key != tokens_[0] for index in screener.index.indexes.values() for _, key in index)
+    assert screener.index.entries[tokens_[2]]["strengthPercent"] == rows[tokens_[0]]["strengthPercent"]
+
+    # Removal
+    manager.watchlists.remove("B.BSE")
+    manager.tick(rows)
+    assert set(screener.index.entries) == {tokens_[2]}
+
+
+def test_parse_filter():
+    assert parse_filter("tradedVolume > 1000000") == ("tradedVolume", ">", 1000000.0)
+    assert parse_filter("sentiment=Bullish") == ("sentiment", "=", "Bullish")
+    for bad in ("volume>1", "ltp>abc", "sentiment>Bullish", "nonsense"):
+        try:
+            parse_filter(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"{bad} should not parse")
+
+
+if __name__ == "__main__":
+    test_ordering()
+    test_filters()
+    test_keys()
+    test_updates_and_removal()
+    test_screener_follows_token_changes()
+    test_parse_filter()
+    print("Screener index checks passed")
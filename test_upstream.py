@@ -0,0 +1,97 @@
+"""
+TokenBucket and UpstreamScheduler ordering / coalescing, offline against FakeSmartConnect.
+Run: python test_upstream.py
+"""
+import asyncio
+import threading
+import time
+from fake_smartapi import FakeSmartConnect
+from upstream import UpstreamScheduler, TokenBucket, PRIORITY_INTERACTIVE, PRIORITY_STREAM, PRIORITY_BACKGROUND
+
+
+class RecordingApi(FakeSmartConnect):
+    """
+    Remembers the order in which searchScrip calls reached the API.
+    """
+
+    def __init__(self):
+        super().__init__(latency=0.05, jitter=0, seed=1)
+        self.order = []
+        self._order_lock = threading.Lock()
+
+    def searchScrip(self, exchange, searchscrip):
+        with self._order_lock:
+            self.order.append(searchscrip)
+        return super().searchScrip(exchange, searchscrip)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(10, capacity=2)
+    assert bucket.wait_time() == 0
+    bucket.consume()
+    bucket.consume()
+    assert 0.05 < bucket.wait_time() <= 0.1
+    time.sleep(0.25)
+    # Refill is capped at the capacity
+    assert bucket.wait_time() == 0
+    bucket._refill(time.monotonic())
+    assert bucket.tokens <= 2
+
+
+def test_priority_order():
+    async def run():
+        api = RecordingApi()
+        scheduler = UpstreamScheduler(api)
+        scheduler._endpoint("searchScrip")
+        # One call every 20 ms, so dispatch order is the order the API sees
+        scheduler._buckets["searchScrip"] = TokenBucket(50, capacity=1)
+        await asyncio.gather(
+            scheduler.call("searchScrip", "BSE", "bg1", priority=PRIORITY_BACKGROUND),
+            scheduler.call("searchScrip", "BSE", "bg2", priority=PRIORITY_BACKGROUND),
+            scheduler.call("searchScrip", "BSE", "stream", priority=PRIORITY_STREAM),
+            scheduler.call("searchScrip", "BSE", "user", priority=PRIORITY_INTERACTIVE),
+        )
+        return api.order
+
+    assert asyncio.run(run()) == ["user", "stream", "bg1", "bg2"]
+
+
+def test_coalescing():
+    async def run():
+        api = RecordingApi()
+        scheduler = UpstreamScheduler(api)
+        results = await asyncio.gather(*[scheduler.call("searchScrip", "BSE", "TCS") for _ in range(5)])
+        separate = await scheduler.call("searchScrip", "BSE", "TCS", coalesce=False)
+        return api, scheduler.stats()["searchScrip"], results, separate
+
+    api, stats, results, separate = asyncio.run(run())
+    assert api.order == ["TCS", "TCS"]
+    assert stats["calls"] == 2 and stats["coalesced"] == 4
+    assert all(result == results[0] for result in results)
+    assert separate == results[0]
+
+
+def test_coalesced_caller_raises_priority():
+    async def run():
+        api = RecordingApi()
+        scheduler = UpstreamScheduler(api)
+        scheduler._endpoint("searchScrip")
+        scheduler._buckets["searchScrip"] = TokenBucket(50, capacity=1)
+        await asyncio.gather(
+            scheduler.call("searchScrip", "BSE", "first", priority=PRIORITY_BACKGROUND),
+            scheduler.call("searchScrip", "BSE", "bg", priority=PRIORITY_BACKGROUND),
+            scheduler.call("searchScrip", "BSE", "shared", priority=PRIORITY_BACKGROUND),
+            # Same request again, interactive: the shared request moves ahead of "bg"
+            scheduler.call("searchScrip", "BSE", "shared", priority=PRIORITY_INTERACTIVE),
+        )
+        return api.order
+
+    assert asyncio.run(run()) == ["shared", "first", "bg"]
+
+
+if __name__ == "__main__":
+    test_token_bucket()
+    test_priority_order()
+    test_coalescing()
+    test_coalesced_caller_raises_priority()
+    print("Upstream scheduler checks passed")
@@ -0,0 +1,66 @@
+"""
+WatchlistStore tracking: reference counts, token changes and symbol names sharing a token.
+Run: python test_watchlist.py
+"""
+import os
+import tempfile
+from watchlist import WatchlistStore
+
+DEFAULTS = {"TCS.BSE": "532540", "INFY.BSE": "500209"}
+
+
+def make_store():
+    store = WatchlistStore(dict(DEFAULTS), path=os.path.join(tempfile.mkdtemp(), "watchlists.json"))
+    events = []
+    store.on_track.append(lambda symbol, token: events.append(("track", symbol, token)))
+    store.on_untrack.append(lambda symbol, token: events.append(("untrack", symbol, token)))
+    return store, events
+
+
+def test_two_symbols_on_one_token():
+    store, events = make_store()
+    store.add("TCS", "532540", "alice")
+    assert list(store.tracked.items())[0] == ("TCS", "532540")
+    assert store.tracked["TCS.BSE"] == "532540"
+    assert events == [("track", "TCS", "532540")]
+
+    # Removing one name keeps the other
+    store.remove("TCS", "alice")
+    assert "TCS" not in store.tracked and store.tracked["TCS.BSE"] == "532540"
+    assert events[-1] == ("untrack", "TCS", "532540")
+
+
+def test_refcounts():
+    store, events = make_store()
+    store.add("TCS.BSE", "532540", "alice")
+    store.remove("TCS.BSE", "alice")
+    # Still held by the default list
+    assert store.tracked["TCS.BSE"] == "532540"
+    assert events == []
+    store.remove("TCS.BSE")
+    assert "TCS.BSE" not in store.tracked
+    assert events == [("untrack", "TCS.BSE", "532540")]
+
+
+def test_token_change_falls_back():
+    store, events = make_store()
+    store.add("INFY.BSE", "999999", "alice")
+    assert store.tracked["INFY.BSE"] == "999999"
+    store.remove("INFY.BSE", "alice")
+    # The default list still holds the original token
+    assert store.tracked["INFY.BSE"] == "500209"
+    assert events[-1] == ("track", "INFY.BSE", "500209")
+
+
+def test_get_does_not_register():
+    store, _ = make_store()
+    assert [e["symbol"] for e in store.get("bob").to_list()] == list(DEFAULTS)
+    assert "bob" not in store.watchlists
+
+
+if __name__ == "__main__":
+    test_two_symbols_on_one_token()
+    test_refcounts()
+    test_token_change_falls_back()
+    test_get_does_not_register()
+    print("Watchlist tracking checks passed")
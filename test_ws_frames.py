@@ -0,0 +1,136 @@
+"""
+/ws delta frames and queue conflation (ws_client.diff_snapshots / conflate), offline.
+Snapshots are analyses of FakeSmartConnect depth. Run: python test_ws_frames.py
+"""
+from fake_smartapi import FakeSmartConnect
+from market import MarketAnalyzer
+from ws_client import ClientSession, conflate, diff_snapshots
+
+
+def fake_snapshot(fake: FakeSmartConnect, count: int = 20):
+    res = fake.getMarketData("FULL", {"BSE": [str(500000 + i) for i in range(count)]})
+    snapshot = []
+    for item in res["data"]["fetched"]:
+        entry = MarketAnalyzer.calculate_strength(dict(item["depth"], tradedVolume=item["tradeVolume"]))
+        entry["symbol"] = f"SYM{item['symbolToken']}.BSE"
+        entry["ltp"] = item["ltp"]
+        snapshot.append(entry)
+    return snapshot
+
+
+def apply(state, changes):
+    state = {symbol: dict(entry) for symbol, entry in state.items()}
+    for change in changes:
+        if change.get("removed"):
+            state.pop(change["symbol"], None)
+        else:
+            state.setdefault(change["symbol"], {}).update(change)
+    return state
+
+
+def by_symbol(snapshot):
+    return {entry["symbol"]: entry for entry in snapshot}
+
+
+def test_diff_snapshots():
+    fake = FakeSmartConnect(latency=0, jitter=0, seed=3)
+    before, after = fake_snapshot(fake), fake_snapshot(fake)
+    changes = diff_snapshots(by_symbol(before), after)
+    assert apply(by_symbol(before), changes) == by_symbol(after)
+    # Only changed fields are sent, always with the symbol
+    for change in changes:
+        old = by_symbol(before)[change["symbol"]]
+        assert all(old.get(k) != v for k, v in change.items() if k != "symbol")
+
+    assert diff_snapshots(by_symbol(after), after) == []
+    new = dict(after[0], symbol="NEW.BSE")
+    assert diff_snapshots(by_symbol(after), after + [new])[-1] == new
+    # Symbols that left the snapshot are announced
+    assert diff_snapshots(by_symbol(after), after[1:]) == [{"symbol": after[0]["symbol"], "removed": True}]
+
+
+def test_conflate_removals():
+    fake = FakeSmartConnect(latency=0, jitter=0, seed=7)
+    first, second = fake_snapshot(fake), fake_snapshot(fake)
+    removed = first[0]["symbol"]
+    deltas = [
+        ("delta", {"type": "delta", "data": diff_snapshots(by_symbol(first), second[1:])}),
+        ("delta", {"type": "delta", "data": diff_snapshots(by_symbol(second[1:]), second[1:])}),
+    ]
+    # Deltas only: the removal is kept for the client
+    kind, frame = conflate(deltas)
+    assert kind == "delta" and {"symbol": removed, "removed": True} in frame["data"]
+    assert apply(by_symbol(first), frame["data"]) == by_symbol(second[1:])
+
+    # On top of a snapshot the symbol just disappears
+    kind, frame = conflate([("snapshot", {"type": "snapshot", "data": first})] + deltas)
+    assert kind == "snapshot" and by_symbol(frame["data"]) == by_symbol(second[1:])
+
+    # Removed, then added back: the new entry arrives whole
+    back = ("delta", {"type": "delta", "data": diff_snapshots(by_symbol(second[1:]), second)})
+    kind, frame = conflate(deltas + [back])
+    assert apply(by_symbol(first), frame["data"]) == by_symbol(second)
+
+
+def test_invalid_symbols_get_an_error_frame():
+    session = ClientSession(None, mode="delta")
+    session.needs_snapshot = False
+    for message in ('{"action": "subscribe", "symbols": "TCS.BSE"}',
+                    '{"action": "subscribe", "symbols": 5}',
+                    '{"action": "unsubscribe", "symbols": ["A.BSE", 1]}'):
+        assert session.handle_message(message) is False
+        kind, frame, _ = session.queue.pop()
+        assert kind == "error" and frame["type"] == "error"
+    assert session.symbols is None and not session.needs_snapshot
+    assert session.handle_message('{"action": "subscribe", "symbols": ["TCS.BSE"]}')
+    assert session.symbols == {"TCS.BSE"}
+
+
+def test_conflate_deltas_keep_latest_state():
+    fake = FakeSmartConnect(latency=0, jitter=0, seed=4)
+    snapshots = [fake_snapshot(fake) for _ in range(5)]
+    frames = [("snapshot", {"type": "snapshot", "data": snapshots[0]})]
+    for previous, current in zip(snapshots, snapshots[1:]):
+        frames.append(("delta", {"type": "delta", "data": diff_snapshots(by_symbol(previous), current)}))
+
+    kind, frame = conflate(frames)
+    assert kind == "snapshot" and frame["type"] == "snapshot"
+    assert by_symbol(frame["data"]) == by_symbol(snapshots[-1])
+
+    # Deltas alone stay a delta carrying the merged changes
+    kind, frame = conflate(frames[1:])
+    assert kind == "delta"
+    assert apply(by_symbol(snapshots[0]), frame["data"]) == by_symbol(snapshots[-1])
+
+
+def test_conflate_full_frames():
+    fake = FakeSmartConnect(latency=0, jitter=0, seed=5)
+    first, second = fake_snapshot(fake), fake_snapshot(fake, count=10)
+    kind, frame = conflate([("full", first), ("full", second)])
+    assert kind == "full" and frame == second
+
+
+def test_queue_overflow_conflates():
+    fake = FakeSmartConnect(latency=0, jitter=0, seed=6)
+    session = ClientSession(None, mode="delta")
+    snapshots = [fake_snapshot(fake) for _ in range(ClientSession.QUEUE_SIZE + 3)]
+    session.offer("snapshot", {"type": "snapshot", "data": snapshots[0]}, "")
+    for previous, current in zip(snapshots, snapshots[1:]):
+        session.offer("delta", {"type": "delta", "data": diff_snapshots(by_symbol(previous), current)}, "")
+
+    assert session.conflated >= 1
+    assert len(session.queue) <= ClientSession.QUEUE_SIZE
+    state = {}
+    for kind, frame, _ in session.queue:
+        state = by_symbol(frame["data"]) if kind == "snapshot" else apply(state, frame["data"])
+    assert state == by_symbol(snapshots[-1])
+
+
+if __name__ == "__main__":
+    test_diff_snapshots()
+    test_conflate_deltas_keep_latest_state()
+    test_conflate_removals()
+    test_invalid_symbols_get_an_error_frame()
+    test_conflate_full_frames()
+    test_queue_overflow_conflates()
+    print("Delta and conflation checks passed")
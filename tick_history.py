@@ -0,0 +1,131 @@
+import os
+from typing import Dict, List, Optional
+import numpy as np
+from market import MarketAnalyzer
+
+LEVELS = 5
+
+
+class SymbolTicks:
+    """
+    Ring of ticks for one symbol in preallocated NumPy columns:
+    timestamp, LTP, traded volume and the best-5 bid/ask prices and quantities.
+    """
+    __slots__ = ("capacity", "head", "count", "ts", "ltp", "volume", "bid_price", "bid_qty", "ask_price", "ask_qty")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.head = 0  # next write position
+        self.count = 0
+        self.ts = np.zeros(capacity, dtype=np.float64)
+        self.ltp = np.zeros(capacity, dtype=np.float64)
+        self.volume = np.zeros(capacity, dtype=np.int64)
+        self.bid_price = np.zeros((capacity, LEVELS), dtype=np.float64)
+        self.bid_qty = np.zeros((capacity, LEVELS), dtype=np.int64)
+        self.ask_price = np.zeros((capacity, LEVELS), dtype=np.float64)
+        self.ask_qty = np.zeros((capacity, LEVELS), dtype=np.int64)
+
+    @staticmethod
+    def row_bytes() -> int:
+        return 8 * 3 + 8 * LEVELS * 4
+
+    def append(self, ts: float, ltp: float, volume: int, depth: Dict):
+        i = self.head
+        self.ts[i] = ts
+        self.ltp[i] = ltp
+        self.volume[i] = volume or 0
+        for side, prices, quantities in (('buy', self.bid_price, self.bid_qty), ('sell', self.ask_price, self.ask_qty)):
+            levels = depth.get(side, [])
+            for j in range(LEVELS):
+                if j < len(levels):
+                    prices[i, j] = levels[j].get('price', 0) or 0
+                    quantities[i, j] = levels[j].get('quantity', 0) or 0
+                else:
+                    prices[i, j] = 0
+                    quantities[i, j] = 0
+        self.head = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def ordered_indexes(self) -> np.ndarray:
+        """
+        Ring positions oldest first.
+        """
+        start = (self.head - self.count) % self.capacity
+        return (np.arange(self.count) + start) % self.capacity
+
+    def window(self, start_ts: float, end_ts: float) -> np.ndarray:
+        """
+        Ring positions of ticks with start_ts <= ts <= end_ts, oldest first (binary search,
+        ticks are appended in time order).
+        """
+        order = self.ordered_indexes()
+        ts = self.ts[order]
+        lo = np.searchsorted(ts, start_ts, side="left")
+        hi = np.searchsorted(ts, end_ts, side="right")
+        return order[lo:hi]
+
+
+class TickHistory:
+    """
+    Compact per-symbol tick history with a hard memory budget.
+    Every symbol gets a fixed-capacity ring; once the budget is used up new symbols
+    are not recorded until others are dropped.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, rows_per_symbol: Optional[int] = None):
+        self.max_bytes = max_bytes or int(float(os.getenv("TICK_HISTORY_MAX_MB", "128")) * 1024 * 1024)
+        # ~2.2 MB per symbol: a full session (6h15m) at one tick every two seconds.
+        # At 1-5 ticks/s (live feed) it holds the last ~3.3 h down to ~40 min instead.
+        self.rows_per_symbol = rows_per_symbol or int(os.getenv("TICK_HISTORY_ROWS", "12000"))
+        self.symbols: Dict[str, SymbolTicks] = {}
+        self._rejected = set()
+
+    @property
+    def used_bytes(self) -> int:
+        return len(self.symbols) * self.rows_per_symbol * SymbolTicks.row_bytes()
+
+    def record(self, symbol: str, ts: float, ltp: float, volume: int, depth: Dict):
+        ticks = self.symbols.get(symbol)
+        if ticks is None:
+            if self.used_bytes + self.rows_per_symbol * SymbolTicks.row_bytes() > self.max_bytes:
+                if symbol not in self._rejected:
+                    self._rejected.add(symbol)
+                    print(f"Tick history budget reached, not recording {symbol}")
+                return
+            ticks = self.symbols[symbol] = SymbolTicks(self.rows_per_symbol)
+        ticks.append(ts, ltp, volume, depth)
+
+    def drop(self, symbol: str):
+        self.symbols.pop(symbol, None)
+        self._rejected.discard(symbol)
+
+    def query(self, symbol: str, start_ts: float, end_ts: float, limit: int = 1000) -> Optional[List[Dict]]:
+        """
+        Recomputes the analysis for every stored tick in [start_ts, end_ts] with the
+        vectorized analyzer. Evenly downsampled to at most `limit` points.
+        Returns None if the symbol is not recorded.
+        """
+        ticks = self.symbols.get(symbol)
+        if ticks is None:
+            return None
+
+        rows = ticks.window(start_ts, end_ts)
+        if limit and len(rows) > limit:
+            rows = rows[np.linspace(0, len(rows) - 1, limit).astype(np.int64)]
+
+        batch = MarketAnalyzer.calculate_strength_batch(ticks.bid_qty[rows], ticks.ask_qty[rows], ticks.volume[rows])
+        records = MarketAnalyzer.batch_to_records(batch)
+        timestamps = ticks.ts[rows].tolist()
+        ltps = ticks.ltp[rows].tolist()
+        best_bids = ticks.bid_price[rows, 0].tolist()
+        best_asks = ticks.ask_price[rows, 0].tolist()
+        for i, record in enumerate(records):
+            record["symbol"] = symbol
+            record["timestamp"] = timestamps[i]
+            record["ltp"] = ltps[i]
+            record["bestBid"] = best_bids[i]
+            record["bestAsk"] = best_asks[i]
+        return records
+
+
+tick_history = TickHistory()
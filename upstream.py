@@ -0,0 +1,259 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from metrics import Histogram
+
+# Priority classes, lower value is dispatched first
+PRIORITY_INTERACTIVE = 0  # user facing: history, search
+PRIORITY_STREAM = 1       # snapshot producer quotes
+PRIORITY_BACKGROUND = 2   # cache warm-up and refresh
+
+# Dedicated pool for blocking upstream I/O (SmartConnect, login), separate from asyncio's default executor
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "16"))
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "10"))
+upstream_pool = ThreadPoolExecutor(max_workers=UPSTREAM_POOL_SIZE, thread_name_prefix="upstream")
+
+
+async def run_blocking(func: Callable, *args, timeout: Optional[float] = None, **kwargs):
+    """
+    Runs a blocking upstream call on the dedicated pool and awaits it with a timeout.
+    On timeout the caller gets asyncio.TimeoutError; the worker thread finishes in the background.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(upstream_pool, functools.partial(func, *args, **kwargs))
+    return await asyncio.wait_for(future, timeout if timeout is not None else UPSTREAM_TIMEOUT)
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second, bursts up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """
+        Seconds until one token is available (0 if available now).
+        """
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+
+class _Request:
+    __slots__ = ("method", "args", "kwargs", "future", "enqueued", "dispatched", "key")
+
+    def __init__(self, method: str, args: Tuple, kwargs: Dict, future: asyncio.Future, key):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.dispatched = False
+        self.key = key
+
+
+class _EndpointStats:
+    __slots__ = ("calls", "errors", "coalesced", "wait_total", "wait_max", "wait", "latency")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.coalesced = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait = Histogram()
+        self.latency = Histogram()
+
+
+class UpstreamScheduler:
+    """
+    Central gateway for every SmartConnect call.
+    - token bucket per endpoint, so bursts never exceed Angel One's request limits
+    - priority queue per endpoint: interactive requests overtake background refreshes
+    - request coalescing: identical in-flight calls share one upstream request
+    Queue depth and wait times are available from `stats()`.
+    """
+    # Requests per second per SmartConnect method (override with UPSTREAM_RATE_<METHOD>)
+    DEFAULT_RATES = {
+        "ltpData": 10,
+        "getMarketData": 10,
+        "getCandleData": 3,
+        "searchScrip": 1,
+    }
+    DEFAULT_RATE = 5
+
+    def __init__(self, api=None):
+        self.api = api
+        # Worker processes forward calls to the ingest process, which owns the session and the limits
+        self.remote = None
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._queues: Dict[str, List] = {}
+        self._wakeups: Dict[str, asyncio.Event] = {}
+        self._dispatchers: Dict[str, asyncio.Task] = {}
+        # Running _execute tasks: the loop only keeps weak references to tasks
+        self._executing: Set[asyncio.Task] = set()
+        self._in_flight: Dict[Any, _Request] = {}
+        self._stats: Dict[str, _EndpointStats] = {}
+        self._seq = itertools.count()
+
+    def set_api(self, api):
+        self.api = api
+
+    def set_remote(self, remote):
+        self.remote = remote
+
+    @staticmethod
+    def timeout_for(method: str) -> float:
+        return float(os.getenv(f"UPSTREAM_TIMEOUT_{method.upper()}", UPSTREAM_TIMEOUT))
+
+    def rate_for(self, method: str) -> float:
+        default = self.DEFAULT_RATES.get(method, self.DEFAULT_RATE)
+        return float(os.getenv(f"UPSTREAM_RATE_{method.upper()}", default))
+
+    @staticmethod
+    def _key(method: str, args: Tuple, kwargs: Dict):
+        return (method, repr(args), repr(sorted(kwargs.items())))
+
+    def _endpoint(self, method: str):
+        if method not in self._buckets:
+            self._buckets[method] = TokenBucket(self.rate_for(method))
+            self._queues[method] = []
+            self._wakeups[method] = asyncio.Event()
+            self._stats[method] = _EndpointStats()
+        task = self._dispatchers.get(method)
+        if task is None or task.done():
+            self._dispatchers[method] = asyncio.create_task(self._dispatch(method))
+
+    async def call(self, method: str, *args, priority: int = PRIORITY_BACKGROUND, coalesce: bool = True, **kwargs):
+        """
+        Queues a SmartConnect call and returns its result once it has been executed.
+        """
+        if self.remote is not None:
+            return await self.remote.call(method, args, kwargs, priority)
+        if self.api is None:
+            raise RuntimeError("Angel One API is not connected")
+
+        self._endpoint(method)
+        key = self._key(method, args, kwargs) if coalesce else None
+
+        request = self._in_flight.get(key) if key is not None else None
+        if request is not None:
+            self._stats[method].coalesced += 1
+            if not request.dispatched:
+                # Re-queue with this caller's priority, the dispatcher skips the stale entry
+                heapq.heappush(self._queues[method], (priority, next(self._seq), request))
+        else:
+            request = _Request(method, args, kwargs, asyncio.get_running_loop().create_future(), key)
+            if key is not None:
+                self._in_flight[key] = request
+            heapq.heappush(self._queues[method], (priority, next(self._seq), request))
+
+        self._wakeups[method].set()
+        # shield: one cancelled caller must not cancel the shared request
+        return await asyncio.shield(request.future)
+
+    async def _dispatch(self, method: str):
+        queue = self._queues[method]
+        bucket = self._buckets[method]
+        wakeup = self._wakeups[method]
+        while True:
+            while not queue:
+                wakeup.clear()
+                await wakeup.wait()
+
+            delay = bucket.wait_time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, request = heapq.heappop(queue)
+            if request.dispatched:
+                continue
+            request.dispatched = True
+            bucket.consume()
+
+            waited = time.monotonic() - request.enqueued
+            stats = self._stats[method]
+            stats.wait_total += waited
+            stats.wait_max = max(stats.wait_max, waited)
+            stats.wait.observe(waited)
+            task = asyncio.create_task(self._execute(request))
+            self._executing.add(task)
+            task.add_done_callback(self._executing.discard)
+
+    async def _execute(self, request: _Request):
+        stats = self._stats[request.method]
+        stats.calls += 1
+        started = time.monotonic()
+        try:
+            func = getattr(self.api, request.method)
+            result = await run_blocking(func, *request.args, timeout=self.timeout_for(request.method), **request.kwargs)
+            request.future.set_result(result)
+        except Exception as e:
+            stats.errors += 1
+            request.future.set_exception(e)
+        finally:
+            stats.latency.observe(time.monotonic() - started)
+            if request.key is not None:
+                self._in_flight.pop(request.key, None)
+            # Nobody may be awaiting anymore, avoid "exception was never retrieved"
+            if request.future.done() and not request.future.cancelled():
+                request.future.exception()
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """
+        Raw per-endpoint counters plus the wait / latency histograms, for /metrics and stats().
+        """
+        result = {}
+        for method, stats in self._stats.items():
+            result[method] = {
+                "queueDepth": sum(1 for _, _, r in self._queues[method] if not r.dispatched),
+                "ratePerSecond": self._buckets[method].rate,
+                "calls": stats.calls,
+                "errors": stats.errors,
+                "coalesced": stats.coalesced,
+                "waitTotal": stats.wait_total,
+                "waitMax": stats.wait_max,
+                "wait": stats.wait,
+                "latency": stats.latency,
+            }
+        return result
+
+    def stats(self) -> Dict[str, Dict]:
+        result = {}
+        for method, snap in self.snapshot().items():
+            dispatched = snap["calls"] or 1
+            latency = snap["latency"]
+            result[method] = {
+                "queueDepth": snap["queueDepth"],
+                "ratePerSecond": snap["ratePerSecond"],
+                "calls": snap["calls"],
+                "errors": snap["errors"],
+                "coalesced": snap["coalesced"],
+                "avgWaitMs": round(snap["waitTotal"] / dispatched * 1000, 2),
+                "maxWaitMs": round(snap["waitMax"] * 1000, 2),
+                "avgLatencyMs": round(latency.sum / (latency.count or 1) * 1000, 2)
+            }
+        return result
+
+
+upstream = UpstreamScheduler()
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+from market_hours import MarketCalendar, IST, market_calendar
+
+
+class VolumeCache:
+    """
+    Caches the latest daily traded volume per token.
+    An entry stays valid until the next session's daily candle is available
+    (next session close plus a short settle delay), so the 5-day candle request
+    happens once per session instead of once per tick.
+    """
+
+    def __init__(self, calendar: MarketCalendar = market_calendar, settle_delay: timedelta = timedelta(minutes=15)):
+        self.calendar = calendar
+        self.settle_delay = settle_delay
+        self._entries: Dict[str, Tuple[int, datetime]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def expiry_for(self, fetched_at: Optional[datetime] = None) -> datetime:
+        return self.calendar.next_session_close(fetched_at) + self.settle_delay
+
+    def get(self, token: str, now: Optional[datetime] = None) -> Optional[int]:
+        entry = self._entries.get(token)
+        if entry is None or entry[1] <= (now or self.calendar.now()):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def put(self, token: str, volume: int, now: Optional[datetime] = None):
+        self._entries[token] = (volume, self.expiry_for(now))
+
+    def needs_refresh(self, token: str, now: Optional[datetime] = None) -> bool:
+        entry = self._entries.get(token)
+        return entry is None or entry[1] <= (now or self.calendar.now())
+
+    def next_expiry(self) -> Optional[datetime]:
+        if not self._entries:
+            return None
+        return min(expires for _, expires in self._entries.values())
+
+    @staticmethod
+    def daily_candle_params(token: str, exchange: str = "BSE") -> Dict:
+        """
+        getCandleData parameters for the last 5 ONE_DAY candles.
+        """
+        now = datetime.now(IST)
+        today = now.strftime("%Y-%m-%d")
+        five_days_ago = (now - timedelta(days=5)).strftime("%Y-%m-%d")
+
+        return {
+            "exchange": exchange,
+            "symboltoken": token,
+            "interval": "ONE_DAY",
+            "fromdate": f"{five_days_ago} 00:00",
+            "todate": f"{today} 23:59"
+        }
+
+    @staticmethod
+    def volume_from_response(candle_res: Optional[Dict]) -> Optional[int]:
+        if candle_res and candle_res.get('data'):
+            # Get the last candle (latest date)
+            # Input: [timestamp, open, high, low, close, volume]
+            return candle_res['data'][-1][5]
+        return None
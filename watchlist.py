@@ -0,0 +1,200 @@
+import json
+import os
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class Watchlist:
+    """
+    Ordered symbol -> token mapping with O(1) add, remove and move-to-front.
+    """
+
+    def __init__(self, items: Optional[Dict[str, str]] = None):
+        self.items: "OrderedDict[str, str]" = OrderedDict(items or {})
+
+    def add(self, symbol: str, token: str) -> bool:
+        """
+        Adds the symbol at the front (or moves it there). Returns True if it was new.
+        """
+        is_new = symbol not in self.items
+        self.items[symbol] = token
+        self.items.move_to_end(symbol, last=False)
+        return is_new
+
+    def remove(self, symbol: str) -> Optional[str]:
+        return self.items.pop(symbol, None)
+
+    def move_to_front(self, symbol: str):
+        self.items.move_to_end(symbol, last=False)
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self.items
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def to_list(self) -> List[Dict]:
+        return [{"symbol": symbol, "token": token} for symbol, token in self.items.items()]
+
+
+class WatchlistStore:
+    """
+    Per-user watchlists persisted to a JSON file.
+    `tracked` is the union of all watchlists (what the snapshot producer and the feed
+    follow). It is maintained incrementally with reference counts per (symbol, token), and
+    listeners are told when a symbol starts or stops being tracked so feed subscriptions
+    follow along. When users hold different tokens for one symbol, the most recently tracked
+    one wins; several symbols may share one token.
+    """
+    DEFAULT_USER = "default"
+
+    def __init__(self, defaults: Dict[str, str], path: Optional[str] = None):
+        self.path = path or os.getenv("WATCHLIST_PATH", "watchlists.json")
+        self.defaults = defaults
+        self.watchlists: Dict[str, Watchlist] = {}
+        self.tracked: "OrderedDict[str, str]" = OrderedDict()
+        # (symbol, token) -> number of watchlists holding it
+        self._refcounts: Dict[Tuple[str, str], int] = {}
+        self.on_track: List[Callable[[str, str], None]] = []
+        self.on_untrack: List[Callable[[str, str], None]] = []
+        # Called after any watchlist edit (the ingest process publishes them to workers)
+        self.on_change: List[Callable[[], None]] = []
+        self.load()
+
+    # --- Persistence ----------------------------------------------------------
+
+    def load(self):
+        data = None
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Could not read watchlists from {self.path}: {e}")
+
+        if not data:
+            data = {self.DEFAULT_USER: [{"symbol": s, "token": t} for s, t in self.defaults.items()]}
+        self.replace(data, notify=False)
+
+    def replace(self, data: Dict[str, List[Dict]], notify: bool = True):
+        """
+        Swaps in watchlists in the `to_dict` format (from the file or the ingest process).
+        """
+        previous = dict(self.tracked)
+        self.watchlists = {}
+        self.tracked = OrderedDict()
+        self._refcounts = {}
+        for user, entries in data.items():
+            watchlist = Watchlist(OrderedDict((e["symbol"], e["token"]) for e in entries))
+            self.watchlists[user] = watchlist
+            for symbol, token in watchlist.items.items():
+                self._track(symbol, token, notify=False)
+
+        if notify:
+            for symbol, token in previous.items():
+                if self.tracked.get(symbol) != token:
+                    for listener in self.on_untrack:
+                        listener(symbol, token)
+            for symbol, token in self.tracked.items():
+                if previous.get(symbol) != token:
+                    for listener in self.on_track:
+                        listener(symbol, token)
+
+    def to_dict(self) -> Dict[str, List[Dict]]:
+        return {user: watchlist.to_list() for user, watchlist in self.watchlists.items()}
+
+    def _changed(self):
+        for listener in self.on_change:
+            listener()
+
+    def save(self):
+        """
+        Atomic write: a crash mid-save never leaves a truncated file behind.
+        """
+        data = self.to_dict()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    # --- Tracking -------------------------------------------------------------
+
+    def _notify(self, listeners, symbol: str, token: str):
+        for listener in listeners:
+            listener(symbol, token)
+
+    def _track(self, symbol: str, token: str, notify: bool = True):
+        count = self._refcounts.get((symbol, token), 0)
+        self._refcounts[(symbol, token)] = count + 1
+        if count > 0:
+            return
+        previous = self.tracked.get(symbol)
+        self.tracked[symbol] = token
+        if notify:
+            if previous is not None and previous != token:
+                self._notify(self.on_untrack, symbol, previous)
+            self._notify(self.on_track, symbol, token)
+
+    def _untrack(self, symbol: str, token: str):
+        count = self._refcounts.get((symbol, token), 0) - 1
+        if count > 0:
+            self._refcounts[(symbol, token)] = count
+            return
+        self._refcounts.pop((symbol, token), None)
+        if self.tracked.get(symbol) != token:
+            # Another token is tracked for this symbol
+            return
+        del self.tracked[symbol]
+        self._notify(self.on_untrack, symbol, token)
+        # Other watchlists may still hold an older token for the symbol
+        fallback = next((t for s, t in self._refcounts if s == symbol), None)
+        if fallback is not None:
+            self.tracked[symbol] = fallback
+            self._notify(self.on_track, symbol, fallback)
+
+    def _ensure(self, user: str) -> Watchlist:
+        """
+        The user's watchlist for an edit, registered (and tracked) on first use.
+        """
+        if user not in self.watchlists:
+            # New users start from the default list
+            base = self.watchlists.get(self.DEFAULT_USER)
+            self.watchlists[user] = Watchlist(base.items if base else self.defaults)
+            for symbol, token in self.watchlists[user].items.items():
+                self._track(symbol, token)
+            self._changed()
+        return self.watchlists[user]
+
+    # --- Public API -----------------------------------------------------------
+
+    def get(self, user: str = DEFAULT_USER) -> Watchlist:
+        """
+        Read-only view: unknown users see the default list, nothing is registered.
+        """
+        watchlist = self.watchlists.get(user)
+        if watchlist is None:
+            base = self.watchlists.get(self.DEFAULT_USER)
+            watchlist = Watchlist(base.items if base else self.defaults)
+        return watchlist
+
+    def add(self, symbol: str, token: str, user: str = DEFAULT_USER):
+        watchlist = self._ensure(user)
+        previous = watchlist.items.get(symbol)
+        if previous is not None and previous != token:
+            # Token changed: treat as remove + add so feed subscriptions stay correct
+            self.remove(symbol, user)
+        if watchlist.add(symbol, token):
+            self._track(symbol, token)
+        # Latest addition shows first in the shared snapshot too
+        if symbol in self.tracked:
+            self.tracked.move_to_end(symbol, last=False)
+        self._changed()
+
+    def remove(self, symbol: str, user: str = DEFAULT_USER) -> bool:
+        watchlist = self._ensure(user)
+        token = watchlist.remove(symbol)
+        if token is None:
+            return False
+        self._untrack(symbol, token)
+        self._changed()
+        return True
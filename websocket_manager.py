@@ -1,75 +1,181 @@
 from SmartApi.smartWebSocketV2 import SmartWebSocketV2
 from fastapi import WebSocket
-from typing import List
+from typing import Callable, Dict, List, Optional
 import json
+import os
+import time
 import asyncio
-from market import MarketAnalyzer
+from market import MarketAnalyzer, StreamingAnalyzer
+from quotes import BatchQuoteFetcher
+from volume_cache import VolumeCache
+from orderbook import OrderBookStore
+from instruments import instrument_index
+from upstream import upstream, PRIORITY_STREAM, PRIORITY_BACKGROUND
+from ws_client import ClientSession, diff_snapshots
+from watchlist import WatchlistStore
+from bars import bar_aggregator
+from tick_history import tick_history
+from recorder import RecordingApi, ReplayApi, ReplayFeed, recorder_from_env
+from metrics import Histogram
+from market_hours import market_calendar, PHASE_OPEN, PHASE_PRE_OPEN, PHASE_CLOSING, PHASE_CLOSED
+import threading
 
 class ConnectionManager:
     """
     Manages WebSocket connections with the Frontend and Angel One.
     """
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Dict[WebSocket, ClientSession] = {}
+        # Totals carried over from disconnected clients
+        self.dropped_frames = 0
+        self.conflated_frames = 0
         self.angel_socket = None
         self.angel_api = None
+        # Shared snapshot, computed once per tick by the producer and served to every client
+        self.latest_calculated_data: List[Dict] = []
+        # Changed fields per symbol in the latest tick, shared by all delta clients
+        self.latest_changes: List[Dict] = []
+        self.stream_interval = float(os.getenv("STREAM_INTERVAL", "1"))
+        # Slower polling around the continuous session; closed markets get a frozen snapshot
+        self.phase_intervals = {
+            PHASE_OPEN: self.stream_interval,
+            PHASE_PRE_OPEN: float(os.getenv("STREAM_INTERVAL_PRE_OPEN", "5")),
+            PHASE_CLOSING: float(os.getenv("STREAM_INTERVAL_CLOSING", "5")),
+        }
+        self.market_hours_aware = os.getenv("MARKET_HOURS_AWARE", "true").lower() == "true"
+        self._watchlist_changed = asyncio.Event()
+        self._producer_task: Optional[asyncio.Task] = None
+        # Producer cycle durations, exported on /metrics
+        self.cycle_seconds = Histogram()
+        # Called with (snapshot, changes) after every producer tick (the ingest process publishes them)
+        self.snapshot_listeners: List[Callable[[List[Dict], List[Dict]], None]] = []
+        # Bounded parallelism for per-ticker upstream fetches
+        self.fetch_concurrency = int(os.getenv("FETCH_CONCURRENCY", "8"))
+        self.fetch_timeout = float(os.getenv("FETCH_TIMEOUT", "3"))
+        self._fetch_semaphore: Optional[asyncio.Semaphore] = None
+        # Last good quote per ticker, reused when a fetch is slow or fails
+        self.last_quotes: Dict[str, Dict] = {}
+        # "batch" uses getMarketData (up to 50 tokens/request, real depth), "ltp" the per-symbol path
+        self.quote_mode = os.getenv("QUOTE_MODE", "batch").lower()
+        self.batch_fetcher = BatchQuoteFetcher(os.getenv("MARKET_DATA_MODE", "FULL"))
+        # Daily traded volume, cached until the next session's candle is available
+        self.volume_cache = VolumeCache()
+        self.volume_refresh_interval = float(os.getenv("VOLUME_REFRESH_INTERVAL", "60"))
+        self._api_ready = asyncio.Event()
+        self._volume_task: Optional[asyncio.Task] = None
+        # Push-based depth from SmartWebSocketV2, preferred over REST polling when fresh
+        self.order_books = OrderBookStore(float(os.getenv("FEED_MAX_AGE", "5")))
+        self.min_stream_interval = float(os.getenv("STREAM_MIN_INTERVAL", "0.2"))
+        self._feed_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._feed_thread: Optional[threading.Thread] = None
+        # Per-symbol EMA / order-flow imbalance / VWAP across ticks
+        self.streaming = StreamingAnalyzer()
+        # RECORD_FILE: append every upstream response and tick for later replay
+        self.recorder = recorder_from_env()
+        self.replay_feed: Optional[ReplayFeed] = None
+        # Per-user watchlists; their union is what the producer and the feed track
+        self.watchlists = WatchlistStore(self.DEFAULT_TOKEN_MAP)
+        self.watchlists.on_track.append(self._on_track)
+        self.watchlists.on_untrack.append(self._on_untrack)
+
+    @property
+    def token_map(self):
+        return self.watchlists.tracked
+
+    def _on_track(self, symbol, token):
+        try:
+            self.subscribe_tokens({symbol: token})
+        except Exception as e:
+            # Feed not connected (yet): on_open subscribes the whole watchlist
+            print(f"Feed subscribe failed for {symbol}: {e}")
+        self._watchlist_changed.set()
+
+    def _on_untrack(self, symbol, token):
+        # Another symbol name can still hold the token on the same exchange
+        exchange_type = self.exchange_type(symbol)
+        if not any(t == token and self.exchange_type(s) == exchange_type for s, t in self.token_map.items()):
+            try:
+                self.unsubscribe_tokens({symbol: token})
+            except Exception as e:
+                print(f"Feed unsubscribe failed for {symbol}: {e}")
+        self.last_quotes.pop(symbol, None)
+        self.streaming.forget(symbol)
+        tick_history.drop(symbol)
+        self._watchlist_changed.set()
+
+    @property
+    def replaying(self) -> bool:
+        return isinstance(self.angel_api, ReplayApi)
+
     def set_api_instance(self, api_instance):
+        if self.recorder and not isinstance(api_instance, ReplayApi):
+            api_instance = RecordingApi(api_instance, self.recorder)
         self.angel_api = api_instance
+        # Every SmartConnect call goes through the rate-limited scheduler
+        upstream.set_api(api_instance)
+        # Wakes the volume refresher so the cache is warmed right after login
+        self._api_ready.set()
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket) -> ClientSession:
         await websocket.accept()
-        self.active_connections.append(websocket)
+        session = ClientSession.from_query(websocket)
+        self.active_connections[websocket] = session
+        session.start_writer(lambda dead: self.disconnect(dead.websocket))
+        return session
+
+    async def send_snapshot(self, session: ClientSession):
+        """
+        Sends the client its current view of the latest snapshot (on connect / subscribe).
+        """
+        if not self.latest_calculated_data:
+            return
+        session.needs_snapshot = True
+        kind = session.frame_key(True)[0]
+        frame = session.build_frame(kind, self.latest_calculated_data, self.latest_changes)
+        if frame is not None:
+            session.offer(kind, frame, session.encode(frame))
+
+    async def fetch_volume(self, ticker, token, priority=PRIORITY_STREAM):
+        """
+        Daily traded volume for a token, from the session cache or a single candle request.
+        """
+        volume = self.volume_cache.get(token)
+        if volume is None:
+            params = VolumeCache.daily_candle_params(token, self.batch_fetcher.exchange_for(ticker))
+            candle_res = await upstream.call("getCandleData", params, priority=priority)
+            volume = VolumeCache.volume_from_response(candle_res)
+            if volume is not None:
+                self.volume_cache.put(token, volume)
+        return volume
 
     async def fetch_real_data(self, ticker, token):
         """
         Fetches Real LTP and Volume (Yesterday's Close) from Angel One.
-        Runs blocking API calls in a separate thread to avoid blocking the event loop.
+        Calls go through the upstream scheduler, which runs them off the event loop.
         """
         try:
-            # Helper function for blocking calls
-            def fetch_sync():
-                ltp_val = None
-                vol_val = 0
-                
-                try:
-                    # 1. Get LTP
-                    ltp_res = self.angel_api.ltpData("BSE", ticker.replace(".BSE", ""), token)
-                    if ltp_res and 'data' in ltp_res:
-                        ltp_val = ltp_res['data']['ltp']
-                    
-                    # 2. Get Volume (Latest available Candle)
-                    from datetime import datetime, timedelta
-                    today = datetime.now().strftime("%Y-%m-%d")
-                    five_days_ago = (datetime.now() - timedelta(days=5)).strftime("%Y-%m-%d")
-                    
-                    historicParam={
-                        "exchange": "BSE",
-                        "symboltoken": token,
-                        "interval": "ONE_DAY",
-                        "fromdate": f"{five_days_ago} 00:00", 
-                        "todate": f"{today} 23:59"
-                    }
-                    candle_res = self.angel_api.getCandleData(historicParam)
-                    if candle_res and candle_res['data']:
-                        # Get the last candle (latest date)
-                        last_candle = candle_res['data'][-1]
-                        # Input: [timestamp, open, high, low, close, volume]
-                        vol_val = last_candle[5]
-                except Exception as inner_e:
-                    print(f"API call error for {ticker}: {inner_e}")
-                    
-                return ltp_val, vol_val
-
-            # Run in thread pool
-            ltp, volume = await asyncio.to_thread(fetch_sync)
-            return ltp, volume
+            ltp_val = None
+            vol_val = 0
+
+            try:
+                # 1. Get LTP
+                ltp_res = await upstream.call("ltpData", "BSE", ticker.replace(".BSE", ""), token, priority=PRIORITY_STREAM)
+                if ltp_res and 'data' in ltp_res:
+                    ltp_val = ltp_res['data']['ltp']
+
+                # 2. Get Volume (Latest available Candle), cached per session
+                vol_val = await self.fetch_volume(ticker, token) or 0
+            except Exception as inner_e:
+                print(f"API call error for {ticker}: {inner_e}")
+
+            return ltp_val, vol_val
 
         except Exception as e:
             print(f"Error fetching real data for {ticker}: {e}")
             return None, None
 
-    # Token Map (Discovered via Script)
-    token_map = {
+    # Default watchlist, seeds the store on first start (Discovered via Script)
+    DEFAULT_TOKEN_MAP = {
         "RPOWER.BSE": "532939",
         "TCS.BSE": "532540",
         "HDFCBANK.BSE": "500180",
@@ -99,99 +205,430 @@ class ConnectionManager:
     }
 
     def get_token(self, symbol):
-        return self.token_map.get(symbol)
+        resolved = self.resolve_symbol(symbol)
+        return resolved[1] if resolved else None
 
-    async def mock_data_generator(self):
+    def resolve_symbol(self, symbol):
         """
-        HYBRID: Uses Real Data if available (via API), else Mock.
+        Resolves a symbol to (exchange, token): watchlist first, then the instrument master.
+        """
+        token = self.token_map.get(symbol)
+        if token:
+            return self.batch_fetcher.exchange_for(symbol), token
+        return instrument_index.resolve(symbol)
+
+    async def run_limited(self, coro, label):
+        """
+        Runs an upstream coroutine under the shared concurrency cap and a per-call timeout.
+        Returns None on timeout so a slow call never holds up the snapshot.
+        """
+        if self._fetch_semaphore is None:
+            self._fetch_semaphore = asyncio.Semaphore(self.fetch_concurrency)
+
+        async with self._fetch_semaphore:
+            try:
+                return await asyncio.wait_for(coro, self.fetch_timeout)
+            except asyncio.TimeoutError:
+                print(f"Fetch timed out for {label} after {self.fetch_timeout}s")
+                return None
+            except Exception as e:
+                print(f"Fetch failed for {label}: {e}")
+                return None
+
+    async def fetch_ticker_quote(self, ticker, token):
+        """
+        Per-symbol path (QUOTE_MODE=ltp): one ltpData + one getCandleData per ticker.
+        """
+        result = await self.run_limited(self.fetch_real_data(ticker, token), ticker)
+        if not result or result[0] is None:
+            return None
+        ltp, volume = result
+        # The volume comes from the daily candle cache, not a live figure
+        return {'ltp': ltp, 'tradedVolume': volume, 'depth': None, 'volumeCached': True}
+
+    async def fetch_batch_quotes(self, token_map):
+        """
+        Batch path (QUOTE_MODE=batch): one getMarketData request per chunk of up to 50 tokens,
+        chunks fetched concurrently. Returns {token: quote}.
+        """
+        chunks = self.batch_fetcher.build_chunks(token_map)
+        tasks = [
+            self.run_limited(
+                upstream.call("getMarketData", self.batch_fetcher.mode, chunk, priority=PRIORITY_STREAM),
+                f"chunk {i}"
+            )
+            for i, chunk in enumerate(chunks)
+        ]
+        responses = await asyncio.gather(*tasks)
+        return self.batch_fetcher.merge([self.batch_fetcher.parse_response(res) for res in responses if res])
+
+    async def fetch_quotes(self, token_map):
+        """
+        Returns {ticker: quote or None} for the whole watchlist.
+        """
+        quotes = {}
+        # Tokens with a fresh pushed order book need no REST call at all
+        for ticker, token in token_map.items():
+            book = self.order_books.get_fresh(self.exchange_type(ticker), token) if token else None
+            if book is not None:
+                quotes[ticker] = book
+        pending = {t: tok for t, tok in token_map.items() if t not in quotes}
+
+        if not self.angel_api or not pending:
+            quotes.update({ticker: None for ticker in pending})
+            return quotes
+
+        if self.quote_mode == "batch":
+            by_token = await self.fetch_batch_quotes(pending)
+            # Outside market hours tradeVolume is 0, fall back to the last session's volume
+            for token, quote in by_token.items():
+                if not quote.get('tradedVolume'):
+                    cached = self.volume_cache.get(token)
+                    if cached is not None:
+                        quote['tradedVolume'] = cached
+                        quote['volumeCached'] = True
+            quotes.update({ticker: by_token.get(token) for ticker, token in pending.items()})
+            return quotes
+
+        tickers = list(pending.keys())
+        results = await asyncio.gather(*[self.fetch_ticker_quote(t, pending[t]) for t in tickers])
+        quotes.update(zip(tickers, results))
+        return quotes
+
+    @staticmethod
+    def synthetic_depth(real_ltp, real_vol):
+        """
+        Simulated best-5 depth around the LTP, used when no real depth is available.
+        """
+        import random
+
+        # We create specific orders around the LTP to make it look realistic
+        spread = real_ltp * 0.001 # 0.1% spread
+        buy_price = real_ltp - spread
+        sell_price = real_ltp + spread
+
+        # Weighted quantity based on volume
+        avg_qty = int(real_vol / 500) if real_vol else 1000
+
+        return {
+            'buy': [{'quantity': random.randint(int(avg_qty*0.5), int(avg_qty*1.5)), 'price': buy_price} for _ in range(5)],
+            'sell': [{'quantity': random.randint(int(avg_qty*0.5), int(avg_qty*1.5)), 'price': sell_price} for _ in range(5)],
+        }
+
+    def build_analysis(self, ticker, quote):
+        """
+        Builds the analysis dict for a single ticker.
+        Marks the entry as stale when live data could not be fetched this cycle.
         """
         import random
-        
-        tickers = list(self.token_map.keys())
-        market_data = []
-
-        for ticker in tickers:
-            token = self.token_map.get(ticker)
-            real_ltp = None
-            real_vol = None
-            
-            if self.angel_api and token:
-                real_ltp, real_vol = await self.fetch_real_data(ticker, token)
-
-            # Fallback to Random if API fails or token unknown
-            if real_ltp is None:
-                real_ltp = random.uniform(100, 3000)
-            if real_vol is None:
-                real_vol = random.randint(10000, 5000000)
-
-            # Simulate Depth based on Real LTP
-            # We create specific orders around the LTP to make it look realistic
-            spread = real_ltp * 0.001 # 0.1% spread
-            buy_price = real_ltp - spread
-            sell_price = real_ltp + spread
-            
-            # Weighted quantity based on volume
-            avg_qty = int(real_vol / 500) if real_vol else 1000
-            
-            depth = {
-                'buy': [{'quantity': random.randint(int(avg_qty*0.5), int(avg_qty*1.5)), 'price': buy_price} for _ in range(5)],
-                'sell': [{'quantity': random.randint(int(avg_qty*0.5), int(avg_qty*1.5)), 'price': sell_price} for _ in range(5)],
-                'tradedVolume': real_vol
-            }
-            
-            analysis = MarketAnalyzer.calculate_strength(depth)
-            analysis['symbol'] = ticker
-            analysis['ltp'] = real_ltp # ADDED: Inject Real LTP for display
-            # Override with Real LTP for display if you want, but analysis uses depth
-            market_data.append(analysis)
-            
-        return market_data
+
+        stale = False
+        if self.angel_api and self.get_token(ticker):
+            if quote is None or quote.get('ltp') is None:
+                stale = True
+                # Prefer the last good quote over random values
+                quote = self.last_quotes.get(ticker)
+            else:
+                self.last_quotes[ticker] = quote
+
+        quote = quote or {}
+        real_ltp = quote.get('ltp')
+        real_vol = quote.get('tradedVolume')
+
+        # Fallback to Random if API fails or token unknown
+        if real_ltp is None:
+            real_ltp = random.uniform(100, 3000)
+        if real_vol is None:
+            real_vol = random.randint(10000, 5000000)
+
+        # Real best-5 depth from the batch quote when present, simulated otherwise
+        depth = dict(quote.get('depth') or self.synthetic_depth(real_ltp, real_vol))
+        depth['tradedVolume'] = real_vol
+
+        analysis = MarketAnalyzer.calculate_strength(depth)
+        analysis['symbol'] = ticker
+        analysis['ltp'] = real_ltp # ADDED: Inject Real LTP for display
+        analysis['stale'] = stale
+        # Stale ticks repeat old data, they must not move the running indicators; a cache-filled
+        # volume is a previous session's total and must not seed the VWAP baseline
+        live_volume = None if quote.get('volumeCached') else real_vol
+        self.streaming.update(ticker, depth, analysis, real_ltp, live_volume, apply=not stale)
+        return analysis
+
+    async def mock_data_generator(self, token_map=None):
+        """
+        HYBRID: Uses Real Data if available (via API), else Mock.
+        Quotes are fetched concurrently (capped by FETCH_CONCURRENCY), so a cycle takes
+        roughly as long as the slowest single call instead of the sum of all calls.
+        """
+        token_map = dict(self.token_map if token_map is None else token_map)
+        quotes = await self.fetch_quotes(token_map)
+
+        # Live intraday bars and tick history from the quotes we already have (no extra upstream calls)
+        now = time.time()
+        for ticker, quote in quotes.items():
+            if quote and quote.get('ltp') is not None:
+                # Cache-filled volumes (a previous session's total) must not become bar volume
+                live_volume = None if quote.get('volumeCached') else quote.get('tradedVolume')
+                bar_aggregator.on_tick(token_map[ticker], quote['ltp'], live_volume, now)
+                if quote.get('depth'):
+                    tick_history.record(ticker, now, quote['ltp'], quote.get('tradedVolume'), quote['depth'])
+
+        # Keep the watchlist order
+        return [self.build_analysis(ticker, quotes.get(ticker)) for ticker in token_map]
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        session = self.active_connections.pop(websocket, None)
+        if session is not None:
+            self.dropped_frames += session.dropped
+            self.conflated_frames += session.conflated
+            if not session.closed:
+                asyncio.ensure_future(session.close())
+
+    async def broadcast(self, snapshot: List[Dict], changes: Optional[List[Dict]] = None):
+        """
+        Queues each client only its subscribed symbols; never waits on a socket.
+        Clients wanting the same frame (kind, encoding, symbol set) share one build +
+        serialization per tick, and each client's writer task does the actual send.
+        """
+        if changes is None:
+            changes = snapshot
+        frames: Dict = {}
+        for session in list(self.active_connections.values()):
+            key = session.frame_key(bool(changes))
+            if key is None:
+                continue
+            if key not in frames:
+                frame = session.build_frame(key[0], snapshot, changes)
+                frames[key] = (frame, session.encode(frame)) if frame is not None else None
+            if frames[key] is not None:
+                session.offer(key[0], *frames[key])
+
+    def stream_stats(self) -> Dict:
+        """
+        Fan-out counters, including clients that already disconnected.
+        """
+        sessions = list(self.active_connections.values())
+        return {
+            "marketPhase": self.market_phase,
+            "activeConnections": len(sessions),
+            "queuedFrames": sum(len(s.queue) for s in sessions),
+            "maxQueueDepth": max((len(s.queue) for s in sessions), default=0),
+            "droppedFrames": self.dropped_frames + sum(s.dropped for s in sessions),
+            "conflatedFrames": self.conflated_frames + sum(s.conflated for s in sessions)
+        }
+
+    async def produce_snapshot(self, frozen: bool = False) -> List[Dict]:
+        """
+        One producer tick: computes the snapshot, diffs it against the previous one and fans it out.
+        `frozen` (market closed): entries already in the snapshot are kept as they are and
+        only symbols added since are fetched.
+        """
+        previous = {entry['symbol']: entry for entry in self.latest_calculated_data}
+        if frozen and previous:
+            token_map = dict(self.token_map)
+            missing = {t: tok for t, tok in token_map.items() if t not in previous}
+            fresh = {e['symbol']: e for e in await self.mock_data_generator(missing)} if missing else {}
+            snapshot = [previous.get(t) or fresh[t] for t in token_map if t in previous or t in fresh]
+        else:
+            snapshot = await self.mock_data_generator()
+        self.latest_changes = diff_snapshots(previous, snapshot)
+        self.latest_calculated_data = snapshot
+        await self.broadcast(snapshot, self.latest_changes)
+        for listener in self.snapshot_listeners:
+            listener(snapshot, self.latest_changes)
+        return snapshot
+
+    async def apply_snapshot(self, snapshot: List[Dict]):
+        """
+        Worker processes: takes a snapshot computed by the ingest process and fans it out locally.
+        Deltas are diffed against the last snapshot applied here, so a snapshot the ingest
+        process skipped for this worker only delays changes, it never loses them.
+        """
+        previous = {entry['symbol']: entry for entry in self.latest_calculated_data}
+        self.latest_changes = diff_snapshots(previous, snapshot)
+        self.latest_calculated_data = snapshot
+        await self.broadcast(snapshot, self.latest_changes)
+
+    @property
+    def market_phase(self) -> str:
+        # Replays run at full rate whatever the wall clock says
+        if not self.market_hours_aware or self.replaying:
+            return PHASE_OPEN
+        return market_calendar.phase()
+
+    async def run_producer(self):
+        """
+        Single background producer: computes the snapshot once per tick, stores it as
+        `latest_calculated_data` and fans it out to all /ws clients.
+        Upstream calls per tick stay the same no matter how many clients are connected.
+        Follows the BSE session: full rate while open, slower in pre-open / closing, and
+        a frozen closing snapshot (no upstream calls) while the market is closed.
+        """
+        while True:
+            started = time.monotonic()
+            phase = self.market_phase
+            self._watchlist_changed.clear()
+            try:
+                await self.produce_snapshot(frozen=phase == PHASE_CLOSED)
+            except Exception as e:
+                print(f"Snapshot producer error: {e}")
+            self.cycle_seconds.observe(time.monotonic() - started)
+
+            if phase == PHASE_CLOSED:
+                # Nothing changes until the next session; wake early only for watchlist edits
+                until_change = (market_calendar.next_phase_change() - market_calendar.now()).total_seconds()
+                try:
+                    await asyncio.wait_for(self._watchlist_changed.wait(), max(1.0, until_change))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Never faster than STREAM_MIN_INTERVAL, then wait for a pushed tick or the regular interval
+            elapsed = time.monotonic() - started
+            await asyncio.sleep(max(0.0, self.min_stream_interval - elapsed))
+            remaining = self.phase_intervals.get(phase, self.stream_interval) - (time.monotonic() - started)
+            if remaining > 0:
+                try:
+                    await asyncio.wait_for(self.order_books.changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            self.order_books.changed.clear()
+
+    async def refresh_volumes(self):
+        """
+        Fetches daily volume for every watched token that is missing or expired in the cache.
+        """
+        # Not under the stream's semaphore: the scheduler rate-limits these at background priority
+        async def refresh(ticker, token):
+            try:
+                await self.fetch_volume(ticker, token, PRIORITY_BACKGROUND)
+            except Exception as e:
+                print(f"Volume refresh failed for {ticker}: {e}")
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            await connection.send_json(message)
+        pending = [(t, tok) for t, tok in dict(self.token_map).items() if tok and self.volume_cache.needs_refresh(tok)]
+        await asyncio.gather(*[refresh(t, tok) for t, tok in pending])
+
+    async def run_volume_refresher(self):
+        """
+        Background loop: warms the volume cache for the whole watchlist as soon as the API
+        is available, then re-checks periodically for expired entries and new symbols.
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self._api_ready.wait(), self.volume_refresh_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._api_ready.clear()
+
+            if self.angel_api:
+                try:
+                    await self.refresh_volumes()
+                except Exception as e:
+                    print(f"Volume refresh error: {e}")
+
+    async def warm_up(self):
+        """
+        Startup: fills the volume cache and computes the first snapshot (the closing snapshot
+        when the market is closed), so the first client after a restart is served from warm caches.
+        """
+        if self.angel_api:
+            try:
+                await self.refresh_volumes()
+            except Exception as e:
+                print(f"Volume warm-up failed: {e}")
+        await self.produce_snapshot(frozen=self.market_phase == PHASE_CLOSED)
+
+    def start_producer(self):
+        """
+        Starts the producer task once. Must be called from a running event loop (app startup).
+        """
+        if self._producer_task is None or self._producer_task.done():
+            self._producer_task = asyncio.create_task(self.run_producer())
+        if self._volume_task is None or self._volume_task.done():
+            self._volume_task = asyncio.create_task(self.run_volume_refresher())
+
+    # SmartWebSocketV2 subscription constants
+    SNAP_QUOTE_MODE = 3
+    EXCHANGE_TYPES = {"NSE": 1, "BSE": 3}
+
+    def exchange_type(self, symbol: str) -> int:
+        return self.EXCHANGE_TYPES[self.batch_fetcher.exchange_for(symbol)]
+
+    def build_token_list(self, token_map):
+        """
+        Groups tokens by exchange type in the shape SmartWebSocketV2.subscribe expects.
+        """
+        grouped: Dict[int, List[str]] = {}
+        for symbol, token in token_map.items():
+            if token:
+                grouped.setdefault(self.exchange_type(symbol), []).append(token)
+        return [{"exchangeType": ex, "tokens": tokens} for ex, tokens in grouped.items()]
+
+    def subscribe_tokens(self, token_map):
+        if self.angel_socket and token_map:
+            self.angel_socket.subscribe("depth", self.SNAP_QUOTE_MODE, self.build_token_list(token_map))
+
+    def unsubscribe_tokens(self, token_map):
+        for symbol, token in token_map.items():
+            self.order_books.discard(self.exchange_type(symbol), token)
+        if self.angel_socket and token_map:
+            self.angel_socket.unsubscribe("depth", self.SNAP_QUOTE_MODE, self.build_token_list(token_map))
 
     def start_angel_socket(self, auth_token, api_key, client_code, feed_token):
         """
-        Initializes Angel One WebSocket.
+        Initializes Angel One WebSocket and subscribes the watchlist in SNAP_QUOTE (best-5 depth) mode.
+        Must be called from the event loop: ticks arrive on the SDK thread and are handed
+        over to this loop through OrderBookStore.publish_threadsafe.
         """
+        self._feed_loop = asyncio.get_running_loop()
+        if self.angel_socket:
+            try:
+                self.angel_socket.close_connection()
+            except Exception as e:
+                print(f"Error closing previous Angel One WebSocket: {e}")
+
         self.angel_socket = SmartWebSocketV2(auth_token, api_key, client_code, feed_token)
-        
+
         def on_data(wsapp, msg):
-            # Process incoming tick data
-            # Note: The actual processing depends on the message structure from Angel One
-            # We assume we subscribed to SNAPQUOTE or DEPTH to get buy/sell quantities
-            
-            # For this example, we parse the message and use MarketAnalyzer
-            # Since real parsing is complex without live docs, we'll assume 'msg' 
-            # contains 'best_5_buy_data' and 'best_5_sell_data' if subscribed to depth.
-            
-            # This is a PLACEHOLDER for the callback logic to bridge the gap.
-            # In production, specific byte-parsing or JSON parsing from the SDK is needed.
-            
-            # If the SDK returns a python dict directly:
+            # The SDK delivers parsed binary ticks as dicts
             if isinstance(msg, dict):
-                 # Transform to format expected by MarketAnalyzer
-                 # This mapping is crucial and depends on exact SDK response format
-                 pass
+                if self.recorder:
+                    self.recorder.record_tick(msg)
+                self.order_books.publish_threadsafe(self._feed_loop, msg)
 
         def on_open(wsapp):
             print("Angel One WebSocket Connected")
-            # Subscribe to Nifty 50 or specific tokens
-            # mode: 2 for FULL depth (Best 5) is required for our logic
-            # exchange_type: 1 (NSE), 3 (BSE)
-            # tokens: ["500325"] # Example BSE Token (RPOWER)
-            
-            # self.angel_socket.subscribe(correlation_id="abc", mode=2, token_list=[{"exchangeType": 3, "tokens": ["500325"]}])
-            pass
+            self.subscribe_tokens(dict(self.token_map))
+
+        def on_error(wsapp, error):
+            print(f"Angel One WebSocket Error: {error}")
+
+        def on_close(wsapp):
+            print("Angel One WebSocket Closed")
 
         self.angel_socket.on_data = on_data
         self.angel_socket.on_open = on_open
-        self.angel_socket.connect()
-        
+        self.angel_socket.on_error = on_error
+        self.angel_socket.on_close = on_close
+
+        # connect() blocks for the lifetime of the socket
+        self._feed_thread = threading.Thread(target=self.angel_socket.connect, name="angel-feed", daemon=True)
+        self._feed_thread.start()
+
+    def start_replay(self, path, speed=1.0, loop=False):
+        """
+        Offline mode: serves recorded upstream responses and replays recorded ticks
+        in place of set_api_instance(SmartConnect) / start_angel_socket.
+        Must be called from the event loop.
+        """
+        self._feed_loop = asyncio.get_running_loop()
+        self.set_api_instance(ReplayApi(path, speed))
+        self.replay_feed = ReplayFeed(
+            path, lambda msg: self.order_books.publish_threadsafe(self._feed_loop, msg), speed, loop
+        )
+        self.replay_feed.start()
+        print(f"Replaying {path} at {'max' if speed <= 0 else f'{speed}x'} speed")
 
 
 socket_manager = ConnectionManager()
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import os
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Set
+from fastapi import WebSocket
+
+try:
+    import msgpack
+except ImportError:  # optional, clients fall back to JSON
+    msgpack = None
+
+
+class ClientSession:
+    """
+    State of one /ws client: which symbols it watches, whether it wants full
+    frames or deltas, and the wire encoding.
+
+    Protocol (client -> server, JSON text):
+        {"action": "subscribe", "symbols": ["TCS.BSE", ...]}
+        {"action": "unsubscribe", "symbols": [...]}
+        {"action": "mode", "mode": "full" | "delta", "encoding": "json" | "msgpack"}
+    The same options can be given as query parameters: /ws?symbols=A,B&mode=delta&encoding=msgpack
+
+    Frames (server -> client):
+        full mode:  the list of analyses, as before (filtered by subscription)
+        delta mode: {"type": "snapshot", "data": [...]} once per newly subscribed symbol set,
+                    then {"type": "delta", "data": [{"symbol": ..., <changed fields>}, ...]};
+                    a symbol that left the watchlist comes as {"symbol": ..., "removed": true}
+        invalid messages: {"type": "error", "message": ...}, the connection stays open
+
+    Outbound frames go through a bounded per-client queue drained by the client's own
+    writer task, so a slow client never delays the others. When the queue is full the
+    pending frames are conflated into one (latest state per symbol); a send that stays
+    stuck longer than CLIENT_SEND_TIMEOUT disconnects the client.
+    """
+    MODES = ("full", "delta")
+    ENCODINGS = ("json", "msgpack")
+    QUEUE_SIZE = int(os.getenv("CLIENT_QUEUE_SIZE", "8"))
+    SEND_TIMEOUT = float(os.getenv("CLIENT_SEND_TIMEOUT", "10"))
+
+    def __init__(self, websocket: WebSocket, symbols: Optional[Iterable[str]] = None, mode: str = "full", encoding: str = "json"):
+        self.websocket = websocket
+        # None means "every watched symbol"
+        self.symbols: Optional[Set[str]] = set(symbols) if symbols else None
+        self.mode = mode if mode in self.MODES else "full"
+        self.encoding = encoding if encoding in self.ENCODINGS and (encoding != "msgpack" or msgpack) else "json"
+        # Symbols that still need a full entry before deltas make sense
+        self.needs_snapshot = True
+        # Pending (kind, frame, payload) items, oldest first
+        self.queue = deque()
+        self._ready = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.conflated = 0
+
+    @classmethod
+    def from_query(cls, websocket: WebSocket) -> "ClientSession":
+        params = websocket.query_params
+        symbols = [s for s in params.get("symbols", "").split(",") if s]
+        return cls(websocket, symbols or None, params.get("mode", "full"), params.get("encoding", "json"))
+
+    @property
+    def symbols_key(self):
+        return frozenset(self.symbols) if self.symbols is not None else None
+
+    def handle_message(self, text: str) -> bool:
+        """
+        Applies a protocol message. Returns True if the client needs a fresh snapshot.
+        """
+        try:
+            msg = json.loads(text)
+        except ValueError:
+            return False
+        if not isinstance(msg, dict):
+            return False
+
+        action = msg.get("action")
+        symbols = msg.get("symbols", [])
+        if action in ("subscribe", "unsubscribe") and (
+                not isinstance(symbols, list) or not all(isinstance(s, str) for s in symbols)):
+            self.error("symbols must be a list of strings")
+            return False
+        if action == "subscribe":
+            self.symbols = (self.symbols or set()) | set(symbols)
+            self.needs_snapshot = True
+        elif action == "unsubscribe":
+            if self.symbols is not None:
+                self.symbols -= set(symbols)
+        elif action == "mode":
+            if msg.get("mode") in self.MODES:
+                self.mode = msg["mode"]
+            if msg.get("encoding") in self.ENCODINGS and (msg["encoding"] != "msgpack" or msgpack):
+                self.encoding = msg["encoding"]
+            self.needs_snapshot = True
+        return self.needs_snapshot
+
+    def select(self, entries: List[Dict]) -> List[Dict]:
+        if self.symbols is None:
+            return entries
+        return [entry for entry in entries if entry.get("symbol") in self.symbols]
+
+    def frame_key(self, has_changes: bool):
+        """
+        Identifies the frame this client needs, so identical frames are built and
+        encoded only once per tick. None means nothing to send.
+        """
+        if self.mode == "full" or self.needs_snapshot:
+            kind = "full" if self.mode == "full" else "snapshot"
+        elif has_changes:
+            kind = "delta"
+        else:
+            return None
+        return (kind, self.encoding, self.symbols_key)
+
+    def build_frame(self, kind: str, snapshot: List[Dict], changes: List[Dict]):
+        if kind == "full":
+            return self.select(snapshot)
+        if kind == "snapshot":
+            return {"type": "snapshot", "data": self.select(snapshot)}
+        data = self.select(changes)
+        return {"type": "delta", "data": data} if data else None
+
+    def error(self, message: str):
+        frame = {"type": "error", "message": message}
+        self.offer("error", frame, self.encode(frame))
+
+    def encode(self, frame):
+        if self.encoding == "msgpack":
+            return msgpack.packb(frame, use_bin_type=True)
+        return json.dumps(frame)
+
+    # --- Outbound queue -------------------------------------------------------
+
+    def offer(self, kind: str, frame, payload):
+        """
+        Non-blocking enqueue. When the queue is full, all pending frames are merged
+        into one carrying the latest state per symbol.
+        """
+        if self.closed:
+            return
+        if kind in ("full", "snapshot"):
+            self.needs_snapshot = False
+        self.queue.append((kind, frame, payload))
+        if len(self.queue) > self.QUEUE_SIZE:
+            self.dropped += len(self.queue) - 1
+            self.conflated += 1
+            kind, frame = conflate([(k, f) for k, f, _ in self.queue])
+            self.queue.clear()
+            if kind is not None:
+                self.queue.append((kind, frame, self.encode(frame)))
+        self._ready.set()
+
+    def start_writer(self, on_dead: Callable[["ClientSession"], None]):
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_loop(on_dead))
+
+    async def _write_loop(self, on_dead: Callable[["ClientSession"], None]):
+        try:
+            while True:
+                while not self.queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                _, _, payload = self.queue.popleft()
+                await asyncio.wait_for(self._send(payload), self.SEND_TIMEOUT)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            print(f"WebSocket client stuck for {self.SEND_TIMEOUT}s, disconnecting")
+            await self.close()
+            on_dead(self)
+        except Exception as e:
+            print(f"Dropping WebSocket client: {e}")
+            await self.close()
+            on_dead(self)
+
+    async def _send(self, payload):
+        if isinstance(payload, bytes):
+            await self.websocket.send_bytes(payload)
+        else:
+            await self.websocket.send_text(payload)
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.dropped += len(self.queue)
+        self.queue.clear()
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
+
+def conflate(frames: List) -> tuple:
+    """
+    Merges queued (kind, frame) items, oldest first, into a single frame with the
+    latest state per symbol. A full/snapshot frame resets the state, deltas update it.
+    Error frames are dropped; (None, None) when nothing else was queued.
+    """
+    kind = None
+    entries: Dict[str, Dict] = {}
+    for frame_kind, frame in frames:
+        if frame_kind in ("full", "snapshot"):
+            kind = frame_kind
+            data = frame if frame_kind == "full" else frame["data"]
+            entries = {entry["symbol"]: dict(entry) for entry in data if not entry.get("removed")}
+        elif frame_kind == "delta":
+            kind = kind or "delta"
+            for entry in frame["data"]:
+                symbol = entry["symbol"]
+                if entry.get("removed") and kind != "delta":
+                    # The state is complete, so the symbol simply leaves it
+                    entries.pop(symbol, None)
+                elif entry.get("removed") or entries.get(symbol, {}).get("removed"):
+                    # Removals replace pending updates, a re-added symbol comes whole
+                    entries[symbol] = dict(entry)
+                else:
+                    entries.setdefault(symbol, {}).update(entry)
+
+    if kind is None:
+        return None, None
+    data = list(entries.values())
+    if kind == "full":
+        return kind, data
+    return kind, {"type": kind, "data": data}
+
+
+def diff_snapshots(previous: Dict[str, Dict], current: List[Dict]) -> List[Dict]:
+    """
+    Per-symbol changed fields between two snapshots. New symbols are sent whole, and
+    symbols that are gone as {"symbol": ..., "removed": True}.
+    Computed once per tick and shared by every delta client.
+    """
+    changes = []
+    seen = set()
+    for entry in current:
+        symbol = entry.get("symbol")
+        seen.add(symbol)
+        before = previous.get(symbol)
+        if before is None:
+            changes.append(entry)
+            continue
+        changed = {key: value for key, value in entry.items() if before.get(key) != value}
+        if changed:
+            changed["symbol"] = symbol
+            changes.append(changed)
+    if len(seen) != len(previous):
+        changes.extend({"symbol": symbol, "removed": True} for symbol in previous if symbol not in seen)
+    return changes